@@ -0,0 +1,496 @@
+import argparse
+import logging
+import multiprocessing
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+from types import SimpleNamespace
+from typing import List
+
+import numpy as np
+import talib
+
+THIS_DIR = Path(__file__).resolve().parent
+if str(THIS_DIR) not in sys.path:
+    sys.path.insert(0, str(THIS_DIR))
+
+from mode_common import build_symbol
+from kuegi_bot.backtest_engine import BackTest
+from kuegi_bot.bots.MultiStrategyBot import MultiStrategyBot, Strategy
+from kuegi_bot.bots.strategies.SfpStrat import SfpStrategy
+from kuegi_bot.bots.strategies.kuegi_strat import KuegiStrategy
+from kuegi_bot.bots.strategies.trend_indicator_engine import Streaming4hIndicators
+from kuegi_bot.indicators.kuegi_channel import KuegiChannel
+from kuegi_bot.indicators.streaming import StreamingADX, StreamingATR, StreamingEMA, StreamingRSI
+from kuegi_bot.indicators.swings import Swings
+from kuegi_bot.utils.bar_array import BarArray
+from kuegi_bot.utils.shared_bars import SharedBarDataset
+from kuegi_bot.utils.trading_classes import Bar, BarWindow, PositionStatus, process_low_tf_bars
+
+# midnight utc, so the synthetic history starts on a funding hour and a full day
+START_TSTAMP = 1600000000 // 86400 * 86400
+
+
+def _logger():
+    logger = logging.getLogger("component_parity")
+    logger.setLevel(logging.WARNING)
+    return logger
+
+
+def _m1_bars(days: int, seed: int = 1) -> List[Bar]:
+    ''' random walk M1 bars with buy/sell volume, newest bar = index 0 like load_bars returns them '''
+    rng = np.random.default_rng(seed)
+    n = days * 1440
+    tstamp = (START_TSTAMP + 60 * np.arange(n)).tolist()
+    close = 20000 * np.exp(np.cumsum(rng.normal(0, 0.0008, n)))
+    open_ = np.concatenate(([close[0]], close[:-1]))
+    spread = np.abs(rng.normal(0, 0.0005, n)) * close
+    high = (np.maximum(open_, close) + spread).tolist()
+    low = (np.minimum(open_, close) - spread).tolist()
+    buy = rng.uniform(0, 5, n).tolist()
+    sell = rng.uniform(0, 5, n).tolist()
+    close = close.tolist()
+    open_ = open_.tolist()
+    result = []
+    for i in range(n - 1, -1, -1):
+        bar = Bar(tstamp=tstamp[i], open=open_[i], high=high[i], low=low[i], close=close[i],
+                  volume=buy[i] + sell[i], subbars=[])
+        bar.buyVolume = buy[i]
+        bar.sellVolume = sell[i]
+        result.append(bar)
+    return result
+
+
+def _channel_bot() -> MultiStrategyBot:
+    bot = MultiStrategyBot(logger=_logger(), directionFilter=0)
+    bot.add_strategy(KuegiStrategy().withChannel(15, 0.9, 0.05, 2, 3).withRM(1, 0, 0, 0))
+    bot.add_strategy(SfpStrategy().withChannel(15, 0.9, 0.05, 2, 3).withRM(1, 0, 0, 0))
+    return bot
+
+
+def _run_fingerprint(backtest: BackTest) -> tuple:
+    trades = [(pos.entry_tstamp, pos.exit_tstamp, pos.filled_entry, pos.filled_exit, pos.max_filled_amount)
+              for pos in backtest.bot.position_history if pos.status == PositionStatus.CLOSED]
+    return backtest.account.equity, backtest.maxDD, backtest.maxExposure, trades
+
+
+# --- bar window --------------------------------------------------------------------------------------------------
+
+class _FullScanChannel(KuegiChannel):
+    ''' on_tick before it stopped at the first unchanged bar '''
+
+    def on_tick(self, bars: List[Bar]):
+        for idx in range(len(bars) - self.max_look_back, -1, -1):
+            if bars[idx].did_change:
+                self.process_bar(bars[idx:])
+
+
+class _FullScanSwings(Swings):
+    ''' on_tick before it stopped at the first unchanged bar '''
+
+    def on_tick(self, bars: List[Bar]):
+        for idx in range(len(bars) - self.before - self.after - 2, -1, -1):
+            if bars[idx].did_change:
+                self.process_bar(bars[idx:])
+
+
+class _IndicatorProbe(Strategy):
+    ''' runs the indicators on every tick of a backtest, no trades '''
+
+    def __init__(self, indicators: list):
+        super().__init__()
+        self.indicators = indicators
+
+    def myId(self):
+        return "probe"
+
+    def got_data_for_position_sync(self, bars: List[Bar]) -> bool:
+        return True
+
+    def prep_bars(self, is_new_bar: bool, bars: list):
+        for indicator in self.indicators:
+            indicator.on_tick(bars)
+
+
+def _indicator_run(indicators: list, days: int) -> BackTest:
+    bot = MultiStrategyBot(logger=_logger(), directionFilter=0)
+    bot.add_strategy(_IndicatorProbe(indicators))
+    return BackTest(bot, bars=process_low_tf_bars(_m1_bars(days), 240), symbol=build_symbol("BTCUSD")).run()
+
+
+def check_bar_window() -> List[str]:
+    ''' BarWindow against list slicing, the window of BackTest against slice + insert of the forming bar and the
+    indicators that stop at the first unchanged bar against the full scan '''
+    errors = []
+    bars = process_low_tf_bars(_m1_bars(10), 60)
+    for start, stop in ((0, None), (3, None), (5, 40), (7, 7)):
+        window = BarWindow(bars, start=start, stop=stop)
+        expected = bars[start:stop]
+        if len(window) != len(expected) or list(window) != expected or list(reversed(window)) != expected[::-1]:
+            errors.append("BarWindow(%s, %s): len/iteration differs from the list slice" % (start, stop))
+        for idx in (0, 1, 5, -1, -2):
+            if -len(expected) <= idx < len(expected) and window[idx] is not expected[idx]:
+                errors.append("BarWindow(%s, %s)[%i] differs from the list slice" % (start, stop, idx))
+        for sub_start, sub_stop in ((1, None), (0, 5), (-3, None), (2, -2), (4, 1)):
+            if list(window[sub_start:sub_stop]) != expected[sub_start:sub_stop]:
+                errors.append("BarWindow(%s, %s)[%s:%s] differs from the list slice"
+                              % (start, stop, sub_start, sub_stop))
+
+    bot = MultiStrategyBot(logger=_logger(), directionFilter=0)
+    bot.add_strategy(_IndicatorProbe([]))
+    backtest = BackTest(bot, bars=bars, symbol=build_symbol("BTCUSD"))
+    for i in range(len(bars) - 1):
+        window = backtest._window_for(i)
+        forming = window[0]
+        if window[1:] != bars[-(i + 1):] or forming.tstamp != bars[-i - 2].tstamp \
+                or (forming.open, forming.high, forming.low, forming.close) != (bars[-i - 2].open,) * 4 \
+                or forming.volume != 0 or len(forming.subbars) != 0:
+            errors.append("_window_for(%i) differs from slice + insert of the forming bar" % i)
+            break
+
+    days = 30
+    streaming = _indicator_run([KuegiChannel(), Swings()], days)
+    full_scan = _indicator_run([_FullScanChannel(), _FullScanSwings()], days)
+    for name, indicator, reference in (("KuegiChannel", KuegiChannel(), _FullScanChannel()),
+                                       ("Swings", Swings(), _FullScanSwings())):
+        with_data = 0
+        for bar, ref_bar in zip(streaming.bars, full_scan.bars):
+            data = indicator.get_data(bar)
+            ref_data = reference.get_data(ref_bar)
+            if (data is None) != (ref_data is None) or (data is not None and vars(data) != vars(ref_data)):
+                errors.append("%s data of bar %i differs from the full scan" % (name, bar.tstamp))
+                break
+            with_data += data is not None
+        if with_data == 0:
+            errors.append("%s wrote no data" % name)
+    return errors
+
+
+# --- bar array ---------------------------------------------------------------------------------------------------
+
+BAR_FIELDS = ("tstamp", "open", "high", "low", "close", "volume", "buyVolume", "sellVolume", "last_tick_tstamp")
+
+
+def _bar_diff(bar, ref: Bar) -> str:
+    for field in BAR_FIELDS:
+        if getattr(bar, field) != getattr(ref, field):
+            return "%s %r != %r" % (field, getattr(bar, field), getattr(ref, field))
+    return None
+
+
+def check_bar_array() -> List[str]:
+    ''' BarArray.aggregate against process_low_tf_bars on Bar lists, its accessors and a backtest on both stores '''
+    errors = []
+    for timeframe, offset in ((5, 0), (60, 0), (240, 0), (240, 60), (1440, 0)):
+        expected = process_low_tf_bars(_m1_bars(3), timeframe, offset)
+        array = BarArray.from_bars(_m1_bars(3)).aggregate(timeframe, offset)
+        materialized = array.to_bars()
+        name = "tf %i offset %i" % (timeframe, offset)
+        if len(materialized) != len(expected) or len(array) != len(expected):
+            errors.append("%s: %i bars instead of %i" % (name, len(materialized), len(expected)))
+            continue
+        for idx, (bar, ref) in enumerate(zip(materialized, expected)):
+            diff = _bar_diff(bar, ref) or _bar_diff(array[idx], ref)
+            if diff is None and [sub.tstamp for sub in bar.subbars] != [sub.tstamp for sub in ref.subbars]:
+                diff = "subbars"
+            for sub, ref_sub in zip(bar.subbars, ref.subbars):
+                if diff is not None:
+                    break
+                diff = _bar_diff(sub, ref_sub)
+            if diff is not None:
+                errors.append("%s: bar %i differs from process_low_tf_bars: %s" % (name, ref.tstamp, diff))
+                break
+
+    days = 60
+    from_list = BackTest(_channel_bot(), bars=process_low_tf_bars(_m1_bars(days), 240),
+                         symbol=build_symbol("BTCUSD")).run()
+    from_array = BackTest(_channel_bot(), bars=BarArray.from_bars(_m1_bars(days)).aggregate(240),
+                          symbol=build_symbol("BTCUSD")).run()
+    if len(from_list.bot.position_history) == 0:
+        errors.append("backtest on the Bar list made no trades")
+    if _run_fingerprint(from_array) != _run_fingerprint(from_list):
+        errors.append("backtest on the BarArray differs from the one on the Bar list")
+    return errors
+
+
+# --- shared bars -------------------------------------------------------------------------------------------------
+
+def _dataset_content(bars: BarArray, funding: dict, open_interest: dict) -> tuple:
+    columns = tuple(getattr(bars, col).tolist() for col in BarArray.COLUMNS)
+    sub_columns = tuple(getattr(bars.subbars, col).tolist() for col in BarArray.COLUMNS)
+    return columns, sub_columns, bars.sub_offset.tolist(), bars.sub_length.tolist(), funding, open_interest
+
+
+def _attached_content(descriptor: dict) -> tuple:
+    # runs in a spawned worker like _parallel_eval_trial of the optimizer
+    dataset = SharedBarDataset.attach(descriptor)
+    try:
+        return _dataset_content(dataset.bar_array(), dataset.funding(), dataset.open_interest())
+    finally:
+        dataset.close()
+
+
+def check_shared_bars() -> List[str]:
+    ''' bars, funding and open interest attached from the shared block (in this process and in a spawned worker)
+    against the data the worker loaded itself before, and a backtest on the attached bars '''
+    errors = []
+    days = 30
+    bars = BarArray.from_bars(_m1_bars(days)).aggregate(240)
+    funding = {int(t): 0.0001 * ((t // 3600) % 3 - 1) for t in bars.tstamp.tolist() if (t // 3600) % 8 == 0}
+    open_interest = {int(t): 1e6 + idx for idx, t in enumerate(bars.tstamp.tolist())}
+    expected = _dataset_content(bars, funding, open_interest)
+
+    dataset = SharedBarDataset.publish(bars, funding, open_interest)
+    try:
+        attached = SharedBarDataset.attach(dataset.descriptor())
+        if _dataset_content(attached.bar_array(), attached.funding(), attached.open_interest()) != expected:
+            errors.append("attached dataset differs from the published data")
+        if attached.bar_array().close.flags.writeable:
+            errors.append("attached columns are writeable")
+        from_shared = BackTest(_channel_bot(), bars=attached.bar_array(), funding=attached.funding(),
+                               symbol=build_symbol("BTCUSD")).run()
+        from_own = BackTest(_channel_bot(), bars=BarArray.from_bars(_m1_bars(days)).aggregate(240), funding=funding,
+                            symbol=build_symbol("BTCUSD")).run()
+        if _run_fingerprint(from_shared) != _run_fingerprint(from_own):
+            errors.append("backtest on the attached bars differs from the one on freshly built bars")
+        attached.close()
+
+        with multiprocessing.get_context("spawn").Pool(2) as pool:
+            for result in pool.map(_attached_content, [dataset.descriptor()] * 2):
+                if result != expected:
+                    errors.append("dataset attached in a spawned worker differs from the published data")
+        try:
+            SharedBarDataset.attach(dataset.descriptor()).close()
+        except FileNotFoundError:
+            errors.append("shared block got removed when the workers exited")
+    finally:
+        dataset.close()
+    return errors
+
+
+# --- plot series -------------------------------------------------------------------------------------------------
+
+SERIES = ("equity_vec", "wallet_equity_vec", "unrealized_equity_vec", "total_equity_vec", "hh_vec", "ll_vec",
+          "dd_vec", "maxDD_vec")
+
+
+class _ListSeriesBackTest(BackTest):
+    ''' also records the plot series in python lists, the way write_plot_data did before the numpy arrays '''
+
+    def reset(self):
+        self.list_series = {name: [] for name in SERIES}
+        self.list_max_dd_pct = []
+        super().reset()
+
+    def write_plot_data(self):
+        super().write_plot_data()
+        series = self.list_series
+        avgEntry = self.account.open_position.avgEntryPrice
+        if avgEntry != 0:
+            unrealized_equity = self.account.open_position.quantity * (
+                (self.current_bars[0].close - avgEntry) if not self.symbol.isInverse else (
+                        -1 / self.current_bars[0].close + 1 / avgEntry))
+        else:
+            unrealized_equity = 0
+        series["equity_vec"].append(self.account.open_position.walletBalance)
+        series["wallet_equity_vec"].append(self.account.open_position.walletBalance)
+        series["unrealized_equity_vec"].append(unrealized_equity)
+        series["total_equity_vec"].append(self.account.equity)
+        dd_basis = self.drawdown_basis_equity
+        hh_vec = series["hh_vec"]
+        hh_vec.append(dd_basis if len(hh_vec) == 0 else (dd_basis if dd_basis > hh_vec[-1] else hh_vec[-1]))
+        ll_vec = series["ll_vec"]
+        ll_vec.append(dd_basis if len(ll_vec) == 0 else (dd_basis if dd_basis < ll_vec[-1] else ll_vec[-1]))
+        dd_vec = series["dd_vec"]
+        dd_vec.append(-(hh_vec[-1] - dd_basis))
+        max_dd_vec = series["maxDD_vec"]
+        max_dd_vec.append(dd_vec[0] if len(max_dd_vec) == 0
+                          else (dd_vec[-1] if dd_vec[-1] < max_dd_vec[-1] else max_dd_vec[-1]))
+        # what the early stop checks saw
+        self.list_max_dd_pct.append((100.0 * max_dd_vec[-1] / self.initialEquity, self._current_max_dd_pct()))
+
+
+class _TickedBackTest(BackTest):
+    ''' every subbar gets its own tick and stats update, no batching of quiet subbars '''
+
+    def reset(self):
+        super().reset()
+        self._needs_intrabar_ticks = True
+
+
+def check_plot_series() -> List[str]:
+    ''' the numpy plot series against the per bar python lists and the stats of batched quiet subbars against
+    ticking every subbar '''
+    errors = []
+    days = 60
+    backtest = _ListSeriesBackTest(_channel_bot(), bars=process_low_tf_bars(_m1_bars(days), 240),
+                                   symbol=build_symbol("BTCUSD")).run()
+    if len(backtest.bot.position_history) == 0:
+        errors.append("backtest made no trades")
+    for name in SERIES:
+        if np.asarray(getattr(backtest, name)).tolist() != backtest.list_series[name]:
+            errors.append("%s differs from the list version" % name)
+    if any(expected != running for expected, running in backtest.list_max_dd_pct):
+        errors.append("running max drawdown differs from maxDD_vec")
+    if backtest.metrics["max_drawdown_pct"] != 100.0 * backtest.list_series["maxDD_vec"][-1] / backtest.initialEquity:
+        errors.append("max_drawdown_pct of the metrics differs from maxDD_vec")
+
+    ticked = _TickedBackTest(_channel_bot(), bars=process_low_tf_bars(_m1_bars(days), 240),
+                             symbol=build_symbol("BTCUSD")).run()
+    for name in ("maxDD", "max_underwater", "maxExposure", "hh"):
+        if getattr(backtest, name) != getattr(ticked, name):
+            errors.append("%s with batched quiet subbars differs from ticking every subbar: %r != %r"
+                          % (name, getattr(backtest, name), getattr(ticked, name)))
+    if _run_fingerprint(backtest) != _run_fingerprint(ticked):
+        errors.append("trades with batched quiet subbars differ from ticking every subbar")
+    return errors
+
+
+# --- funding -----------------------------------------------------------------------------------------------------
+
+def _dict_funding_rate(backtest: BackTest, tstamp: int) -> float:
+    ''' the lookup do_funding did on every bar before the funding vector '''
+    funding = 0
+    if backtest.funding is not None and backtest.firstFunding <= tstamp <= backtest.lastFunding:
+        if tstamp in backtest.funding:
+            funding = backtest.funding[tstamp]
+    else:
+        dt = datetime.fromtimestamp(tstamp, tz=timezone.utc)
+        if dt.hour in (0, 8, 16):
+            funding = 0.0001
+    return funding
+
+
+class _DictFundingBackTest(BackTest):
+    def do_funding(self, funding: float = None):
+        super().do_funding(_dict_funding_rate(self, self.current_bars[0].tstamp))
+
+
+def check_funding() -> List[str]:
+    ''' the per bar funding vector against the dict lookup with the 0/8/16h fallback '''
+    errors = []
+    days = 30
+    m1 = _m1_bars(days)
+    tstamps = sorted({bar.tstamp // 3600 * 3600 for bar in m1})
+    known = [t for t in tstamps[len(tstamps) // 4: 3 * len(tstamps) // 4] if (t // 3600) % 8 == 0]
+    funding = {t: 0.0001 * ((t // 3600) % 3 - 1) for t in known if t != known[len(known) // 2]}  # with a gap
+    for name, series in (("no funding", None), ("empty funding", {}), ("funding", funding)):
+        for store in ("list", "array"):
+            bars = process_low_tf_bars(m1, 60) if store == "list" else BarArray.from_bars(m1).aggregate(60)
+            backtest = BackTest(_channel_bot(), bars=bars, funding=series, symbol=build_symbol("BTCUSD"))
+            expected = [_dict_funding_rate(backtest, bar.tstamp) for bar in backtest.bars]
+            if backtest.funding_rates.tolist() != expected:
+                errors.append("%s, %s bars: funding_rates differ from the dict lookup" % (name, store))
+            if [backtest.funding_rate(bar) for bar in backtest.bars] != expected:
+                errors.append("%s, %s bars: funding_rate differs from the dict lookup" % (name, store))
+
+    for name, series in (("no funding", None), ("funding", funding)):
+        vector = BackTest(_channel_bot(), bars=process_low_tf_bars(_m1_bars(days), 240), funding=series,
+                          symbol=build_symbol("BTCUSD")).run()
+        lookup = _DictFundingBackTest(_channel_bot(), bars=process_low_tf_bars(_m1_bars(days), 240), funding=series,
+                                      symbol=build_symbol("BTCUSD")).run()
+        if _run_fingerprint(vector) != _run_fingerprint(lookup) or vector.cum_funding_for_dd != lookup.cum_funding_for_dd:
+            errors.append("%s: backtest with the funding vector differs from the dict lookup" % name)
+        if vector.cum_funding_for_dd == 0:
+            errors.append("%s: backtest paid no funding" % name)
+    return errors
+
+
+# --- streaming indicators ----------------------------------------------------------------------------------------
+
+STREAMING_TOL = 1e-9
+
+
+def _same_values(values, expected) -> bool:
+    values = np.asarray(values, dtype=float)
+    expected = np.asarray(expected, dtype=float)
+    return values.shape == expected.shape and bool(np.all(np.isnan(values) == np.isnan(expected))) and \
+        bool(np.allclose(values, expected, rtol=STREAMING_TOL, atol=STREAMING_TOL, equal_nan=True))
+
+
+def check_streaming() -> List[str]:
+    ''' the streaming kernels (seeded on a history, then one update per bar) against talib on the whole history '''
+    errors = []
+    bars = process_low_tf_bars(_m1_bars(120), 240)[::-1]
+    high = np.array([bar.high for bar in bars])
+    low = np.array([bar.low for bar in bars])
+    close = np.array([bar.close for bar in bars])
+    seeded = len(close) // 2
+
+    for period in (14, 35):
+        kernels = (
+            ("EMA", StreamingEMA(period), (close,), lambda kernel: kernel.value,
+             talib.EMA(close, period)),
+            ("RSI", StreamingRSI(period), (close,), lambda kernel: kernel.value,
+             talib.RSI(close, period)),
+            ("ATR", StreamingATR(period), (high, low, close), lambda kernel: kernel.value,
+             talib.ATR(high, low, close, period)),
+            ("NATR", StreamingATR(period), (high, low, close), lambda kernel: kernel.natr,
+             talib.NATR(high, low, close, period)),
+            ("ADX", StreamingADX(period), (high, low, close), lambda kernel: kernel.value,
+             talib.ADX(high, low, close, period)),
+            ("PLUS_DI", StreamingADX(period), (high, low, close), lambda kernel: kernel.plus_di,
+             talib.PLUS_DI(high, low, close, period)),
+            ("MINUS_DI", StreamingADX(period), (high, low, close), lambda kernel: kernel.minus_di,
+             talib.MINUS_DI(high, low, close, period)),
+        )
+        for name, kernel, inputs, output, expected in kernels:
+            kernel.seed(*(values[:seeded] for values in inputs))
+            values = [output(kernel)]
+            for idx in range(seeded, len(close)):
+                kernel.update(*(float(values_in[idx]) for values_in in inputs))
+                values.append(output(kernel))
+            if not _same_values(values, expected[seeded - 1:]):
+                errors.append("%s(%i): streaming values differ from talib" % (name, period))
+
+    # the indicator engine: one update per closed bar, a gap makes it replay the history
+    streaming = Streaming4hIndicators(14, 50, 14, 35)
+    timestamps = np.array([bar.tstamp for bar in bars])
+    for stop in list(range(seeded, seeded + 20)) + list(range(seeded + 25, len(close) + 1)):
+        history = streaming.update(SimpleNamespace(high=high[:stop], low=low[:stop], close=close[:stop],
+                                                   timestamps=timestamps[:stop]))
+    expected = {
+        "atr": talib.ATR(high, low, close, 14),
+        "natr": talib.NATR(high, low, close, 14),
+        "natr_slow": talib.NATR(high, low, close, 50),
+        "rsi": talib.RSI(close, 14),
+        "adx": talib.ADX(high, low, close, 35),
+        "plus_di": talib.PLUS_DI(high, low, close, 35),
+        "minus_di": talib.MINUS_DI(high, low, close, 35),
+    }
+    for name, values in expected.items():
+        if not _same_values(history[name].values, values):
+            errors.append("Streaming4hIndicators %s differs from talib" % name)
+    return errors
+
+
+CHECKS = {
+    "bar_window": check_bar_window,
+    "bar_array": check_bar_array,
+    "shared_bars": check_shared_bars,
+    "plot_series": check_plot_series,
+    "funding": check_funding,
+    "streaming": check_streaming,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check optimized components against the implementation they replaced.")
+    parser.add_argument("--check", action="append", choices=sorted(CHECKS.keys()),
+                        help="run only this check (repeatable), default: all")
+    args = parser.parse_args()
+
+    failed = False
+    for name in args.check or CHECKS.keys():
+        errors = CHECKS[name]()
+        print("%s: %s" % (name, "PASS" if len(errors) == 0 else "FAIL"))
+        for error in errors:
+            print("  " + error)
+        failed = failed or len(errors) > 0
+
+    print("COMPONENT_PARITY=%s" % ("FAIL" if failed else "PASS"))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -370,6 +370,7 @@ def load_backtest_data(exchange: str, pair: str, days: int, timeframe: int):
         start_offset_minutes=0,
         exchange=normalized_exchange,
         symbol=pair,
+        cache="mmap",
     )
     funding = load_funding(normalized_exchange, pair)
     open_interest = load_open_interest(normalized_exchange, pair)
@@ -18,15 +18,17 @@ from typing import Any, Dict, List, Optional, Tuple
 
 import numpy as np
 import talib
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
 
 PROJECT_ROOT = Path(__file__).resolve().parents[1]
 if str(PROJECT_ROOT) not in sys.path:
     sys.path.insert(0, str(PROJECT_ROOT))
+THIS_DIR = Path(__file__).resolve().parent
+if str(THIS_DIR) not in sys.path:
+    sys.path.insert(0, str(THIS_DIR))
 os.chdir(PROJECT_ROOT)
 
 from kuegi_bot.backtest_engine import BackTest
+from kuegi_bot.backtest_batch import BatchBackTest
 from kuegi_bot.bots.MultiStrategyBot import MultiStrategyBot
 from kuegi_bot.bots.strategies.entry_filters import DayOfWeekFilter
 from kuegi_bot.bots.strategies.exit_modules import ATRrangeSL, FixedPercentage, TimedExit
@@ -41,8 +43,13 @@ from kuegi_bot.bots.strategies.trend_enums import (
 from kuegi_bot.bots.strategies.trend_indicator_provider import build_trend_indicator_provider
 from kuegi_bot.bots.strategies.strategy_one_entry_schema import ENTRY_IDS, get_entry_parameter_catalog
 from kuegi_bot.utils import log as botlog
+from kuegi_bot.utils.bar_array import BarArray
+from kuegi_bot.utils.monte_carlo import monte_carlo_metrics
+from kuegi_bot.utils.results_sink import ResultsSink, trade_rows
 from kuegi_bot.utils.helper import load_bars, load_funding, load_open_interest
+from kuegi_bot.utils.shared_bars import SharedBarDataset
 from kuegi_bot.utils.trading_classes import Symbol
+from signal_screening import gate_for_param, screen_gate, screening_trades
 
 DEFAULT_SL_ATR_MULT = 0.8
 PREPARATION_TARGET_SWEEP_POINTS = 18
@@ -52,6 +59,30 @@ PREPARATION_MAX_SWEEP_POINTS = 20
 BASE_ENTRY_MODULE_CONFIG = {entry_id: False for entry_id in ENTRY_IDS}
 
 
+def add_monte_carlo_metrics(metrics: Dict[str, Any], bt: BackTest, args):
+    runs = int(getattr(args, "monte_carlo_runs", 0))
+    if runs <= 0 or len(metrics) == 0:
+        return
+    # fixed seed: the same trades always get the same distribution, so candidates compare on their trades only
+    metrics.update(monte_carlo_metrics(bt, runs=runs, method=str(getattr(args, "monte_carlo_method", "bootstrap"))))
+
+
+def load_optimizer_dataset(args) -> Tuple[BarArray, Optional[Dict[int, float]], Optional[Dict[int, float]]]:
+    exchange = normalize_exchange(args.exchange, args.pair)
+    funding = load_funding(exchange, args.pair)
+    open_interest = load_open_interest(exchange, args.pair)
+    bars = load_bars(
+        days_in_history=int(args.days),
+        wanted_tf=int(args.timeframe),
+        start_offset_minutes=0,
+        exchange=exchange,
+        symbol=args.pair,
+        as_array=True,
+        cache="mmap",
+    )
+    return bars, funding, open_interest
+
+
 def get_symbol(pair: str):
     if pair == "BTCUSD":
         return Symbol(baseCoin="BTC", symbol="BTCUSD", isInverse=True, tickSize=0.1, lotSize=1.0, makerFee=0.0002, takerFee=0.00055, quantityPrecision=2, pricePrecision=2)
@@ -258,7 +289,8 @@ class MetricGate:
 
 
 class EntryStagedOptimizer:
-    def __init__(self, args):
+    def __init__(self, args, dataset: Optional[Tuple[BarArray, Optional[Dict[int, float]], Optional[Dict[int, float]]]] = None):
+        # dataset: (bars, funding, open interest) to optimize on instead of loading --days of history
         self.args = args
         self.entry_id = str(getattr(args, "entry_id", DEFAULT_ENTRY_ID) or "").strip().lower()
         if self.entry_id not in ENTRY_PARAM_CATALOG:
@@ -294,15 +326,19 @@ class EntryStagedOptimizer:
 
         self.symbol = get_symbol(args.pair)
         self.exchange = normalize_exchange(args.exchange, args.pair)
-        self.funding = load_funding(self.exchange, args.pair)
-        self.open_interest = load_open_interest(self.exchange, args.pair)
-        self.bars = load_bars(
-            days_in_history=int(args.days),
-            wanted_tf=int(args.timeframe),
-            start_offset_minutes=0,
-            exchange=self.exchange,
-            symbol=args.pair,
-        )
+        if dataset is None:
+            dataset = load_optimizer_dataset(args)
+        self.bar_array, self.funding, self.open_interest = dataset
+        # backtests run on the BarArray (subbars created per bar while running), the Bar list without subbars is
+        # only for the indicator preparation and the same objects the backtests share
+        self.bars = self.bar_array.shared_bars()
+        # published on the first parallel batch, parallel workers attach to it instead of loading the history
+        self.shared_dataset: Optional[SharedBarDataset] = None
+        # per bar gate values for --screen-top-k, built on the first screened sweep
+        self.screening_features: Optional[Dict[str, np.ndarray]] = None
+        results_db = str(getattr(args, "results_db", "") or "").strip()
+        self.results_sink: Optional[ResultsSink] = ResultsSink(results_db) if results_db != "" else None
+        self.results_with_trades = bool(getattr(args, "results_db_trades", False))
 
         self.active_sweep_order: List[str] = []
 
@@ -1678,6 +1714,9 @@ class EntryStagedOptimizer:
     ) -> None:
         if not self._oi_flow_plot_requested():
             return
+        # plotly only loads when a plot is written, sweep workers import this module without it
+        import plotly.graph_objects as go
+        from plotly.subplots import make_subplots
         flow_cfg = self._current_oi_flow_plot_config()
         if not isinstance(flow_cfg, dict):
             return
@@ -1850,6 +1889,8 @@ class EntryStagedOptimizer:
     ) -> None:
         if not self._oi_funding_plot_requested():
             return
+        import plotly.graph_objects as go
+        from plotly.subplots import make_subplots
         cfg = self._current_oi_funding_plot_config()
         if not isinstance(cfg, dict):
             return
@@ -1990,6 +2031,8 @@ class EntryStagedOptimizer:
         }
         if not payload["enabled"]:
             return payload
+        import plotly.graph_objects as go
+        from plotly.subplots import make_subplots
 
         status_by_dim = {str(row.get("dim")): dict(row) for row in prep_dim_status if row.get("dim") is not None}
         seeded_values = self._seeded_numeric_values_by_dimension()
@@ -2510,6 +2553,15 @@ class EntryStagedOptimizer:
             "rel2_signed": "rel2_signed",
             "trades": "trades",
             "trades_closed": "trades",
+            "mc_profit_p5": "mc_profit_pct_p5",
+            "mc_profit_pct_p5": "mc_profit_pct_p5",
+            "mc_profit_p50": "mc_profit_pct_p50",
+            "mc_profit_pct_p50": "mc_profit_pct_p50",
+            "mc_dd_p50": "mc_dd_p50",
+            "mc_peak_dd_pct_p50": "mc_dd_p50",
+            "mc_dd_p95": "mc_dd_p95",
+            "mc_peak_dd_pct_p95": "mc_dd_p95",
+            "mc_loss_prob": "mc_loss_prob",
         }
         out: List[MetricGate] = []
         for raw_item in raw_items:
@@ -2524,6 +2576,8 @@ class EntryStagedOptimizer:
                     raise ValueError("Invalid gate value in %s: '%s'" % (flag_name, token))
                 if not math.isfinite(value):
                     raise ValueError("Invalid gate value in %s: '%s'" % (flag_name, token))
+                if metric_key.startswith("mc_") and int(getattr(self.args, "monte_carlo_runs", 0)) <= 0:
+                    raise ValueError("%s gate '%s' needs --monte-carlo-runs > 0" % (flag_name, token))
                 out.append(MetricGate(metric_key=metric_key, op=op, value=float(value), raw=token))
         return out
 
@@ -2539,6 +2593,12 @@ class EntryStagedOptimizer:
             return self._value_rel2_signed(metrics)
         if key == "trades":
             return float(int(metric(metrics, "trades_closed")))
+        if key == "mc_dd_p50":
+            return abs(metric(metrics, "mc_peak_dd_pct_p50"))
+        if key == "mc_dd_p95":
+            return abs(metric(metrics, "mc_peak_dd_pct_p95"))
+        if key.startswith("mc_"):
+            return metric(metrics, key)
         raise ValueError("Unknown metric key: %s" % str(metric_key))
 
     def _metrics_pass_stage_gates(
@@ -3013,19 +3073,23 @@ class EntryStagedOptimizer:
             early_cfg = {"max_trades_closed": int(early_stop_max_trades)}
         bt = BackTest(
             self._build_bot(entry_cfg=params, timeframe=int(self.args.timeframe)),
-            bars=copy.deepcopy(self.bars),
+            bars=self.bar_array,
             funding=self.funding,
             symbol=self.symbol,
             early_stop_config=early_cfg,
         ).run()
-        elapsed = time.time() - start
+        return self._trial_result(bt=bt, params=params, stage=stage, label=label, elapsed=time.time() - start)
+
+    def _trial_result(self, bt: BackTest, params: Dict[str, Any], stage: str, label: str, elapsed: float) -> TrialResult:
         metrics = bt.metrics if isinstance(bt.metrics, dict) else {}
+        add_monte_carlo_metrics(metrics, bt, self.args)
         result = TrialResult(
             metrics=metrics,
             elapsed_s=elapsed,
             early_stopped=bool(getattr(bt, "early_stopped", False)),
             early_stop_reason=str(getattr(bt, "early_stop_reason", "")) if getattr(bt, "early_stopped", False) else None,
         )
+        self._store_trial(stage, label, params, result, trades=trade_rows(bt) if self.results_with_trades else None)
         self._record_event(
             "trial",
             {
@@ -3092,7 +3156,7 @@ class EntryStagedOptimizer:
             details["ram_available_gb"] = None if avail_gb is None else round(float(avail_gb), 3)
             if avail_gb is not None:
                 reserve_gb = max(0.0, float(getattr(self.args, "ram_reserve_gb", 8.0)))
-                per_worker_gb = max(0.1, float(getattr(self.args, "worker_ram_gb", 2.0)))
+                per_worker_gb = max(0.1, float(getattr(self.args, "worker_ram_gb", 1.0)))
                 usable_gb = max(0.0, float(avail_gb) - reserve_gb)
                 ram_limit = int(max(1, math.floor(usable_gb / per_worker_gb))) if usable_gb > 0 else 1
                 details["ram_limit_workers"] = int(ram_limit)
@@ -3101,13 +3165,75 @@ class EntryStagedOptimizer:
         details["resolved_workers"] = int(workers)
         return int(workers), details
 
+    def _shared_dataset_descriptor(self) -> Optional[Dict[str, Any]]:
+        if self.shared_dataset is None:
+            try:
+                self.shared_dataset = SharedBarDataset.publish(self.bar_array, self.funding, self.open_interest)
+            except (OSError, ValueError) as exc:
+                self._progress("shared dataset unavailable, workers load the history themselves: %s" % str(exc))
+                return None
+        return self.shared_dataset.descriptor()
+
+    def close(self):
+        if self.shared_dataset is not None:
+            self.shared_dataset.close()
+            self.shared_dataset = None
+        if self.results_sink is not None:
+            self.results_sink.close()
+            self.results_sink = None
+
+    def _store_trial(self, stage: str, label: str, params: Dict[str, Any], trial: TrialResult,
+                     trades: Optional[List[Tuple]] = None):
+        if self.results_sink is None:
+            return
+        self.results_sink.add(
+            trial.metrics,
+            params=params,
+            trades=trades if self.results_with_trades else None,
+            run_name=self.run_name,
+            stage=stage,
+            label=label,
+            elapsed_s=round(float(trial.elapsed_s), 3),
+            early_stopped=bool(trial.early_stopped),
+            early_stop_reason=trial.early_stop_reason,
+        )
+
+    def _run_trials_batch(
+        self,
+        stage: str,
+        candidates: List[Tuple[Any, Dict[str, Any], str]],
+    ) -> List[Tuple[Any, Dict[str, Any], TrialResult]]:
+        # all candidates in one pass over the bars, bars/subbars/funding/indicator snapshots are shared
+        self._record_event("batch_trials_start", {"stage": stage, "candidate_count": len(candidates)})
+        self._progress("[%s] candidates=%d in one shared bar pass" % (stage, len(candidates)))
+        start = time.time()
+        backtests = BatchBackTest(
+            [self._build_bot(entry_cfg=params, timeframe=int(self.args.timeframe)) for _value, params, _label in candidates],
+            bars=self.bar_array,
+            funding=self.funding,
+            symbol=self.symbol,
+        ).run()
+        elapsed = time.time() - start
+        out: List[Tuple[Any, Dict[str, Any], TrialResult]] = []
+        for (value, params, label), bt in zip(candidates, backtests):
+            out.append((value, params, self._trial_result(
+                bt=bt, params=params, stage=stage, label=label, elapsed=elapsed / len(candidates))))
+        self._record_event(
+            "batch_trials_done",
+            {"stage": stage, "candidate_count": len(candidates), "elapsed_s": round(elapsed, 3)},
+        )
+        return out
+
     def _run_trials_parallel(
         self,
         stage: str,
         candidates: List[Tuple[Any, Dict[str, Any], str]],
+        batchable: bool = False,
     ) -> List[Tuple[Any, Dict[str, Any], TrialResult]]:
         if len(candidates) == 0:
             return []
+        if batchable and bool(getattr(self.args, "batch_sweeps", False)):
+            return self._run_trials_batch(stage=stage, candidates=candidates)
 
         workers, worker_details = self._resolve_eval_workers(batch_size=len(candidates))
         self._record_event(
@@ -3164,6 +3290,10 @@ class EntryStagedOptimizer:
             "timeframe": int(self.args.timeframe),
             "days": int(self.args.days),
             "entry_id": self.entry_id,
+            "dataset": self._shared_dataset_descriptor(),
+            "monte_carlo_runs": int(getattr(self.args, "monte_carlo_runs", 0)),
+            "monte_carlo_method": str(getattr(self.args, "monte_carlo_method", "bootstrap")),
+            "with_trades": bool(self.results_with_trades),
         }
         accept_best_requested = False
         fast_forward_logged = False
@@ -3222,6 +3352,7 @@ class EntryStagedOptimizer:
                                 early_stop_reason=row.get("early_stop_reason"),
                             )
                             ordered[idx] = (value, params, trial_result)
+                            self._store_trial(stage, label, params, trial_result, trades=row.get("trades"))
 
                             self._record_event(
                                 "trial",
@@ -3897,7 +4028,7 @@ class EntryStagedOptimizer:
         try:
             bt = BackTest(
                 self._build_bot(entry_cfg=final_params, timeframe=int(self.args.timeframe)),
-                bars=copy.deepcopy(self.bars),
+                bars=self.bar_array,
                 funding=self.funding,
                 symbol=self.symbol,
             ).run()
@@ -3905,6 +4036,7 @@ class EntryStagedOptimizer:
             metrics = bt.metrics if isinstance(getattr(bt, "metrics", None), dict) else {}
             if not isinstance(metrics, dict):
                 metrics = {}
+            add_monte_carlo_metrics(metrics, bt, self.args)
 
             self.final_confirmation_report = {
                 "enabled": True,
@@ -3993,6 +4125,84 @@ class EntryStagedOptimizer:
         self._set_benchmark("stage1a_idea_baseline", self.current_params, result.metrics)
         return True
 
+    def _screen_candidates(
+        self,
+        stage: str,
+        dim_id: str,
+        candidates: List[Tuple[Any, Dict[str, Any], str]],
+        objective: str,
+        top_k: int,
+    ) -> List[Tuple[Any, Dict[str, Any], str]]:
+        # one backtest with the gate off, then all thresholds on its trades at once. the top_k go on to the full run
+        gate = gate_for_param(str(self._dim_param_name(dim_id) or ""), self.entry_id)
+        if gate is None:
+            return candidates
+        values: List[Optional[float]] = []
+        for value, _params, _label in candidates:
+            if self._is_off_value(value):
+                values.append(None)
+                continue
+            try:
+                values.append(float(value))
+            except (TypeError, ValueError):
+                return candidates
+
+        start = time.time()
+        ref_params = copy.deepcopy(self.current_params)
+        self._apply_dimension_off(params=ref_params, dim_id=dim_id)
+        reference = BackTest(
+            self._build_bot(entry_cfg=ref_params, timeframe=int(self.args.timeframe)),
+            bars=self.bar_array,
+            funding=self.funding,
+            symbol=self.symbol,
+        ).run()
+        if self.screening_features is None:
+            strategy = self._build_strategy(
+                entry_cfg=ref_params,
+                timeframe=int(self.args.timeframe),
+                entry_id=self.entry_id,
+                open_interest_by_tstamp=self.open_interest,
+                funding_by_tstamp=self.funding,
+            )
+            provider = build_trend_indicator_provider(strategy.ta_trend_strat, "precomputed")
+            provider.prepare_backtest(self.bars)
+            self.screening_features = provider.gate_features()
+            self.screening_features["timestamps"] = provider.timestamps
+        trades = screening_trades(reference, self.screening_features["timestamps"])
+        screened = screen_gate(trades, self.screening_features, gate, values, initial_equity=reference.initialEquity)
+
+        rows = [
+            (idx, params, TrialResult(metrics=metrics, elapsed_s=0.0, early_stopped=False, early_stop_reason=None))
+            for idx, ((_value, params, _label), metrics) in enumerate(zip(candidates, screened))
+        ]
+        picked: List[int] = []
+        while len(picked) < top_k:
+            best = self._select_best_trial_row_by_objective(
+                trial_rows=[row for row in rows if row[0] not in picked], objective=objective
+            )
+            if best is None:
+                break
+            picked.append(best[0])
+        # no screened trades left: fill up in sweep order
+        picked.extend([idx for idx in range(len(candidates)) if idx not in picked][: max(0, top_k - len(picked))])
+        shortlist = [candidates[idx] for idx in sorted(picked)]
+        self._record_event(
+            "screening",
+            {
+                "stage": stage,
+                "dimension": dim_id,
+                "candidate_count": len(candidates),
+                "shortlist": [label for _value, _params, label in shortlist],
+                "reference_trades": int(len(trades["ret"])),
+                "elapsed_s": round(time.time() - start, 3),
+            },
+        )
+        self._progress(
+            "[%s] screened %d candidates on %d reference trades in %.1fs, simulating %d"
+            % (stage, len(candidates), len(trades["ret"]), time.time() - start, len(shortlist))
+        )
+        return shortlist
+
     def _gate_sweep(
         self,
         stage: str,
@@ -4003,6 +4213,7 @@ class EntryStagedOptimizer:
         disable_fn=None,
         objective: str = OBJECTIVE_PROFIT,
         stage_bucket: Optional[str] = None,
+        screen_dim: Optional[str] = None,
     ) -> bool:
         if self.benchmark is None:
             raise RuntimeError("Benchmark must be initialized before gate sweeps.")
@@ -4035,7 +4246,12 @@ class EntryStagedOptimizer:
                     )
                     continue
                 candidates.append((value, trial_params, f"value={value}"))
-            trial_rows = self._run_trials_parallel(stage=stage, candidates=candidates)
+            screen_top_k = int(getattr(self.args, "screen_top_k", 0))
+            if screen_dim is not None and 0 < screen_top_k < len(candidates):
+                candidates = self._screen_candidates(
+                    stage=stage, dim_id=screen_dim, candidates=candidates, objective=objective_key, top_k=screen_top_k
+                )
+            trial_rows = self._run_trials_parallel(stage=stage, candidates=candidates, batchable=True)
         else:
             accept_best_requested = False
             for value in values:
@@ -4315,7 +4531,7 @@ class EntryStagedOptimizer:
                     continue
                 candidates.append((value, trial_params, "value=%s" % str(value)))
 
-            rows = self._run_trials_parallel(stage=stage_name, candidates=candidates)
+            rows = self._run_trials_parallel(stage=stage_name, candidates=candidates, batchable=True)
             eligible_rows: List[Tuple[Any, Dict[str, Any], TrialResult]] = []
             for value, trial_params, result in rows:
                 if int(metric(result.metrics, "trades_closed")) <= 0:
@@ -4479,7 +4695,13 @@ class EntryStagedOptimizer:
                 "max_eval_workers": int(getattr(self.args, "max_eval_workers", 0)),
                 "ram_aware_workers": bool(getattr(self.args, "ram_aware_workers", True)),
                 "ram_reserve_gb": float(getattr(self.args, "ram_reserve_gb", 8.0)),
-                "worker_ram_gb": float(getattr(self.args, "worker_ram_gb", 2.0)),
+                "worker_ram_gb": float(getattr(self.args, "worker_ram_gb", 1.0)),
+                "batch_sweeps": bool(getattr(self.args, "batch_sweeps", False)),
+                "screen_top_k": int(getattr(self.args, "screen_top_k", 0)),
+                "monte_carlo_runs": int(getattr(self.args, "monte_carlo_runs", 0)),
+                "monte_carlo_method": str(getattr(self.args, "monte_carlo_method", "bootstrap")),
+                "results_db": str(getattr(self.args, "results_db", "") or ""),
+                "results_db_trades": bool(getattr(self.args, "results_db_trades", False)),
                 "control_file": str(self.control_path),
                 "control_command": "accept_best",
                 "final_confirmation_run": bool(getattr(self.args, "final_confirmation_run", True)),
@@ -4547,6 +4769,7 @@ class EntryStagedOptimizer:
                 disable_fn=disable_fn,
                 objective=objective,
                 stage_bucket=stage_bucket,
+                screen_dim=dim_id,
             )
 
         if skip_stage0_gate:
@@ -4654,7 +4877,7 @@ class EntryStagedOptimizer:
         )
 
 
-_PARALLEL_WORKER_CACHE: Dict[Tuple[str, str, int, int], Dict[str, Any]] = {}
+_PARALLEL_WORKER_CACHE: Dict[Any, Dict[str, Any]] = {}
 
 
 def _parallel_eval_trial(payload: Dict[str, Any]) -> Dict[str, Any]:
@@ -4676,9 +4899,20 @@ def _parallel_eval_trial(payload: Dict[str, Any]) -> Dict[str, Any]:
         entry_id = str(payload.get("entry_id", DEFAULT_ENTRY_ID))
         params = dict(payload["params"])
 
-        key = (exchange, pair, timeframe, days)
+        dataset_descriptor = payload.get("dataset")
+        key = (exchange, pair, timeframe, days) if dataset_descriptor is None else dataset_descriptor["name"]
         cached = _PARALLEL_WORKER_CACHE.get(key)
-        if cached is None:
+        if cached is None and dataset_descriptor is not None:
+            dataset = SharedBarDataset.attach(dataset_descriptor)
+            cached = {
+                "symbol": get_symbol(pair),
+                "funding": dataset.funding(),
+                "open_interest": dataset.open_interest(),
+                "bars": dataset.bar_array(),
+                "dataset": dataset,
+            }
+            _PARALLEL_WORKER_CACHE[key] = cached
+        elif cached is None:
             cached = {
                 "symbol": get_symbol(pair),
                 "funding": load_funding(exchange, pair),
@@ -4689,6 +4923,8 @@ def _parallel_eval_trial(payload: Dict[str, Any]) -> Dict[str, Any]:
                     start_offset_minutes=0,
                     exchange=exchange,
                     symbol=pair,
+                    as_array=True,
+                    cache="mmap",
                 ),
             }
             _PARALLEL_WORKER_CACHE[key] = cached
@@ -4711,8 +4947,8 @@ def _parallel_eval_trial(payload: Dict[str, Any]) -> Dict[str, Any]:
         )
         bt = BackTest(
             bot=bot,
-            # Use fresh bar objects per trial to avoid cross-trial state bleed via bar.bot_data.
-            bars=copy.deepcopy(cached["bars"]),
+            # BackTest.reset() wipes the state of the bars, so the bars are shared across trials
+            bars=cached["bars"],
             funding=cached["funding"],
             symbol=cached["symbol"],
             market_slipage_percent=0.15,
@@ -4722,12 +4958,17 @@ def _parallel_eval_trial(payload: Dict[str, Any]) -> Dict[str, Any]:
         metrics = bt.metrics if isinstance(getattr(bt, "metrics", None), dict) else {}
         if not isinstance(metrics, dict):
             metrics = {}
+        add_monte_carlo_metrics(metrics, bt, argparse.Namespace(
+            monte_carlo_runs=int(payload.get("monte_carlo_runs", 0)),
+            monte_carlo_method=str(payload.get("monte_carlo_method", "bootstrap")),
+        ))
 
         return {
             "metrics": metrics,
             "elapsed_s": float(time.time() - started),
             "early_stopped": bool(getattr(bt, "early_stopped", False)),
             "early_stop_reason": str(getattr(bt, "early_stop_reason", "")) if getattr(bt, "early_stopped", False) else None,
+            "trades": trade_rows(bt) if payload.get("with_trades") else None,
         }
     except Exception as exc:
         return {
@@ -4950,8 +5191,45 @@ def build_arg_parser() -> argparse.ArgumentParser:
     parser.add_argument(
         "--worker-ram-gb",
         type=float,
-        default=2.0,
-        help="Estimated RAM per worker process used for RAM-aware cap.",
+        default=1.0,
+        help="Estimated RAM per worker process used for RAM-aware cap (bars are shared, this is strategy state).",
+    )
+    parser.add_argument(
+        "--batch-sweeps",
+        action="store_true",
+        help="Run the candidates of gate and SL sweeps in one shared pass over the bars (BatchBackTest) in this "
+        "process instead of one backtest per candidate on the worker pool.",
+    )
+    parser.add_argument(
+        "--screen-top-k",
+        type=int,
+        default=0,
+        help="Pre-filter numeric entry gate sweeps (RSI/NATR/volume/OI thresholds): rank all values on the trades of "
+        "one run with the gate off and only backtest the best K. 0 = off.",
+    )
+    parser.add_argument(
+        "--monte-carlo-runs",
+        type=int,
+        default=0,
+        help="Resample the closed trades of every trial this many times and add mc_* metrics (profit p5/p50, "
+        "drawdown from the high p50/p95, loss probability) that metric gates can use, e.g. --stage3-gate mc_dd_p95<=30. 0 = off.",
+    )
+    parser.add_argument(
+        "--monte-carlo-method",
+        choices=["bootstrap", "shuffle"],
+        default="bootstrap",
+        help="bootstrap: draw trades with replacement, shuffle: permute the trade order.",
+    )
+    parser.add_argument(
+        "--results-db",
+        default="",
+        help="SQLite file every trial is appended to (table trials: tags, metrics, params json). "
+        "Several runs can share one file.",
+    )
+    parser.add_argument(
+        "--results-db-trades",
+        action="store_true",
+        help="Also store the positions of every trial in the results db (table trades, keyed by trial_id).",
     )
     parser.add_argument(
         "--control-file",
@@ -5038,6 +5316,12 @@ def get_optimizer_gui_schema() -> Dict[str, Any]:
         "ram_aware_workers",
         "ram_reserve_gb",
         "worker_ram_gb",
+        "batch_sweeps",
+        "screen_top_k",
+        "monte_carlo_runs",
+        "monte_carlo_method",
+        "results_db",
+        "results_db_trades",
         "control_file",
         "final_confirmation_run",
         "final_run_with_plots",
@@ -5085,7 +5369,10 @@ def parse_args():
 def main():
     args = parse_args()
     optimizer = EntryStagedOptimizer(args)
-    optimizer.run()
+    try:
+        optimizer.run()
+    finally:
+        optimizer.close()
 
 if __name__ == "__main__":
     main()
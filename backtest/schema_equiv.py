@@ -205,7 +205,8 @@ def main():
     if exchange == "bybit" and "USDT" in PAIR:
         exchange = "bybit-linear"
 
-    bars = load_bars(days_in_history=3000 * 6, wanted_tf=TIMEFRAME, start_offset_minutes=0, exchange=exchange, symbol=PAIR)
+    bars = load_bars(days_in_history=3000 * 6, wanted_tf=TIMEFRAME, start_offset_minutes=0, exchange=exchange, symbol=PAIR,
+                     cache="mmap")
     funding = load_funding(exchange, PAIR)
     open_interest = load_open_interest(exchange, PAIR)
     symbol = get_symbol(PAIR)
@@ -0,0 +1,103 @@
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from kuegi_bot.utils.trading_classes import PositionStatus
+
+# common rule threshold (param suffix after "<entry_id>_") -> (feature of gate_features(), "min" or "max")
+GATE_FEATURES: Dict[str, Tuple[str, str]] = {
+    "confirm_rsi_4h_min": ("rsi_4h", "min"),
+    "confirm_rsi_4h_max": ("rsi_4h", "max"),
+    "confirm_rsi_d_min": ("rsi_d", "min"),
+    "confirm_rsi_d_max": ("rsi_d", "max"),
+    "confirm_natr_min": ("natr_4h", "min"),
+    "confirm_natr_max": ("natr_4h", "max"),
+    "confirm_vol_ratio_min": ("vol_ratio", "min"),
+    "confirm_vol_ratio_max": ("vol_ratio", "max"),
+    "filter_natr_max": ("natr_4h", "max"),
+    "filter_rsi_4h_max": ("rsi_4h", "max"),
+    "filter_rsi_d_min": ("rsi_d", "min"),
+    "filter_rsi_d_max": ("rsi_d", "max"),
+    "filter_vol_ratio_max": ("vol_ratio", "max"),
+    "filter_oi_ratio_4h_min": ("oi_ratio_4h", "min"),
+    "filter_oi_ratio_4h_max": ("oi_ratio_4h", "max"),
+    "filter_oi_4h_min": ("oi_4h", "min"),
+    "filter_atr_std_ratio_max": ("atr_std_ratio", "max"),
+}
+
+# features where the rules reject a missing value. the others only reject on the comparison, which nan never fails
+NAN_REJECTS = {"rsi_d", "vol_ratio", "oi_ratio_4h", "oi_4h", "atr_std_ratio"}
+
+
+def gate_for_param(param_name: str, entry_id: str) -> Optional[Tuple[str, str]]:
+    prefix = "%s_" % entry_id
+    if not str(param_name).startswith(prefix):
+        return None
+    return GATE_FEATURES.get(str(param_name)[len(prefix):])
+
+
+def screening_trades(reference, timestamps: np.ndarray) -> Dict[str, np.ndarray]:
+    '''
+    closed trades of a finished reference backtest (run with the screened gate off) as arrays in exit order:
+    snapshot index of the entry decision (the bar before the signal bar), return on the wallet at the signal.
+    '''
+    index_by_tstamp = {int(tstamp): idx for idx, tstamp in enumerate(timestamps)}
+    wallet = reference.wallet_equity_vec
+    inverse = bool(reference.symbol.isInverse)
+    rows = []
+    for pos in reference.bot.position_history:
+        if pos.status != PositionStatus.CLOSED or not pos.filled_entry or not pos.filled_exit:
+            continue
+        signal_idx = index_by_tstamp.get(int(pos.signal_tstamp))
+        if signal_idx is None or signal_idx < 1 or pos.max_filled_amount == 0:
+            continue
+        amount = float(pos.max_filled_amount)
+        if inverse:
+            pnl = amount * (1 / float(pos.filled_entry) - 1 / float(pos.filled_exit))
+        else:
+            pnl = amount * (float(pos.filled_exit) - float(pos.filled_entry))
+        # plot row idx - 1 holds the wallet at the open of bar idx
+        balance = float(wallet[min(max(0, signal_idx - 1), len(wallet) - 1)]) if len(wallet) > 0 \
+            else reference.initialEquity
+        rows.append((int(pos.exit_tstamp or 0), signal_idx - 1, pnl / balance if balance > 0 else 0.0))
+    rows.sort(key=lambda row: row[0])
+    return {
+        "snapshot_idx": np.array([row[1] for row in rows], dtype=np.int64),
+        "ret": np.array([row[2] for row in rows], dtype=float),
+    }
+
+
+def screen_gate(trades: Dict[str, np.ndarray], features: Dict[str, np.ndarray], gate: Tuple[str, str],
+                values: List[Any], initial_equity: float = 100) -> List[Dict[str, Any]]:
+    '''
+    approximate metrics of the reference trades that pass the gate, for all candidate values at once.
+    None as value keeps every trade (gate off). trades the reference run didn't take (e.g. blocked by the position
+    limit) can't show up, so this ranks candidates, the exact numbers come from the full backtest.
+    '''
+    feature_name, kind = gate
+    feature = features[feature_name][trades["snapshot_idx"]] if len(trades["ret"]) > 0 else np.zeros(0)
+    thresholds = np.array([np.nan if value is None else float(value) for value in values], dtype=float)
+    off = np.isnan(thresholds)[:, None]
+    with np.errstate(invalid="ignore"):
+        if kind == "min":
+            keep = ~(feature[None, :] < thresholds[:, None])
+        else:
+            keep = ~(feature[None, :] > thresholds[:, None])
+    if feature_name in NAN_REJECTS:
+        keep &= ~np.isnan(feature)[None, :]
+    keep |= off
+
+    # compounded equity after each kept trade, one row per candidate
+    growth = np.where(keep, np.log1p(np.maximum(trades["ret"], -0.999999))[None, :], 0.0)
+    equity = initial_equity * np.exp(np.cumsum(growth, axis=1))
+    equity = np.concatenate([np.full((len(values), 1), float(initial_equity)), equity], axis=1)
+    max_dd = (equity - np.maximum.accumulate(equity, axis=1)).min(axis=1)
+    result = []
+    for row in range(len(values)):
+        result.append({
+            "trades_closed": int(keep[row].sum()),
+            "profit_pct": float(100.0 * (equity[row, -1] - initial_equity) / initial_equity),
+            "max_drawdown_pct": float(100.0 * max_dd[row] / initial_equity),
+            "screened": True,
+        })
+    return result
@@ -11,7 +11,7 @@ THIS_DIR = Path(__file__).resolve().parent
 if str(THIS_DIR) not in sys.path:
     sys.path.insert(0, str(THIS_DIR))
 
-from backtest_result_tools import extract_metrics, trade_fingerprint
+from result_tools import extract_metrics, trade_fingerprint
 from mode_common import load_backtest_data, run_mode_backtest, setup_logger
 from truth_scenarios import DEFAULT_TRUTH_SCENARIOS
 
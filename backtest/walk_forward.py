@@ -0,0 +1,222 @@
+import argparse
+import concurrent.futures
+import copy
+import json
+import multiprocessing as mp
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+THIS_DIR = Path(__file__).resolve().parent
+if str(THIS_DIR) not in sys.path:
+    sys.path.insert(0, str(THIS_DIR))
+
+from kuegi_bot.backtest_engine import BackTest
+from kuegi_bot.utils.bar_array import BarArray
+from kuegi_bot.utils.results_sink import ResultsSink
+from kuegi_bot.utils.shared_bars import SharedBarDataset
+from optimizer import EntryStagedOptimizer, build_arg_parser, load_optimizer_dataset, metric
+
+
+def _run_fold(payload: Dict[str, Any]) -> Dict[str, Any]:
+    ''' staged optimizer on the train rows, then one backtest of the best params on the test rows '''
+    started = time.time()
+    dataset = None
+    if payload.get("dataset") is not None:
+        dataset = SharedBarDataset.attach(payload["dataset"])
+        bars, funding, open_interest = dataset.bar_array(), dataset.funding(), dataset.open_interest()
+    else:
+        bars, funding, open_interest = payload["bars"], payload["funding"], payload["open_interest"]
+    try:
+        fold = payload["fold"]
+        args = argparse.Namespace(**payload["args"])
+        optimizer = EntryStagedOptimizer(
+            args, dataset=(bars.window(fold["train_start"], fold["train_end"]), funding, open_interest)
+        )
+        try:
+            optimizer.run()
+        finally:
+            optimizer.close()
+        benchmark = optimizer.benchmark
+        params = copy.deepcopy(benchmark.params if benchmark is not None else optimizer.current_params)
+
+        bot = optimizer._build_bot(entry_cfg=params, timeframe=int(args.timeframe))
+        # history before the test rows only warms up the indicators, trading starts with the first test bar
+        test_start = max(0, fold["test_start"] - bot.min_bars_needed())
+        test = BackTest(bot, bars=bars.window(test_start, fold["test_end"]), funding=funding,
+                        symbol=optimizer.symbol).run()
+        return {
+            **fold,
+            "run_name": optimizer.run_name,
+            "params": params,
+            "train_metrics": benchmark.metrics if benchmark is not None else {},
+            "test_metrics": test.metrics if isinstance(test.metrics, dict) else {},
+            "elapsed_s": round(time.time() - started, 3),
+        }
+    finally:
+        if dataset is not None:
+            dataset.close()
+
+
+class WalkForwardRunner:
+    '''
+    walk-forward evaluation of the staged optimizer: the history is split into folds of train days followed by
+    test days, each fold optimizes on its train rows and scores the result on the unseen test rows.
+    the history is loaded once, parallel folds attach to it as SharedBarDataset.
+    with --results-db the trials of fold N go to <db>_foldN, the test result of every fold to <db> itself.
+    '''
+
+    def __init__(self, args, dataset: Optional[Tuple[BarArray, Optional[Dict[int, float]], Optional[Dict[int, float]]]] = None):
+        self.args = args
+        self.bars, self.funding, self.open_interest = dataset if dataset is not None else load_optimizer_dataset(args)
+        self.run_name = str(args.run_name).strip() or "walk_forward_" + time.strftime("%Y%m%d_%H%M%S")
+        self.out_dir = Path(args.out_dir)
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        self.result_path = self.out_dir / ("%s.walk_forward.json" % self.run_name)
+
+    def folds(self) -> List[Dict[str, Any]]:
+        bars_per_day = 24 * 60 / float(self.args.timeframe)
+        train = int(round(self.args.train_days * bars_per_day))
+        test = int(round(self.args.test_days * bars_per_day))
+        step = int(round((self.args.step_days or self.args.test_days) * bars_per_day))
+        if train <= 0 or test <= 0 or step <= 0:
+            raise ValueError("train, test and step days need to cover at least one bar")
+        result = []
+        offset = 0
+        while offset + train + test <= len(self.bars):
+            result.append({
+                "fold": len(result),
+                "train_start": 0 if self.args.anchored else offset,
+                "train_end": offset + train,
+                "test_start": offset + train,
+                "test_end": offset + train + test,
+            })
+            offset += step
+        for fold in result:
+            fold["train_from"] = int(self.bars.tstamp[fold["train_start"]])
+            fold["test_from"] = int(self.bars.tstamp[fold["test_start"]])
+            fold["test_to"] = int(self.bars.tstamp[fold["test_end"] - 1])
+            fold["train_days"] = (fold["train_end"] - fold["train_start"]) / bars_per_day
+            fold["test_days"] = (fold["test_end"] - fold["test_start"]) / bars_per_day
+        return result
+
+    def _fold_args(self, fold: Dict[str, Any], fold_workers: int) -> Dict[str, Any]:
+        args = dict(vars(self.args))
+        args["run_name"] = "%s_fold%d" % (self.run_name, fold["fold"])
+        args["days"] = int(self.args.train_days)
+        args["final_run_with_plots"] = False
+        args["final_run_open_browser"] = False
+        results_db = str(args.get("results_db", "") or "").strip()
+        if results_db != "":
+            # the trials of each fold go to a file of their own, the parent writes the fold results to results_db
+            path = Path(results_db)
+            args["results_db"] = str(path.with_name("%s_fold%d%s" % (path.stem, fold["fold"], path.suffix)))
+        if fold_workers > 1 and int(args.get("eval_workers", 0)) <= 0:
+            # split the cores between the folds instead of every fold taking all of them
+            args["eval_workers"] = max(1, (os.cpu_count() or 1) // fold_workers)
+        return args
+
+    def run(self) -> Dict[str, Any]:
+        folds = self.folds()
+        if len(folds) == 0:
+            raise ValueError("history of %d bars is too short for one train+test fold" % len(self.bars))
+        fold_workers = max(1, min(int(self.args.fold_workers), len(folds)))
+        print("walk-forward: %d folds, %d in parallel" % (len(folds), fold_workers))
+        results: List[Dict[str, Any]] = []
+        if fold_workers <= 1:
+            for fold in folds:
+                results.append(_run_fold({"fold": fold, "args": self._fold_args(fold, 1), "bars": self.bars,
+                                          "funding": self.funding, "open_interest": self.open_interest}))
+                self._print_fold(results[-1])
+        else:
+            shared = SharedBarDataset.publish(self.bars, self.funding, self.open_interest)
+            try:
+                with concurrent.futures.ProcessPoolExecutor(max_workers=fold_workers,
+                                                            mp_context=mp.get_context("spawn")) as pool:
+                    futures = [pool.submit(_run_fold, {"fold": fold, "args": self._fold_args(fold, fold_workers),
+                                                       "dataset": shared.descriptor()})
+                               for fold in folds]
+                    for future in concurrent.futures.as_completed(futures):
+                        results.append(future.result())
+                        self._print_fold(results[-1])
+            finally:
+                shared.close()
+        results.sort(key=lambda row: row["fold"])
+        self._store_results(results)
+
+        summary = self._summarize(results)
+        payload = {"run_name": self.run_name, "entry_id": self.args.entry_id, "pair": self.args.pair,
+                   "timeframe": int(self.args.timeframe), "train_days": self.args.train_days,
+                   "test_days": self.args.test_days, "step_days": self.args.step_days or self.args.test_days,
+                   "anchored": bool(self.args.anchored), "summary": summary, "folds": results}
+        self.result_path.write_text(json.dumps(payload, indent=2, sort_keys=True), encoding="utf-8")
+        print("test profit: mean %.2f%% | total %.2f%% | profitable folds %d/%d | worst dd %.2f%%" % (
+            summary["test_profit_pct_mean"], summary["test_profit_pct_total"], summary["profitable_folds"],
+            len(results), summary["test_max_drawdown_pct_worst"]))
+        print("wrote " + str(self.result_path))
+        return payload
+
+    def _store_results(self, results: List[Dict[str, Any]]):
+        results_db = str(getattr(self.args, "results_db", "") or "").strip()
+        if results_db == "":
+            return
+        with ResultsSink(results_db) as sink:
+            for row in results:
+                sink.add(row["test_metrics"], params=row["params"], run_name=self.run_name, stage="walk_forward_test",
+                         label=row["run_name"], fold=row["fold"], test_from=row["test_from"], test_to=row["test_to"],
+                         train_profit_pct=metric(row["train_metrics"], "profit_pct"))
+
+    @staticmethod
+    def _print_fold(row: Dict[str, Any]):
+        print("fold %d | train profit %.2f%% dd %.2f%% trades %d | test profit %.2f%% dd %.2f%% trades %d | %.0fs" % (
+            row["fold"],
+            metric(row["train_metrics"], "profit_pct"), metric(row["train_metrics"], "max_drawdown_pct"),
+            int(metric(row["train_metrics"], "trades_closed")),
+            metric(row["test_metrics"], "profit_pct"), metric(row["test_metrics"], "max_drawdown_pct"),
+            int(metric(row["test_metrics"], "trades_closed")), row["elapsed_s"]))
+
+    @staticmethod
+    def _summarize(results: List[Dict[str, Any]]) -> Dict[str, Any]:
+        test_profits = [metric(row["test_metrics"], "profit_pct") for row in results]
+        growth = 1.0
+        for profit in test_profits:
+            growth *= 1 + profit / 100.0
+        # test profit per day relative to train profit per day (the metrics' total_days include the warmup bars),
+        # over the folds with a profitable train result
+        efficiencies = []
+        for row in results:
+            train_profit = metric(row["train_metrics"], "profit_pct")
+            if train_profit > 0:
+                efficiencies.append((metric(row["test_metrics"], "profit_pct") / row["test_days"])
+                                    / (train_profit / row["train_days"]))
+        return {
+            "test_profit_pct_mean": sum(test_profits) / len(test_profits) if len(test_profits) > 0 else 0.0,
+            "test_profit_pct_total": 100.0 * (growth - 1),
+            "profitable_folds": len([profit for profit in test_profits if profit > 0]),
+            "test_max_drawdown_pct_worst": min([metric(row["test_metrics"], "max_drawdown_pct") for row in results],
+                                               default=0.0),
+            "walk_forward_efficiency": sum(efficiencies) / len(efficiencies) if len(efficiencies) > 0 else None,
+        }
+
+
+def main():
+    parser = build_arg_parser()
+    parser.description = "Walk-forward runs of the staged optimizer: optimize on each train fold, score on the next test fold."
+    parser.add_argument("--train-days", type=float, default=360, help="Days of history each fold optimizes on.")
+    parser.add_argument("--test-days", type=float, default=90, help="Days after the train window the result is scored on.")
+    parser.add_argument("--step-days", type=float, default=None, help="Shift between folds (default: --test-days).")
+    parser.add_argument("--anchored", action="store_true", help="Train windows all start at the first bar.")
+    parser.add_argument("--fold-workers", type=int, default=1, help="Folds optimized in parallel processes.")
+    args = parser.parse_args()
+    WalkForwardRunner(args).run()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
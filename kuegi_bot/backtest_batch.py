@@ -0,0 +1,104 @@
+import copy
+from typing import List
+
+from kuegi_bot.backtest_engine import BackTest
+from kuegi_bot.bots.trading_bot import TradingBot
+from kuegi_bot.bots.strategies.trend_indicator_provider import share_precomputed_providers
+from kuegi_bot.utils.trading_classes import Symbol
+
+
+class BatchBackTest:
+    '''
+    runs N independent (bot, account) pairs over the same bars in one pass.
+    every bot gets its own BackTest (account, order book, stats, early stop) and its own copies of the bars, since
+    bot_data/did_change live on them. the batch only shares the work that is the same for all of them: the subbars
+    of each bar, the funding lookup and (share_indicators) the precomputed trend indicator snapshot of strategies
+    with equal indicator settings. the backtests step in lockstep per subbar, so each one sees exactly what it would see
+    in its own BackTest.run().
+    run() returns the finished BackTests in the order of the bots.
+    '''
+
+    def __init__(self, bots: List[TradingBot], bars: list, funding: dict = None, symbol: Symbol = None,
+                 market_slipage_percent=0.15, early_stop_config: dict = None, share_indicators: bool = True):
+        if share_indicators:
+            strategies = []
+            for bot in bots:
+                strategies.extend(getattr(bot, "strategies", []))
+            share_precomputed_providers(strategies)
+        self.backtests: List[BackTest] = [
+            BackTest(bot, bars=bars, funding=funding, symbol=symbol, market_slipage_percent=market_slipage_percent,
+                     early_stop_config=early_stop_config)
+            for bot in bots
+        ]
+        for bt in self.backtests[1:]:
+            bt.bars = [copy.copy(bar) for bar in bt.bars]  # same prices and subbars, own bot_data/did_change
+        self.bars = self.backtests[0].bars if len(self.backtests) > 0 else []
+
+    def _process_bar(self, i: int, backtests: List[BackTest]):
+        lead = backtests[0]
+        funding = float(lead.funding_rates[-i - 2])
+        for bt in backtests:
+            bt._open_bar(bt._window_for(i), funding)
+
+        subbars = lead._subbars_for(i + 1)
+        # subbars each backtest still has to pass over, they were part of a quiet run it already accounted for
+        skipping = [0] * len(backtests)
+        for idx in range(len(subbars) - 1, -1, -1):
+            subbar = subbars[idx]
+            if subbar.last_tick_tstamp < subbar.tstamp + 59:
+                subbar.last_tick_tstamp = subbar.tstamp + 59
+            for k, bt in enumerate(backtests):
+                bt.current_bars[0].add_subbar(subbar)
+                if skipping[k] > 0:
+                    skipping[k] -= 1
+                else:
+                    quiet_run = bt._quiet_subbars(subbars, idx)
+                    if len(quiet_run) > 0:
+                        bt.skip_quiet_subbars(quiet_run)
+                        skipping[k] = len(quiet_run) - 1
+                    else:
+                        bt.execute_subbar(subbar)
+                bt.current_bars[1].did_change = False
+
+        for bt in backtests:
+            bt._close_bar(bt.bars[-i - 2], subbars)
+
+    def run(self) -> List[BackTest]:
+        backtests = self.backtests
+        min_bars = []
+        for bt in backtests:
+            bt.reset()
+            bt.logger.info(
+                "starting backtest with " + str(len(bt.bars)) + " bars and " + str(bt.account.equity) + " equity")
+            min_bars.append(bt.bot.min_bars_needed())
+            bt._run_initial_plot_warmup(min_bars[-1])
+
+        total_bars = [max(1, len(self.bars) - needed) for needed in min_bars]
+        processed_bars = [0] * len(backtests)
+        running = list(range(len(backtests)))
+        for i in range(min(min_bars, default=len(self.bars)), len(self.bars)):
+            active = [idx for idx in running if i >= min_bars[idx]]
+            if len(active) == 0:
+                continue
+            last_bar = i == len(self.bars) - 1
+            if last_bar:
+                for idx in active:
+                    backtests[idx]._process_last_bar(i)
+            else:
+                self._process_bar(i, [backtests[idx] for idx in active])
+            for idx in active:
+                bt = backtests[idx]
+                processed_bars[idx] += 1
+                if bt._should_early_stop(processed_bars=processed_bars[idx], total_bars=total_bars[idx]):
+                    if not last_bar:
+                        bt.logger.info("early stop: processed=%d/%d reason=%s",
+                                       processed_bars[idx], total_bars[idx], str(bt.early_stop_reason))
+                    running.remove(idx)
+
+        for bt in backtests:
+            if bt.early_stopped:
+                bt.logger.info("backtest stopped early: %s", str(bt.early_stop_reason))
+            bt._force_close_remaining_position()
+            bt._finalize_plot_series()
+            bt._finalize_metrics()
+        return backtests
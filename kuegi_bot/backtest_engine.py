@@ -1,20 +1,25 @@
+import bisect
 import logging
 import math
 #import statistics
 import os
 import csv
+import io
 import json
+import pickle
 
-import plotly.graph_objects as go
+import numpy as np
 
-#import plotly.express as px
 from typing import List
 
 from kuegi_bot.bots.trading_bot import TradingBot, PositionDirection
-from kuegi_bot.utils.trading_classes import OrderInterface, Bar, Account, Order, Symbol, AccountPosition, \
-    PositionStatus, OrderType
+from kuegi_bot.utils.trading_classes import OrderInterface, Bar, BarWindow, Account, Order, \
+    Symbol, AccountPosition, PositionStatus, OrderType
+from kuegi_bot.utils.bar_array import BarArray
+from kuegi_bot.utils.order_book import OrderBook
+from kuegi_bot.utils.plotting import DEFAULT_MAX_POINTS, bucket_starts, decimate_lines, decimate_ohlc, graph_objects
 from kuegi_bot.utils import log
-from datetime import datetime, timezone
+from datetime import datetime
 
 
 class SilentLogger(object):
@@ -32,11 +37,59 @@ class SilentLogger(object):
         pass
 
 
+class BackTestSnapshot:
+    ''' serialised state of a BackTest between two bars: account, open orders, bot (positions, strategies,
+    indicator state), bot_data/did_change of the bars, stats and plot rows. bars, funding, symbol and logger are
+    referenced, not copied, so it can only be resumed by a BackTest on the same bars.
+    see BackTest.run_until and resume_from '''
+
+    def __init__(self, next_bar: int, processed_bars: int, min_bars_needed: int, bars_key: tuple, state: bytes):
+        # index i of the next bar to process in the price loop
+        self.next_bar = next_bar
+        self.processed_bars = processed_bars
+        self.min_bars_needed = min_bars_needed
+        # (count, newest tstamp, oldest tstamp) of the bars it was taken on
+        self.bars_key = bars_key
+        self.state = state
+
+    def __len__(self):
+        return len(self.state)
+
+
+class _SnapshotPickler(pickle.Pickler):
+
+    def __init__(self, file, shared: dict):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.shared = shared
+
+    def persistent_id(self, obj):
+        return self.shared.get(id(obj))
+
+
+class _SnapshotUnpickler(pickle.Unpickler):
+
+    def __init__(self, file, backtest: 'BackTest'):
+        super().__init__(file)
+        self.backtest = backtest
+
+    def persistent_load(self, pid):
+        if pid[0] == "bar":
+            return self.backtest.bars[pid[1]]
+        return self.backtest._snapshot_refs()[pid[0]]
+
+
 class BackTest(OrderInterface):
+    # not part of a snapshot: shared with the run (see _snapshot_refs), settings of the resuming backtest or rebuilt
+    _SNAPSHOT_STATIC = {"bars", "bar_array", "funding", "firstFunding", "lastFunding", "funding_rates",
+                        "symbol", "logger", "order_book",
+                        "early_stop_config", "_early_stop_tiers", "_early_stop_tier_progress", "_snapshot_shared"}
 
     def __init__(self, bot: TradingBot, bars: list, funding: dict = None, symbol: Symbol = None,
                  market_slipage_percent=0.15, early_stop_config: dict = None):
-        self.bars: List[Bar] = bars
+        # a BarArray is materialized without subbars, those get created per bar while running
+        self.bar_array: BarArray = bars if isinstance(bars, BarArray) else None
+        # bot_data/did_change of the bars are wiped in reset(), so runs one after the other can share the bars
+        self.bars: List[Bar] = bars.shared_bars() if self.bar_array is not None else bars
         self.funding = funding
         self.firstFunding = 9999999999
         self.lastFunding = 0
@@ -44,6 +97,8 @@ class BackTest(OrderInterface):
             for key in funding.keys():
                 self.firstFunding = min(self.firstFunding, key)
                 self.lastFunding = max(self.lastFunding, key)
+        # funding rate of every bar (aligned with self.bars), applied by index when the bar opens
+        self.funding_rates: np.ndarray = self._funding_vector()
         self.handles_executions = True
         self.logger = bot.logger
         self.bot = bot
@@ -66,6 +121,7 @@ class BackTest(OrderInterface):
         self.taker_fee = self._normalize_fee_rate(getattr(self.symbol, "takerFee", self.taker_fee), "takerFee")
 
         self.account: Account = None
+        self.order_book: OrderBook = None
         self.initialEquity = 100  # BTC
         self.drawdown_basis_equity = self.initialEquity
 
@@ -79,18 +135,18 @@ class BackTest(OrderInterface):
         self.current_bars: List[Bar] = []
         self.unrealized_equity = 0
         self.cum_funding_for_dd = 0
-        self.total_equity_vec = []
-        self.equity_vec = []
-        self.unrealized_equity_vec = []
-        self.hh_vec = []
-        self.ll_vec = []
-        self.dd_vec = []
-        self.maxDD_vec = []
-        self.wallet_equity_vec = []
+        # per bar plot series, recorded into preallocated arrays while running (see write_plot_data)
+        self._plot_rows = 0
+        self._plot_data: np.ndarray = None
+        self._plot_hh = 0.0
+        self._plot_max_dd = 0.0
         self.early_stop_config = dict(early_stop_config) if isinstance(early_stop_config, dict) else {}
+        self._prepare_early_stop_tiers()
         self.early_stopped = False
         self.early_stop_reason = None
         self.last_processed_bar = None
+        self.last_processed_subbars = None
+        self._snapshot_shared = None
         self.reset()
 
     def _normalize_fee_rate(self, rate, field_name: str) -> float:
@@ -115,6 +171,8 @@ class BackTest(OrderInterface):
 
     def reset(self):
         self.account = Account()
+        # orderKeyForSort is relative to the newest bar, which is the same for the whole run
+        self.order_book = OrderBook(ref_close=self.bars[0].close, ref_open=self.bars[0].open)
         self.account.open_position.walletBalance = self.initialEquity
         self.account.open_position.quantity = 0
         self.account.equity = self.account.open_position.walletBalance
@@ -128,16 +186,19 @@ class BackTest(OrderInterface):
         self.unrealized_equity=0
         self.cum_funding_for_dd  = 0
         self.drawdown_basis_equity = self.initialEquity
-        self.total_equity_vec = []
-        self.equity_vec = []
-        self.unrealized_equity_vec = []
-        self.hh_vec = []
-        self.ll_vec = []
-        self.dd_vec = []
-        self.wallet_equity_vec = []
+        # columns: wallet balance, unrealized equity, total equity, drawdown basis. one row per bar
+        self._plot_rows = 0
+        self._plot_data = np.empty((len(self.bars), 4))
+        self._plot_hh = 0.0
+        self._plot_max_dd = 0.0
+        self._set_plot_series(0)
         self.early_stopped = False
         self.early_stop_reason = None
+        # running counter of closed trades in bot.position_history, see _current_closed_trades
+        self._closed_trades = 0
+        self._history_counted = 0
         self.last_processed_bar = None
+        self.last_processed_subbars = None
         self.bot.reset()
         if hasattr(self.bot, "set_backtest_bars"):
             self.bot.set_backtest_bars(self.bars)
@@ -146,7 +207,11 @@ class BackTest(OrderInterface):
         for b in self.bars:
             b.did_change = True
             b.bot_data = {"indicators": {}}
-        self.bot.init(self.bars[-self.bot.min_bars_needed():], self.account, self.symbol, None)
+        min_bars = self.bot.min_bars_needed()
+        self.bot.init(BarWindow(self.bars, start=max(0, len(self.bars) - min_bars)) if min_bars > 0
+                      else BarWindow(self.bars), self.account, self.symbol, None)
+        # fixed for the run, the MultiStrategyBot property walks all strategies and exit modules
+        self._needs_intrabar_ticks = self.bot.needs_intrabar_ticks
 
     # implementing OrderInterface
 
@@ -168,27 +233,39 @@ class BackTest(OrderInterface):
         order.tstamp = self.current_bars[0].tstamp
         if order not in self.account.open_orders:  # bot might add it himself temporarily.
             self.account.open_orders.append(order)
+        if order not in self.order_book:
+            self.order_book.add(order)
+
+    def _open_order_by_id(self, order_id):
+        order = self.order_book.get(order_id)
+        if (order is None or len(self.order_book) != len(self.account.open_orders)) \
+                and not self.order_book.matches(self.account.open_orders):
+            # someone changed account.open_orders directly
+            self.order_book.rebuild(self.account.open_orders)
+            order = self.order_book.get(order_id)
+        return order
 
     def update_order(self, order: Order):
-        for existing_order in self.account.open_orders:
-            if existing_order.id == order.id:
-                self.account.open_orders.remove(existing_order)
-                self.account.open_orders.append(order)
-                order.tstamp = self.current_bars[0].last_tick_tstamp
-                self.logger.debug("updated order %s" % (order.print_info()))
-                break
+        existing_order = self._open_order_by_id(order.id)
+        if existing_order is not None:
+            self.account.open_orders.remove(existing_order)
+            self.account.open_orders.append(order)
+            self.order_book.remove(existing_order)
+            self.order_book.add(order)  # moved to the end -> new arrival
+            order.tstamp = self.current_bars[0].last_tick_tstamp
+            self.logger.debug("updated order %s" % (order.print_info()))
 
     def cancel_order(self, order_to_cancel):
-        for order in self.account.open_orders:
-            if order.id == order_to_cancel.id:
-                order.active = False
-                order.final_tstamp = self.current_bars[0].tstamp
-                order.final_reason = 'cancel'
-
-                self.account.order_history.append(order)
-                self.account.open_orders.remove(order)
-                self.logger.debug("canceled order " + order_to_cancel.id)
-                break
+        order = self._open_order_by_id(order_to_cancel.id)
+        if order is not None:
+            order.active = False
+            order.final_tstamp = self.current_bars[0].tstamp
+            order.final_reason = 'cancel'
+
+            self.account.order_history.append(order)
+            self.account.open_orders.remove(order)
+            self.order_book.remove(order)
+            self.logger.debug("canceled order " + order_to_cancel.id)
 
     # ----------
     def handle_order_execution(self, order: Order, intrabar: Bar, force_taker=False):
@@ -237,27 +314,14 @@ class BackTest(OrderInterface):
         self.bot.on_execution(order_id=order.id, amount=amount, executed_price=price, tstamp=intrabar.tstamp)
         self.account.order_history.append(order)
         self.account.open_orders.remove(order)
+        self.order_book.remove(order)
         self.logger.debug(
             "executed order %s | %.0f %.5f | %.5f@ %.1f" % (
                 order.id, self.account.usd_equity, self.account.open_position.quantity, order.executed_amount,
                 order.executed_price))
 
     def orderKeyForSort(self, order):
-        if order.trigger_price is None and order.limit_price is None:
-            return 0
-        # sort buys after sells (higher number) when bar is falling
-        long_fac = 1 if self.bars[0].close > self.bars[0].open else 2
-        short_fac = 1 if self.bars[0].close < self.bars[0].open else 2
-        if order.trigger_price is not None:
-            if order.amount > 0:
-                return order.trigger_price
-            else:
-                return -order.trigger_price
-        else:  # limit -> bigger numbers to be sorted after the stops
-            if order.amount > 0:
-                return (self.bars[0].close + self.bars[0].close - order.limit_price) + self.bars[0].close * long_fac
-            else:
-                return order.limit_price + self.bars[0].close * short_fac
+        return self.order_book.sort_key(order)
 
     def check_executions(self, intrabar_to_check: Bar, only_on_close):
         another_round = True
@@ -265,6 +329,8 @@ class BackTest(OrderInterface):
         allowed_order_ids = None
         if not only_on_close:
             allowed_order_ids = set(map(lambda o: o.id, self.account.open_orders))
+        if not self.order_book.matches(self.account.open_orders):
+            self.order_book.rebuild(self.account.open_orders)
         loopbreak = 0
         while another_round:
             if loopbreak > 100:
@@ -273,12 +339,8 @@ class BackTest(OrderInterface):
             loopbreak += 1
             another_round = False
             should_execute = False
-            orders = self.account.open_orders
-            if len(orders) <= 1:
-                iterable_orders = orders
-            else:
-                iterable_orders = sorted(orders, key=self.orderKeyForSort)
-            for order in iterable_orders:
+            # only the orders whose level the subbar crossed, in orderKeyForSort order
+            for order in self.order_book.crossed(intrabar_to_check.high, intrabar_to_check.low):
                 if allowed_order_ids is not None and order.id not in allowed_order_ids:
                     continue
                 force_taker = False
@@ -291,18 +353,19 @@ class BackTest(OrderInterface):
                     if (order.amount > 0 and order.trigger_price < intrabar_to_check.high) or (
                             order.amount < 0 and order.trigger_price > intrabar_to_check.low):
                         order.stop_triggered = True
-                        something_changed = True
                         if order.limit_price is None:
                             # execute stop market
                             should_execute = True
                             if only_on_close:  # order just came in and executed right away: execution on the worst price cause can't assume anything better
                                 order.trigger_price = intrabar_to_check.low if order.amount < 0 else intrabar_to_check.high
 
-                        elif ((order.amount > 0 and order.limit_price > intrabar_to_check.close) or (
-                                order.amount < 0 and order.limit_price < intrabar_to_check.close)):
-                            # close below/above limit: got definitly executed
-                            should_execute = True
-                            force_taker = True  # need to assume taker.
+                        else:
+                            self.order_book.refresh(order)  # now waits for its limit
+                            if ((order.amount > 0 and order.limit_price > intrabar_to_check.close) or (
+                                    order.amount < 0 and order.limit_price < intrabar_to_check.close)):
+                                # close below/above limit: got definitly executed
+                                should_execute = True
+                                force_taker = True  # need to assume taker.
                 else:  # means order.limit_price and (order.stop_price is None or order.stop_triggered):
                     # check for limit execution
                     ref = intrabar_to_check.low if order.amount > 0 else intrabar_to_check.high
@@ -323,9 +386,14 @@ class BackTest(OrderInterface):
 
     def handle_subbar(self, intrabarToCheck: Bar):
         self.current_bars[0].add_subbar(intrabarToCheck)  # so bot knows about the current intrabar
-        if len(self.account.open_orders) == 0:
-            # No active orders to evaluate against this subbar, so we can directly tick once.
-            self.bot.on_tick(self.current_bars, self.account)
+        self.execute_subbar(intrabarToCheck)
+
+    def execute_subbar(self, intrabarToCheck: Bar):
+        ''' orders, bot tick, equity and stats for a subbar that is already part of the forming bar '''
+        if len(self.account.open_orders) == 0 or self._is_quiet(intrabarToCheck):
+            # no order can execute on this subbar, only the bot needs to know about it
+            if self._needs_intrabar_ticks:
+                self.bot.on_tick(self.current_bars, self.account)
         else:
             # first the ones that are there at the beginning
             something_changed_on_existing_orders = self.check_executions(intrabarToCheck, False)
@@ -335,12 +403,25 @@ class BackTest(OrderInterface):
             if not something_changed_on_existing_orders and not something_changed_on_second_pass:  # no execution happened -> execute on tick now
                 self.bot.on_tick(self.current_bars, self.account)
 
+        self.update_equity(intrabarToCheck.close)
+        self.update_stats()
+
+    def skip_quiet_subbars(self, subbars: List[Bar]):
+        ''' a run of quiet subbars (oldest first, see _quiet_subbars) that is already part of the forming bar:
+        only equity and stats get updated, stats in one pass for the whole run '''
+        closes = [subbar.close for subbar in subbars]
+        self.update_equity(closes[-1])
+        # the position doesn't change during the run, so the highest exposure comes from the extreme close
+        self.update_stats(ticks=len(subbars),
+                          exposure_close=min(closes) if self.symbol.isInverse else max(closes))
+
+    def update_equity(self, close: float):
         # update equity = balance + current value of open position
         avgEntry = self.account.open_position.avgEntryPrice
         if avgEntry != 0:
             posValue = self.account.open_position.quantity * (
-                (intrabarToCheck.close - avgEntry) if not self.symbol.isInverse else (
-                        -1 / intrabarToCheck.close + 1 / avgEntry))
+                (close - avgEntry) if not self.symbol.isInverse else (
+                        -1 / close + 1 / avgEntry))
         else:
             posValue = 0
 
@@ -353,12 +434,11 @@ class BackTest(OrderInterface):
         # - still includes realized PnL and trading fees
         self.drawdown_basis_equity = self.account.open_position.walletBalance + self.cum_funding_for_dd
 
-        self.account.usd_equity = self.account.equity * intrabarToCheck.close
+        self.account.usd_equity = self.account.equity * close
         self.unrealized_equity = posValue
 
-        self.update_stats()
-
-    def update_stats(self):
+    def update_stats(self, ticks: int = 1, exposure_close: float = None):
+        ''' ticks > 1: same stats as that many calls with unchanged position and balance '''
 
         if math.fabs( # TODO: why?
                 self.account.open_position.quantity) < 1 or self.lastHHPosition * self.account.open_position.quantity < 0:
@@ -368,12 +448,14 @@ class BackTest(OrderInterface):
         if dd > self.maxDD:
             self.maxDD = dd
 
+        if exposure_close is None:
+            exposure_close = self.current_bars[0].close
         exposure = abs(self.account.open_position.quantity) * (
-            1 / self.current_bars[0].close if self.symbol.isInverse else self.current_bars[0].close)
+            1 / exposure_close if self.symbol.isInverse else exposure_close)
         self.maxExposure = max(self.maxExposure, exposure)
         # inside write_plot_data, after equity_vec append
         if self.drawdown_basis_equity < self.hh:
-            self.underwater += 1
+            self.underwater += ticks
         else:
             self.underwater = 0
         self.max_underwater = max(self.max_underwater, self.underwater)
@@ -387,40 +469,70 @@ class BackTest(OrderInterface):
         else:
             unrealized_equity = 0
 
-        #self.equity_vec.append(self.drawdown_basis_equity)
-        self.equity_vec.append(self.account.open_position.walletBalance)
-        self.wallet_equity_vec.append(self.account.open_position.walletBalance)
-        self.unrealized_equity_vec.append(unrealized_equity)
-        self.total_equity_vec.append(self.account.equity)
+        if self._plot_rows == len(self._plot_data):
+            self._plot_data = np.resize(self._plot_data, (max(16, 2 * len(self._plot_data)), 4))
         dd_basis = self.drawdown_basis_equity
-
-        self.hh_vec.append(
-            dd_basis if len(self.hh_vec) == 0
-            else (dd_basis if dd_basis > self.hh_vec[-1] else self.hh_vec[-1])
-        )
-
-        self.ll_vec.append(
-            dd_basis if len(self.ll_vec) == 0
-            else (dd_basis if dd_basis < self.ll_vec[-1] else self.ll_vec[-1])
-        )
-
-        self.dd_vec.append(-(self.hh_vec[-1] - dd_basis))
-
-        self.maxDD_vec.append(
-            self.dd_vec[0] if len(self.maxDD_vec) == 0
-            else (self.dd_vec[-1] if self.dd_vec[-1] < self.maxDD_vec[-1] else self.maxDD_vec[-1])
-        )
-
-    def do_funding(self):
+        row = self._plot_data[self._plot_rows]
+        row[0] = self.account.open_position.walletBalance
+        row[1] = unrealized_equity
+        row[2] = self.account.equity
+        row[3] = dd_basis
+
+        # running values for the early stop checks, the series are derived in _finalize_plot_series
+        if self._plot_rows == 0 or dd_basis > self._plot_hh:
+            self._plot_hh = dd_basis
+        dd = -(self._plot_hh - dd_basis)
+        if self._plot_rows == 0 or dd < self._plot_max_dd:
+            self._plot_max_dd = dd
+        self._plot_rows += 1
+
+    def _set_plot_series(self, rows: int):
+        data = self._plot_data[:rows]
+        self.equity_vec = data[:, 0]
+        self.wallet_equity_vec = data[:, 0]
+        self.unrealized_equity_vec = data[:, 1]
+        self.total_equity_vec = data[:, 2]
+        dd_basis = data[:, 3]
+        self.hh_vec = np.maximum.accumulate(dd_basis)
+        self.ll_vec = np.minimum.accumulate(dd_basis)
+        self.dd_vec = -(self.hh_vec - dd_basis)
+        self.maxDD_vec = np.minimum.accumulate(self.dd_vec)
+
+    def _finalize_plot_series(self):
+        ''' derives high-water mark, low, drawdown and max drawdown of the recorded bars in one pass '''
+        self._set_plot_series(self._plot_rows)
+
+    def funding_rate(self, bar: Bar) -> float:
         funding = 0
-        bar = self.current_bars[0]
         if self.funding is not None and self.firstFunding <= bar.tstamp <= self.lastFunding:
             if bar.tstamp in self.funding:
                 funding = self.funding[bar.tstamp]
+        elif (bar.tstamp // 3600) % 8 == 0:  # utc hour 0, 8 or 16
+            funding = 0.0001
+        return funding
+
+    def _funding_vector(self) -> np.ndarray:
+        ''' funding_rate of all bars at once '''
+        if self.bar_array is not None:
+            tstamps = self.bar_array.tstamp[::-1].astype(np.int64)
         else:
-            dt = datetime.fromtimestamp(bar.tstamp, tz=timezone.utc)
-            if dt.hour in (0, 8, 16):
-                funding = 0.0001
+            tstamps = np.fromiter((bar.tstamp for bar in self.bars), dtype=np.int64, count=len(self.bars))
+        rates = np.where((tstamps // 3600) % 8 == 0, 0.0001, 0.0)
+        if self.funding is not None and len(self.funding) > 0:
+            keys = np.fromiter(self.funding.keys(), dtype=np.int64, count=len(self.funding))
+            values = np.fromiter(self.funding.values(), dtype=float, count=len(self.funding))
+            order = np.argsort(keys)
+            keys, values = keys[order], values[order]
+            pos = np.minimum(np.searchsorted(keys, tstamps), len(keys) - 1)
+            known = (self.firstFunding <= tstamps) & (tstamps <= self.lastFunding)
+            rates = np.where(known, np.where(keys[pos] == tstamps, values[pos], 0.0), rates)
+        return rates
+
+    def do_funding(self, funding: float = None):
+        ''' funding: rate of the current bar if already known (see funding_rates) '''
+        bar = self.current_bars[0]
+        if funding is None:
+            funding = self.funding_rate(bar)
 
         if funding != 0 and self.account.open_position.quantity != 0:
             qty = self.account.open_position.quantity
@@ -436,10 +548,9 @@ class BackTest(OrderInterface):
         for _idx in range(0, min_bars_needed):
             self.write_plot_data()
 
-    def _process_backtest_bar(self, i: int):
-        self.current_bars = self.bars[-(i + 1):]
-        next_bar = self.bars[-i - 2]
-        forming_bar = Bar(
+    @staticmethod
+    def _forming_bar(next_bar: Bar) -> Bar:
+        return Bar(
             tstamp=next_bar.tstamp,
             open=next_bar.open,
             high=next_bar.open,
@@ -448,27 +559,102 @@ class BackTest(OrderInterface):
             volume=0,
             subbars=[],
         )
-        self.current_bars.insert(0, forming_bar)
+
+    def _window_for(self, i: int) -> List[Bar]:
+        # bars[-(i + 1):] with the forming bar in front. a plain list since the bot indexes it on every tick, one copy
+        # per bar instead of slice + insert. the indicators slice it through BarWindow views, not per tick
+        current_bars = self.bars[-i - 2:]
+        current_bars[0] = self._forming_bar(self.bars[-i - 2])
+        return current_bars
+
+    def _open_bar(self, current_bars: List[Bar], funding: float = None):
+        ''' start of a new bar: funding, the bot's tick on the opened bar and the plot row '''
+        self.current_bars = current_bars
         self.current_bars[0].did_change = True
         self.current_bars[1].did_change = True
 
-        self.do_funding()
+        self.do_funding(funding)
         self.bot.on_tick(self.current_bars, self.account)
         self.write_plot_data()
 
-        for subbar in reversed(next_bar.subbars):
-            if subbar.last_tick_tstamp < subbar.tstamp + 59:
-                subbar.last_tick_tstamp = subbar.tstamp + 59
-            self.handle_subbar(subbar)
-            self.current_bars[1].did_change = False
-
-        next_bar.bot_data = forming_bar.bot_data
+    def _close_bar(self, next_bar: Bar, subbars: List[Bar]):
+        next_bar.bot_data = self.current_bars[0].bot_data
         for bar in self.current_bars:
             if bar.did_change:
                 bar.did_change = False
                 continue
             break
         self.last_processed_bar = next_bar
+        self.last_processed_subbars = subbars
+
+    def _process_backtest_bar(self, i: int):
+        next_bar = self.bars[-i - 2]
+        self._open_bar(self._window_for(i), float(self.funding_rates[-i - 2]))
+
+        current_bars = self.current_bars
+        subbars = self._subbars_for(i + 1)
+        batch_quiet = not self._needs_intrabar_ticks
+        idx = len(subbars) - 1
+        while idx >= 0:
+            if batch_quiet:
+                quiet_run = self._quiet_subbars(subbars, idx)
+                if len(quiet_run) > 0:
+                    current_bars[0].add_subbars(quiet_run)
+                    self.skip_quiet_subbars(quiet_run)
+                    current_bars[1].did_change = False
+                    idx -= len(quiet_run)
+                    continue
+            subbar = subbars[idx]
+            if subbar.last_tick_tstamp < subbar.tstamp + 59:
+                subbar.last_tick_tstamp = subbar.tstamp + 59
+            current_bars[0].add_subbar(subbar)  # handle_subbar, without the extra call per subbar
+            self.execute_subbar(subbar)
+            current_bars[1].did_change = False
+            idx -= 1
+
+        self._close_bar(next_bar, subbars)
+
+    def _process_last_bar(self, i: int):
+        # the newest bar has no following bar to replay, it only gets its plot row
+        self.last_processed_bar = self.bars[0]
+        self.last_processed_subbars = self._subbars_for(i)
+        self.write_plot_data()
+
+    def _quiet_range(self):
+        # runs on every subbar, so only the count is compared. orders that got added or removed directly on
+        # account.open_orders are caught here, check_executions does the full compare before any execution
+        if len(self.order_book) != len(self.account.open_orders):
+            self.order_book.rebuild(self.account.open_orders)
+        return self.order_book.quiet_range()
+
+    def _is_quiet(self, subbar: Bar) -> bool:
+        # the subbar stays inside the nearest levels, no order can execute on it
+        quiet_range = self._quiet_range()
+        return quiet_range is not None and quiet_range[0] < subbar.low and subbar.high < quiet_range[1]
+
+    def _quiet_subbars(self, subbars: List[Bar], idx: int) -> List[Bar]:
+        ''' consecutive quiet subbars from subbars[idx] on (towards index 0 = newer), oldest first. only for bots
+        without intrabar ticks, for the others nothing happens between executions that could be batched '''
+        if self._needs_intrabar_ticks:
+            return []
+        quiet_range = self._quiet_range()
+        if quiet_range is None:
+            return []
+        lower, upper = quiet_range
+        result = []
+        while idx >= 0 and lower < subbars[idx].low and subbars[idx].high < upper:
+            subbar = subbars[idx]
+            if subbar.last_tick_tstamp < subbar.tstamp + 59:
+                subbar.last_tick_tstamp = subbar.tstamp + 59
+            result.append(subbar)
+            idx -= 1
+        return result
+
+    def _subbars_for(self, i: int) -> List[Bar]:
+        # subbars of self.bars[-i - 1], created on demand when running off a BarArray
+        if self.bar_array is None:
+            return self.bars[-i - 1].subbars
+        return self.bar_array.subbars_of(i)
 
     def _current_profit_pct(self) -> float:
         if self.initialEquity <= 0:
@@ -476,16 +662,30 @@ class BackTest(OrderInterface):
         return 100.0 * (self.account.equity - self.initialEquity) / self.initialEquity
 
     def _current_max_dd_pct(self) -> float:
-        if self.initialEquity <= 0 or len(self.maxDD_vec) == 0:
+        if self.initialEquity <= 0 or self._plot_rows == 0:
             return 0.0
-        return 100.0 * self.maxDD_vec[-1] / self.initialEquity
+        return 100.0 * self._plot_max_dd / self.initialEquity
 
     def _current_closed_trades(self) -> int:
-        n_closed = 0
-        for pos in self.bot.position_history:
-            if pos.status == PositionStatus.CLOSED:
-                n_closed += 1
-        return n_closed
+        # position_closed only appends to the history, so each position needs to be looked at once
+        history = self.bot.position_history
+        if len(history) < self._history_counted:
+            self._history_counted = 0  # history got replaced
+            self._closed_trades = 0
+        for idx in range(self._history_counted, len(history)):
+            if history[idx].status == PositionStatus.CLOSED:
+                self._closed_trades += 1
+        self._history_counted = len(history)
+        return self._closed_trades
+
+    def _prepare_early_stop_tiers(self):
+        tiers = self.early_stop_config.get("tiers", [])
+        if not isinstance(tiers, list):
+            tiers = []
+        tiers = sorted([tier for tier in tiers if isinstance(tier, dict)],
+                       key=lambda row: float(row.get("min_progress", 0.0)))
+        self._early_stop_tiers = tiers
+        self._early_stop_tier_progress = [float(tier.get("min_progress", 0.0)) for tier in tiers]
 
     def _should_early_stop(self, processed_bars: int, total_bars: int) -> bool:
         cfg = self.early_stop_config
@@ -516,40 +716,32 @@ class BackTest(OrderInterface):
                 )
                 return True
 
-        tiers = cfg.get("tiers", [])
-        if isinstance(tiers, list) and len(tiers) > 0:
-            active = []
-            for tier in tiers:
-                if not isinstance(tier, dict):
-                    continue
-                tier_progress = float(tier.get("min_progress", 0.0))
-                if progress >= tier_progress:
-                    active.append(tier)
-            if len(active) > 0:
-                active = sorted(active, key=lambda row: float(row.get("min_progress", 0.0)))
-                tier = active[-1]
-                tier_max_dd = tier.get("max_dd_pct")
-                if tier_max_dd is not None:
-                    current_dd_pct = self._current_max_dd_pct()
-                    if current_dd_pct < float(tier_max_dd):
-                        self.early_stopped = True
-                        self.early_stop_reason = "tier max_dd_pct=%.2f below threshold=%.2f at progress=%.3f" % (
-                            current_dd_pct,
-                            float(tier_max_dd),
-                            progress,
-                        )
-                        return True
-                tier_min_profit = tier.get("min_profit_pct")
-                if tier_min_profit is not None:
-                    current_profit_pct = self._current_profit_pct()
-                    if current_profit_pct < float(tier_min_profit):
-                        self.early_stopped = True
-                        self.early_stop_reason = "tier profit_pct=%.2f below threshold=%.2f at progress=%.3f" % (
-                            current_profit_pct,
-                            float(tier_min_profit),
-                            progress,
-                        )
-                        return True
+        # the active tier is the one with the highest min_progress reached
+        tier_idx = bisect.bisect_right(self._early_stop_tier_progress, progress) - 1
+        if tier_idx >= 0:
+            tier = self._early_stop_tiers[tier_idx]
+            tier_max_dd = tier.get("max_dd_pct")
+            if tier_max_dd is not None:
+                current_dd_pct = self._current_max_dd_pct()
+                if current_dd_pct < float(tier_max_dd):
+                    self.early_stopped = True
+                    self.early_stop_reason = "tier max_dd_pct=%.2f below threshold=%.2f at progress=%.3f" % (
+                        current_dd_pct,
+                        float(tier_max_dd),
+                        progress,
+                    )
+                    return True
+            tier_min_profit = tier.get("min_profit_pct")
+            if tier_min_profit is not None:
+                current_profit_pct = self._current_profit_pct()
+                if current_profit_pct < float(tier_min_profit):
+                    self.early_stopped = True
+                    self.early_stop_reason = "tier profit_pct=%.2f below threshold=%.2f at progress=%.3f" % (
+                        current_profit_pct,
+                        float(tier_min_profit),
+                        progress,
+                    )
+                    return True
 
         max_dd_pct = cfg.get("max_dd_pct")
         if max_dd_pct is not None:
@@ -575,13 +767,13 @@ class BackTest(OrderInterface):
 
         return False
 
-    def _run_price_loop(self, min_bars_needed: int):
+    def _run_price_loop(self, min_bars_needed: int, start: int = None, stop: int = None,
+                        processed_bars: int = 0) -> int:
+        ''' processes the bars start..stop-1 (default: all after the warmup), returns the processed bar count '''
         total_bars = max(1, len(self.bars) - min_bars_needed)
-        processed_bars = 0
-        for i in range(min_bars_needed, len(self.bars)):
+        for i in range(min_bars_needed if start is None else start, len(self.bars) if stop is None else stop):
             if i == len(self.bars) - 1:
-                self.last_processed_bar = self.bars[0]
-                self.write_plot_data()
+                self._process_last_bar(i)
                 processed_bars += 1
                 if self._should_early_stop(processed_bars=processed_bars, total_bars=total_bars):
                     break
@@ -596,13 +788,16 @@ class BackTest(OrderInterface):
                     str(self.early_stop_reason),
                 )
                 break
+        return processed_bars
 
     def _force_close_remaining_position(self):
         if abs(self.account.open_position.quantity) <= self.symbol.lotSize / 10:
             return
         ref_bar = self.last_processed_bar if self.last_processed_bar is not None else self.bars[0]
-        if len(ref_bar.subbars) > 0:
-            close_bar = ref_bar.subbars[-1]
+        ref_subbars = self.last_processed_subbars if self.last_processed_bar is not None \
+            else self._subbars_for(len(self.bars) - 1)
+        if len(ref_subbars) > 0:
+            close_bar = ref_subbars[-1]
         else:
             close_bar = Bar(
                 tstamp=ref_bar.tstamp,
@@ -641,7 +836,7 @@ class BackTest(OrderInterface):
         first_ts = self.bars[0].tstamp
         last_ts = self.bars[-1].tstamp
         total_days = max(1e-9, abs(last_ts - first_ts) / (60 * 60 * 24))
-        max_dd = -self.maxDD_vec[-1]
+        max_dd = -float(self.maxDD_vec[-1])
 
         if max_dd > 0 and final_equity != self.initialEquity:
             rel = final_equity / max_dd
@@ -784,7 +979,7 @@ class BackTest(OrderInterface):
             "profit_abs": performance["profit"],
             "profit_pct": 100.0 * performance["profit"] / self.initialEquity if self.initialEquity > 0 else 0.0,
             "max_drawdown_abs": performance["max_dd"],
-            "max_drawdown_pct": 100.0 * self.maxDD_vec[-1] / self.initialEquity if self.initialEquity > 0 else 0.0,
+            "max_drawdown_pct": 100.0 * float(self.maxDD_vec[-1]) / self.initialEquity if self.initialEquity > 0 else 0.0,
             "max_exposure_abs": self.maxExposure,
             "max_exposure_pct": 100.0 * self.maxExposure / self.initialEquity if self.initialEquity > 0 else 0.0,
             "total_days": performance["total_days"],
@@ -805,25 +1000,98 @@ class BackTest(OrderInterface):
         min_bars_needed = self.bot.min_bars_needed()
         self._run_initial_plot_warmup(min_bars_needed)
         self._run_price_loop(min_bars_needed)
+        return self._finish_run()
+
+    def _finish_run(self):
         if self.early_stopped:
             self.logger.info("backtest stopped early: %s", str(self.early_stop_reason))
         self._force_close_remaining_position()
+        self._finalize_plot_series()
         self._finalize_metrics()
         return self
 
-    def plot_equity_stats(self):
-        self.logger.info("creating equity plot")
+    def run_until(self, tstamp: int) -> BackTestSnapshot:
+        ''' runs from the start through the last bar that opens before tstamp and returns the snapshot there.
+        the backtest is left in that state, resume_from(snapshot) finishes it '''
+        self.reset()
+        self.logger.info(
+            "starting backtest with " + str(len(self.bars)) + " bars and " + str(self.account.equity) + " equity")
+        min_bars_needed = self.bot.min_bars_needed()
+        self._run_initial_plot_warmup(min_bars_needed)
+        stop = min_bars_needed
+        while stop < len(self.bars) - 1 and self.bars[-stop - 2].tstamp < tstamp:
+            stop += 1
+        processed_bars = self._run_price_loop(min_bars_needed, stop=stop)
+        # after an early stop the loop is done, resuming only finishes the run
+        return self.snapshot(next_bar=len(self.bars) if self.early_stopped else stop, processed_bars=processed_bars,
+                             min_bars_needed=min_bars_needed)
+
+    def _snapshot_refs(self) -> dict:
+        # everything the state references but doesn't own
+        return {"backtest": self, "bars": self.bars, "bar_array": self.bar_array, "funding": self.funding,
+                "symbol": self.symbol, "logger": self.logger}
+
+    def snapshot(self, next_bar: int, processed_bars: int, min_bars_needed: int) -> BackTestSnapshot:
+        if self._snapshot_shared is None:
+            self._snapshot_shared = {id(bar): ("bar", idx) for idx, bar in enumerate(self.bars)}
+        shared = dict(self._snapshot_shared)
+        for key, value in self._snapshot_refs().items():
+            if value is not None:
+                shared[id(value)] = (key,)
+        state = {key: value for key, value in self.__dict__.items() if key not in self._SNAPSHOT_STATIC}
+        # the bars are shared, but their bot_data/did_change belong to the run
+        state["bar_state"] = [(bar.bot_data, bar.did_change) for bar in self.bars]
+        buffer = io.BytesIO()
+        _SnapshotPickler(buffer, shared).dump(state)
+        return BackTestSnapshot(next_bar=next_bar, processed_bars=processed_bars, min_bars_needed=min_bars_needed,
+                                bars_key=self._bars_key(), state=buffer.getvalue())
+
+    def resume_from(self, snapshot: BackTestSnapshot, configure=None):
+        ''' restores the state of the snapshot (replacing account, bot and stats of this backtest) and runs it to the
+        end. configure(bot) is called on the restored bot before, e.g. to change parameters that could not have
+        made a difference before the snapshot. can be called repeatedly on the same snapshot. '''
+        if snapshot.bars_key != self._bars_key():
+            raise ValueError("snapshot was taken on different bars")
+        state = _SnapshotUnpickler(io.BytesIO(snapshot.state), self).load()
+        for bar, (bot_data, did_change) in zip(self.bars, state.pop("bar_state")):
+            bar.bot_data = bot_data
+            bar.did_change = did_change
+        self.__dict__.update(state)
+        # the book is keyed by object identity, rebuilt from the restored orders (same arrival order)
+        self.order_book = OrderBook(ref_close=self.bars[0].close, ref_open=self.bars[0].open)
+        self.order_book.rebuild(self.account.open_orders)
+        if configure is not None:
+            configure(self.bot)
+        if not self.early_stopped:
+            self._run_price_loop(snapshot.min_bars_needed, start=snapshot.next_bar,
+                                 processed_bars=snapshot.processed_bars)
+        return self._finish_run()
+
+    def _bars_key(self) -> tuple:
+        return len(self.bars), self.bars[0].tstamp, self.bars[-1].tstamp
+
+    def _chronological_columns(self):
+        ''' tstamp, open, high, low, close of the bars as arrays, oldest bar first '''
+        if self.bar_array is not None:
+            return (self.bar_array.tstamp, self.bar_array.open, self.bar_array.high, self.bar_array.low,
+                    self.bar_array.close)
+        bars = self.bars[::-1]
+        return tuple(np.fromiter((getattr(bar, column) for bar in bars), dtype=float, count=len(bars))
+                     for column in ("tstamp", "open", "high", "low", "close"))
+
+    def _bucket_bars(self, starts: np.ndarray) -> List[Bar]:
+        # newest bar of every display bucket, newest first like self.bars. it carries the indicator values of the bucket
+        ends = np.append(starts[1:], len(self.bars)) - 1
+        return [self.bars[len(self.bars) - 1 - end] for end in ends[::-1].tolist()]
+
+    def _plot_time(self, tstamps: np.ndarray) -> list:
         barcenter = (self.bars[0].tstamp - self.bars[1].tstamp) / 2
-        time = list(map(lambda b: datetime.fromtimestamp(b.tstamp + barcenter), self.bars))
-
-        #self.unrealized_equity_vec.reverse()
-        self.total_equity_vec.reverse()
-        #self.hh_vec.reverse()
-        #self.ll_vec.reverse()
-        self.equity_vec.reverse()
-        self.maxDD_vec.reverse()
-        self.dd_vec.reverse()
+        return [datetime.fromtimestamp(tstamp + barcenter) for tstamp in tstamps.tolist()]
 
+    def plot_equity_stats(self, max_points: int = DEFAULT_MAX_POINTS):
+        go = graph_objects()
+        self.logger.info("creating equity plot")
+        # series are recorded oldest first, one row per bar from the oldest on
         sub_data ={
             #'unrealized equity':self.unrealized_equity_vec,
             'total equity':self.total_equity_vec,
@@ -835,7 +1103,6 @@ class BackTest(OrderInterface):
 
         # only plot wallet equity if the vector exists and has data
         if hasattr(self, "wallet_equity_vec") and len(self.wallet_equity_vec) > 0:
-            self.wallet_equity_vec.reverse()
             sub_data['wallet equity'] = self.wallet_equity_vec
 
         colors = {
@@ -849,32 +1116,29 @@ class BackTest(OrderInterface):
             "DD": 'orange'
         }
 
+        rows = len(self.total_equity_vec)
+        rows_to_plot = decimate_lines(list(sub_data.values()), bucket_starts(rows, max_points))
+        time = self._plot_time(self._chronological_columns()[0][:rows][rows_to_plot])
         data_abs = []
         for key in sub_data.keys():
             data_abs.append(
-                go.Scatter(x=time, y=sub_data.get(key), name=(key + ': %.1f' % sub_data.get(key)[0]),
+                go.Scatter(x=time, y=sub_data.get(key)[rows_to_plot], name=(key + ': %.1f' % sub_data.get(key)[-1]),
                            line=dict(color=colors.get(key, 'gray'), width=2))
             )
         fig_abs = go.Figure(data = data_abs)
         return fig_abs
 
-    def plot_normalized_stats(self):
+    def plot_normalized_stats(self, max_points: int = DEFAULT_MAX_POINTS):
+        go = graph_objects()
         self.logger.info("creating plot with normalized indicators")
-        barcenter = (self.bars[0].tstamp - self.bars[1].tstamp) / 2
-
-        time = list(map(lambda b: datetime.fromtimestamp(b.tstamp + barcenter), self.bars))
-        open = list(map(lambda b: b.open, self.bars))
-        high = list(map(lambda b: b.high, self.bars))
-        low = list(map(lambda b: b.low, self.bars))
-        close = list(map(lambda b: b.close, self.bars))
-
+        tstamp, open, high, low, close = self._chronological_columns()
         normalizing_factor = 100
 
         # Normalize your price data
-        normalized_open = [o / max(open) * normalizing_factor for o in open]
-        normalized_high = [h / max(high) * normalizing_factor for h in high]
-        normalized_low = [l / max(low) * normalizing_factor for l in low]
-        normalized_close = [c / max(close) * normalizing_factor for c in close]
+        normalized = [values / values.max() * normalizing_factor for values in (open, high, low, close)]
+        starts = bucket_starts(len(tstamp), max_points)
+        normalized_open, normalized_high, normalized_low, normalized_close = decimate_ohlc(*normalized, starts)
+        time = self._plot_time(tstamp[starts])
 
         fig = go.Figure()
         #    data=[go.Candlestick(x=time, open=open, high=high, low=low, close=close, name=self.symbol.symbol)])
@@ -882,26 +1146,27 @@ class BackTest(OrderInterface):
                                      close=normalized_close, name=self.symbol.symbol, opacity=0.5))
 
         self.logger.info("adding normalized indicators to price chart from strategy and bot")
-        self.bot.add_to_normalized_plot(fig, self.bars, time)
+        self.bot.add_to_normalized_plot(fig, self._bucket_bars(starts), time[::-1])
         fig.update_layout(xaxis_rangeslider_visible=False)
         fig.update_layout(hovermode='x')
         return fig
 
-    def plot_price_data(self):
-        barcenter = (self.bars[0].tstamp - self.bars[1].tstamp) / 2
+    def plot_price_data(self, max_points: int = DEFAULT_MAX_POINTS):
+        ''' candles merged to at most max_points / 4 buckets for long histories, indicators of the newest bar per bucket.
+        max_points=0 plots every bar '''
+        go = graph_objects()
         self.logger.info("creating price chart")
-        time = list(map(lambda b: datetime.fromtimestamp(b.tstamp + barcenter), self.bars))
-        open = list(map(lambda b: b.open, self.bars))
-        high = list(map(lambda b: b.high, self.bars))
-        low = list(map(lambda b: b.low, self.bars))
-        close = list(map(lambda b: b.close, self.bars))
+        tstamp, open, high, low, close = self._chronological_columns()
+        starts = bucket_starts(len(tstamp), max_points)
+        open, high, low, close = decimate_ohlc(open, high, low, close, starts)
+        time = self._plot_time(tstamp[starts])
 
         #self.logger.info("creating plot")
         fig = go.Figure(
             data=[go.Candlestick(x=time, open=open, high=high, low=low, close=close, name=self.symbol.symbol)])
 
         self.logger.info("adding strategy and bot data to price chart")
-        self.bot.add_to_price_data_plot(fig, self.bars, time)
+        self.bot.add_to_price_data_plot(fig, self._bucket_bars(starts), time[::-1])
 
         fig.update_layout(xaxis_rangeslider_visible=False)
         return fig
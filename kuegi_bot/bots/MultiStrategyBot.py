@@ -2,14 +2,19 @@ import math
 from functools import reduce
 from random import randint
 
-import plotly.graph_objects as go
 from kuegi_bot.bots.trading_bot import TradingBot
 from kuegi_bot.utils.trading_classes import Position, Account, Bar, Symbol
-from kuegi_bot.utils.telegram import TelegramBot
-from typing import List
+from typing import List, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import plotly.graph_objects as go
+    from kuegi_bot.utils.telegram import TelegramBot
 
 
 class Strategy:
+    # set to False if the strategy only acts on new bars. exit modules are checked separately
+    needs_intrabar_ticks = True
+
     def __init__(self):
         self.logger = None
         self.order_interface = None
@@ -18,7 +23,7 @@ class Strategy:
         self.risk_type = 0  # 0= all equal, 1= 1 atr eq 1 R
         self.atr_factor_risk = 1
         self.max_risk_mul = 1
-        self.telegram: TelegramBot = None
+        self.telegram: 'TelegramBot' = None
         self._signal_prefix = None
         self._backtest_bars = None
 
@@ -75,13 +80,13 @@ class Strategy:
     def consolidate_positions(self, is_new_bar, bars, account, open_positions_of_strat: dict):
         pass
 
-    def add_to_price_data_plot(self, fig: go.Figure, bars: List[Bar], time):
+    def add_to_price_data_plot(self, fig: 'go.Figure', bars: List[Bar], time):
         pass
 
-    def add_to_normalized_plot(self, fig: go.Figure, bars: List[Bar], time):
+    def add_to_normalized_plot(self, fig: 'go.Figure', bars: List[Bar], time):
         pass
 
-    def with_telegram(self, telegram: TelegramBot):
+    def with_telegram(self, telegram: 'TelegramBot'):
         self.telegram = telegram
 
     def withRM(self, risk_factor: float = 0.01, max_risk_mul: float = 2, risk_type: int = 0, atr_factor: float = 1):
@@ -164,6 +169,16 @@ class MultiStrategyBot(TradingBot):
                 max_needed = bars_needed
         return max_needed
 
+    @property
+    def needs_intrabar_ticks(self) -> bool:
+        for strategy in self.strategies:
+            if strategy.needs_intrabar_ticks:
+                return True
+            for module in getattr(strategy, "exitModules", []):
+                if module.needs_intrabar_ticks:
+                    return True
+        return False
+
     def prep_bars(self, bars: list):
         newbar = self.is_new_bar
         #if not self.got_data_for_position_sync(bars):
@@ -312,12 +327,12 @@ class MultiStrategyBot(TradingBot):
 
             self.call_with_open_positions_for_strat(strat, run_consolidation)
 
-    def add_to_price_data_plot(self, fig: go.Figure, bars: List[Bar], time):
+    def add_to_price_data_plot(self, fig: 'go.Figure', bars: List[Bar], time):
         super().add_to_price_data_plot(fig, bars, time)
         for strat in self.strategies:
             strat.add_to_price_data_plot(fig, bars, time)
 
-    def add_to_normalized_plot(self, fig: go.Figure, bars: List[Bar], time):
+    def add_to_normalized_plot(self, fig: 'go.Figure', bars: List[Bar], time):
         super().add_to_normalized_plot(fig, bars, time)
         for strat in self.strategies:
             strat.add_to_normalized_plot(fig, bars, time)
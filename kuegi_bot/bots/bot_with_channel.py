@@ -1,11 +1,13 @@
-from typing import List
+from typing import List, TYPE_CHECKING
 import math
-import plotly.graph_objects as go
 
 from kuegi_bot.bots.trading_bot import TradingBot
 from kuegi_bot.indicators.kuegi_channel import KuegiChannel, Data
 from kuegi_bot.utils.trading_classes import Bar, Account, Symbol, OrderType, Position
 
+if TYPE_CHECKING:
+    import plotly.graph_objects as go
+
 
 class BotWithChannel(TradingBot):
     def __init__(self, logger, directionFilter: int = 0):
@@ -54,7 +56,7 @@ class BotWithChannel(TradingBot):
                               self.risk_factor, self.max_risk_mul, self.risk_type,
                               self.be_factor, self.be_buffer,
                               self.trail_active, self.delayed_swing_trail, self.trail_to_swing, self.trail_back))
-            self.channel.on_tick(bars)
+            self.channel.fill_history(bars)
         super().init(bars=bars, account=account, symbol=symbol, unique_id=unique_id)
 
     def min_bars_needed(self):
@@ -148,7 +150,7 @@ class BotWithChannel(TradingBot):
         else:
             return current_stop
 
-    def add_to_price_data_plot(self, fig: go.Figure, bars: List[Bar], time):
+    def add_to_price_data_plot(self, fig: 'go.Figure', bars: List[Bar], time):
         super().add_to_price_data_plot(fig, bars, time)
         lines = self.channel.get_number_of_lines()
         styles = self.channel.get_line_styles()
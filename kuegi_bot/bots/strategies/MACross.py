@@ -1,6 +1,5 @@
 import math
-from typing import List
-import plotly.graph_objects as go
+from typing import List, TYPE_CHECKING
 
 from kuegi_bot.bots.strategies.strat_with_exit_modules import StrategyWithExitModulesAndFilter
 from kuegi_bot.bots.trading_bot import TradingBot, PositionDirection
@@ -8,6 +7,9 @@ from kuegi_bot.indicators.indicator import SMA, BarSeries, highest, lowest
 from kuegi_bot.indicators.swings import Swings, Data
 from kuegi_bot.utils.trading_classes import Bar, Account, Symbol, OrderType, Position, Order, PositionStatus
 
+if TYPE_CHECKING:
+    import plotly.graph_objects as go
+
 
 class MACross(StrategyWithExitModulesAndFilter):
 
@@ -24,9 +26,9 @@ class MACross(StrategyWithExitModulesAndFilter):
         super().init(bars, account, symbol)
         self.logger.info("init with %d,%d,%d,%d" %
                          (self.fastMA.period, self.slowMA.period, self.swings.before, self.swings.after))
-        self.fastMA.on_tick(bars)
-        self.slowMA.on_tick(bars)
-        self.swings.on_tick(bars)
+        self.fastMA.fill_history(bars)
+        self.slowMA.fill_history(bars)
+        self.swings.fill_history(bars)
 
     def min_bars_needed(self) -> int:
         return max(self.fastMA.period, self.slowMA.period, self.swings.before + self.swings.after) + 1
@@ -127,7 +129,7 @@ class MACross(StrategyWithExitModulesAndFilter):
                                                   amount=-amount, trigger=stop, limit=None))
             pos.status = PositionStatus.OPEN
 
-    def add_to_price_data_plot(self, fig: go.Figure, bars: List[Bar], time):
+    def add_to_price_data_plot(self, fig: 'go.Figure', bars: List[Bar], time):
         super().add_to_price_data_plot(fig, bars, time)
         styles = self.swings.get_line_styles()
         styles.extend(self.slowMA.get_line_styles())
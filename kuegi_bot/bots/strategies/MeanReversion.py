@@ -1,6 +1,5 @@
 import math
-from typing import List
-import plotly.graph_objects as go
+from typing import List, TYPE_CHECKING
 
 from kuegi_bot.bots.strategies.strat_with_exit_modules import StrategyWithExitModulesAndFilter
 from kuegi_bot.bots.trading_bot import TradingBot, PositionDirection
@@ -9,6 +8,9 @@ from kuegi_bot.indicators.indicator import SMA, BarSeries, highest, lowest
 from kuegi_bot.indicators.swings import Swings, Data
 from kuegi_bot.utils.trading_classes import Bar, Account, Symbol, OrderType, Position, Order, PositionStatus
 
+if TYPE_CHECKING:
+    import plotly.graph_objects as go
+
 
 class MeanReversion(StrategyWithExitModulesAndFilter):
 
@@ -27,7 +29,7 @@ class MeanReversion(StrategyWithExitModulesAndFilter):
     def init(self, bars: List[Bar], account: Account, symbol: Symbol):
         super().init(bars, account, symbol)
         self.logger.info(f"init with {self.mean.period},{self.entry_factor},{self.tp_factor},{self.sl_factor}")
-        self.mean.on_tick(bars)
+        self.mean.fill_history(bars)
 
     def min_bars_needed(self) -> int:
         return self.mean.period + 1
@@ -167,7 +169,7 @@ class MeanReversion(StrategyWithExitModulesAndFilter):
                       limit=shortEntry))
 
 
-    def add_to_price_data_plot(self, fig: go.Figure, bars: List[Bar], time):
+    def add_to_price_data_plot(self, fig: 'go.Figure', bars: List[Bar], time):
         super().add_to_price_data_plot(fig, bars, time)
         styles = self.mean.get_line_styles()
 
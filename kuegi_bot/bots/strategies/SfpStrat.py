@@ -9,6 +9,9 @@ from kuegi_bot.utils.trading_classes import Bar, Account, Symbol, OrderType, Pos
 
 
 class SfpStrategy(ChannelStrategy):
+    # entries on new bars, the channel trail only uses closed bars
+    needs_intrabar_ticks = False
+
     def __init__(self, tp_fac: float = 0, tp_use_atr: bool= False,
                  init_stop_type: int = 0,stop_buffer_fac:int=2, min_stop_diff_perc:float = 0, ignore_on_tight_stop:bool = False,
                  min_wick_fac: float = 0.2, min_air_wick_fac: float = 0.0, min_wick_to_body:float= 0.5,
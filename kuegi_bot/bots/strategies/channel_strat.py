@@ -1,12 +1,14 @@
-from typing import List
+from typing import List, TYPE_CHECKING
 import math
-import plotly.graph_objects as go
 
 from kuegi_bot.bots.strategies.strat_with_exit_modules import StrategyWithExitModulesAndFilter
 from kuegi_bot.bots.trading_bot import TradingBot, PositionDirection
 from kuegi_bot.indicators.kuegi_channel import KuegiChannel, Data
 from kuegi_bot.utils.trading_classes import Bar, Account, Symbol, OrderType, Order, PositionStatus, Position
 
+if TYPE_CHECKING:
+    import plotly.graph_objects as go
+
 
 class ChannelStrategy(StrategyWithExitModulesAndFilter):
 
@@ -43,7 +45,7 @@ class ChannelStrategy(StrategyWithExitModulesAndFilter):
                               self.channel.max_dist_factor, self.channel.max_swing_length,
                               self.risk_factor, self.max_risk_mul, self.risk_type, self.atr_factor_risk,
                               self.trail_active, self.delayed_swing_trail, self.trail_to_swing, self.trail_back))
-            self.channel.on_tick(bars)
+            self.channel.fill_history(bars)
 
     def min_bars_needed(self) -> int:
         return self.channel.max_look_back + 1
@@ -227,7 +229,7 @@ class ChannelStrategy(StrategyWithExitModulesAndFilter):
             pos.status = PositionStatus.OPEN
             open_positions[posId] = pos
 
-    def add_to_price_data_plot(self, fig: go.Figure, bars: List[Bar], time):
+    def add_to_price_data_plot(self, fig: 'go.Figure', bars: List[Bar], time):
         super().add_to_price_data_plot(fig, bars, time)
         lines = self.channel.get_number_of_lines()
         styles = self.channel.get_line_styles()
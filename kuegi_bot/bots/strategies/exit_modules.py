@@ -34,6 +34,9 @@ def _has_closed_bar_after_entry(bars, position) -> bool:
 
 
 class ExitModule:
+    # most modules trail/move the stop intrabar. set to False if the module only acts on new bars
+    needs_intrabar_ticks = True
+
     def __init__(self):
         self.logger = None
         self.symbol= None
@@ -199,6 +202,7 @@ class MaxSLDiff(ExitModule):
 
 class TimedExit(ExitModule):
     ''' time based breakeven and exit '''
+    needs_intrabar_ticks = False  # acts on the first tick of a bar per position
 
     def __init__(self, longs_min_to_exit:int= 240, shorts_min_to_exit: int = 240, longs_min_to_breakeven: int = 2,
                  shorts_min_to_breakeven: int = 2, atrPeriod: int = 14):
@@ -274,6 +278,7 @@ class TimedExit(ExitModule):
 
 class RsiExit(ExitModule):
     """ closes positions at oversold and overbougt RSI """
+    needs_intrabar_ticks = False
     def __init__(self, rsi_high_lim: float = 100, rsi_low_lim: int = 0):
         super().__init__()
         self.rsi_high_lim = rsi_high_lim
@@ -428,6 +433,8 @@ class ATRrangeSL(ExitModule):
     ''' trails the stop to "to a new position" when the price moves a given factor of the entry-risk in the right direction
         "break even" includes a buffer (multiple of the entry-risk).
     '''
+    # the target only depends on closed bars, repeating it within the bar doesn't move the stop again
+    needs_intrabar_ticks = False
 
     def __init__(self, rangeFacTrigger, longRangefacSL, shortRangefacSL, rangeATRfactor: float = 0, atrPeriod: int = 10):
         super().__init__()
@@ -9,6 +9,9 @@ from kuegi_bot.utils.trading_classes import Bar, Account, Symbol, OrderType, Pos
 
 
 class KuegiStrategy(ChannelStrategy):
+    # entries on new bars, the channel trail only uses closed bars
+    needs_intrabar_ticks = False
+
     def __init__(self, max_channel_size_factor: float = 6, min_channel_size_factor: float = 0,
                  entry_tightening=0, bars_till_cancel_triggered=3,
                  limit_entry_offset_perc: float = None, delayed_entry: bool = True, delayed_cancel: bool = False,
@@ -7,6 +7,9 @@ from kuegi_bot.utils.trading_classes import Bar, Account, Symbol, OrderType, Ord
 
 
 class StrategyWithTradeManagement(StrategyWithExitModulesAndFilter):
+    # entries, cancels and the stop rules only look at closed bars, triggered orders get ticked by the backtest anyway
+    needs_intrabar_ticks = False
+
     def __init__(self, close_on_opposite: bool = False, bars_till_cancel_triggered: int = 3, delayed_cancel: bool = False,
                  cancel_on_filter:bool = False, tp_fac: float = 0, maxPositions: int = 100, consolidate: bool = False,
                  limit_entry_offset_perc: float = -0.1):
@@ -1,7 +1,6 @@
 import math
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, TYPE_CHECKING
 
-import plotly.graph_objects as go
 import numpy as np
 import talib
 
@@ -24,6 +23,9 @@ from kuegi_bot.bots.trading_bot import TradingBot, PositionDirection
 from kuegi_bot.indicators.indicator import Indicator
 from kuegi_bot.utils.trading_classes import Bar, Account, Symbol, OrderType, Order, PositionStatus, Position
 
+if TYPE_CHECKING:
+    import plotly.graph_objects as go
+
 
 class DataStrategyOne:
     def __init__(self):
@@ -352,7 +354,7 @@ class StrategyOne(TrendStrategy):
         else:
             return [bar.close, bar.close, bar.close, bar.close]
 
-    def add_to_price_data_plot(self, fig: go.Figure, bars: List[Bar], time):
+    def add_to_price_data_plot(self, fig: 'go.Figure', bars: List[Bar], time):
         super().add_to_price_data_plot(fig, bars, time)
 
         # Plot TA-generated data
@@ -387,7 +389,7 @@ class StrategyOne(TrendStrategy):
             fig.add_scatter(x=time, y=sub_data[offset:], mode='lines', line=styles[1],
                             name=self.ta_strat_one.id + "_" + names[1])
 
-    def add_to_normalized_plot(self, fig: go.Figure, bars: List[Bar], time):
+    def add_to_normalized_plot(self, fig: 'go.Figure', bars: List[Bar], time):
         super().add_to_normalized_plot(fig, bars, time)
 
 
@@ -12,7 +12,9 @@ from kuegi_bot.bots.strategies.trend_enums import (
     oi_price_flow_state_from_returns,
 )
 from kuegi_bot.indicators.indicator import Indicator
+from kuegi_bot.indicators.streaming import StreamingADX, StreamingATR, StreamingRSI
 from kuegi_bot.indicators.talibbars import TAlibBars
+from kuegi_bot.utils.growable_array import GrowableArray
 from kuegi_bot.utils.trading_classes import Bar
 
 
@@ -80,6 +82,57 @@ class TAdataTrendStrategy:
         self.is_initialized = False
 
 
+class Streaming4hIndicators:
+    ''' atr, natr, slow natr, rsi and adx/di of the 4h bars as streaming kernels, with their outputs per bar for the
+    *_vec tails of TAdataTrendStrategy '''
+
+    def __init__(self, atr_period: int, natr_slow_period: int, rsi_period: int, adx_period: int):
+        self.atr = StreamingATR(atr_period)
+        self.natr_slow = StreamingATR(natr_slow_period)
+        self.rsi = StreamingRSI(rsi_period)
+        self.adx = StreamingADX(adx_period)
+        self.tstamp: Optional[int] = None
+        self.history: Dict[str, GrowableArray] = {}
+
+    def update(self, talibbars: TAlibBars) -> Dict[str, GrowableArray]:
+        ''' feeds the last closed bar to the kernels. if the bars don't continue the ones fed before
+        (first call, resynced or skipped bars) the kernels replay the whole history instead '''
+        close = talibbars.close
+        timestamps = talibbars.timestamps
+        last_tstamp = None
+        if timestamps is not None and len(timestamps) == len(close):
+            last_tstamp = int(timestamps[-1])
+            if last_tstamp == self.tstamp:
+                return self.history
+        if last_tstamp is not None and self.tstamp is not None and len(timestamps) >= 2 \
+                and int(timestamps[-2]) == self.tstamp:
+            high, low, last_close = float(talibbars.high[-1]), float(talibbars.low[-1]), float(close[-1])
+            history = self.history
+            history["atr"].append(self.atr.update(high, low, last_close))
+            history["natr"].append(self.atr.natr)
+            self.natr_slow.update(high, low, last_close)
+            history["natr_slow"].append(self.natr_slow.natr)
+            history["rsi"].append(self.rsi.update(last_close))
+            history["adx"].append(self.adx.update(high, low, last_close))
+            history["plus_di"].append(self.adx.plus_di)
+            history["minus_di"].append(self.adx.minus_di)
+        else:
+            atr, natr = self.atr.seed(talibbars.high, talibbars.low, close)
+            _, natr_slow = self.natr_slow.seed(talibbars.high, talibbars.low, close)
+            adx, plus_di, minus_di = self.adx.seed(talibbars.high, talibbars.low, close)
+            self.history = {
+                "atr": GrowableArray(atr),
+                "natr": GrowableArray(natr),
+                "natr_slow": GrowableArray(natr_slow),
+                "rsi": GrowableArray(self.rsi.seed(close)),
+                "adx": GrowableArray(adx),
+                "plus_di": GrowableArray(plus_di),
+                "minus_di": GrowableArray(minus_di),
+            }
+        self.tstamp = last_tstamp
+        return self.history
+
+
 class TATrendStrategyIndicator(Indicator):
     """Run technical analysis calculations here and store data in TAdataTrendStrategy."""
 
@@ -193,6 +246,8 @@ class TATrendStrategyIndicator(Indicator):
             (self.max_w_period + 2) * 7 * 6,
         )
         self.max_4h_history_candles = self.max_4h_period
+        # wilder smoothed 4h indicators carry their state from bar to bar instead of running talib over a window
+        self.streaming_4h = Streaming4hIndicators(self.atr_4h_period, self.natr_4h_period_slow, self.rsi_4h_period, 35)
 
     def _set_open_interest_series(self, open_interest_by_tstamp: Optional[Dict[int, float]]):
         if not isinstance(open_interest_by_tstamp, dict) or len(open_interest_by_tstamp) == 0:
@@ -383,24 +438,10 @@ class TATrendStrategyIndicator(Indicator):
         self.taData_trend_strat.bbands_4h.std_vec = a - b
 
         # Update atr_4h & natr_4h arrays
-        atr_4h_vec = talib.ATR(
-            high[-self.max_4h_period - 1 :],
-            low[-self.max_4h_period - 1 :],
-            close[-self.max_4h_period - 1 :],
-            self.atr_4h_period,
-        )
-        natr_4h_vec = talib.NATR(
-            high[-self.max_4h_period - 1 :],
-            low[-self.max_4h_period - 1 :],
-            close[-self.max_4h_period - 1 :],
-            self.atr_4h_period,
-        )
-        natr_slow_4h_vec = talib.NATR(
-            high[-self.max_4h_period - 1 :],
-            low[-self.max_4h_period - 1 :],
-            close[-self.max_4h_period - 1 :],
-            self.natr_4h_period_slow,
-        )
+        history = self.streaming_4h.update(talibbars)
+        atr_4h_vec = history["atr"].values[-self.max_4h_period - 1 :]
+        natr_4h_vec = history["natr"].values[-self.max_4h_period - 1 :]
+        natr_slow_4h_vec = history["natr_slow"].values[-self.max_4h_period - 1 :]
         self.taData_trend_strat.atr_4h_vec = atr_4h_vec
         self.taData_trend_strat.natr_4h_vec = natr_4h_vec
         self.taData_trend_strat.natr_slow_4h_vec = natr_slow_4h_vec
@@ -424,10 +465,7 @@ class TATrendStrategyIndicator(Indicator):
         ) / 2
 
         # Update RSI for 4H timeframe
-        self.taData_trend_strat.rsi_4h_vec = talib.RSI(
-            close[-min(self.max_4h_period, 200 + self.rsi_4h_period) :],
-            self.rsi_4h_period,
-        )
+        self.taData_trend_strat.rsi_4h_vec = history["rsi"].values[-min(self.max_4h_period, 200 + self.rsi_4h_period) :]
 
         # Update Volume for 4H timeframe
         self.taData_trend_strat.volume_4h = volume[-1]
@@ -516,24 +554,9 @@ class TATrendStrategyIndicator(Indicator):
             self.taData_trend_strat.oi_funding_state = OIFundingState.NEUTRAL
 
         # Update ADX / DMI for 4H timeframe
-        adx_4h_vec = talib.ADX(
-            high[-self.max_4h_period - 1 :],
-            low[-self.max_4h_period - 1 :],
-            close[-self.max_4h_period - 1 :],
-            35,
-        )
-        plus_di_4h_vec = talib.PLUS_DI(
-            high[-self.max_4h_period - 1 :],
-            low[-self.max_4h_period - 1 :],
-            close[-self.max_4h_period - 1 :],
-            35,
-        )
-        minus_di_4h_vec = talib.MINUS_DI(
-            high[-self.max_4h_period - 1 :],
-            low[-self.max_4h_period - 1 :],
-            close[-self.max_4h_period - 1 :],
-            35,
-        )
+        adx_4h_vec = history["adx"].values[-self.max_4h_period - 1 :]
+        plus_di_4h_vec = history["plus_di"].values[-self.max_4h_period - 1 :]
+        minus_di_4h_vec = history["minus_di"].values[-self.max_4h_period - 1 :]
         self.taData_trend_strat.adx_4h_vec = adx_4h_vec
         self.taData_trend_strat.plus_di_4h_vec = plus_di_4h_vec
         self.taData_trend_strat.minus_di_4h_vec = minus_di_4h_vec
@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-from datetime import datetime
+from enum import Enum
 from typing import Dict, List, Optional, Tuple
 
 import numpy as np
@@ -15,6 +15,7 @@ from kuegi_bot.bots.strategies.trend_enums import (
     oi_price_flow_state_from_returns,
 )
 from kuegi_bot.bots.strategies.trend_indicator_engine import TATrendStrategyIndicator
+from kuegi_bot.indicators.talibbars import DAY_SECONDS, WEEK_OFFSET_SECONDS, WEEK_SECONDS, resample_candles
 from kuegi_bot.utils.trading_classes import Bar
 
 
@@ -45,6 +46,9 @@ class PrecomputedTrendIndicatorProvider(TrendIndicatorProvider):
         self._fallback = IncrementalTrendIndicatorProvider(ta_indicator)
         self._ready = False
         self._signature: Optional[Tuple[int, int, int]] = None
+        # bars of the last on_new_bar call, strategies sharing this provider (see share_precomputed_providers)
+        # get the same snapshot for the same bars
+        self._last_bars = None
 
         self._index_by_tstamp: Dict[int, int] = {}
         self._timestamps = np.array([], dtype=np.int64)
@@ -54,6 +58,7 @@ class PrecomputedTrendIndicatorProvider(TrendIndicatorProvider):
         self._close = np.array([], dtype=float)
         self._volume = np.array([], dtype=float)
 
+        self._daily_tstamp = np.array([], dtype=np.int64)
         self._daily_open = np.array([], dtype=float)
         self._daily_high = np.array([], dtype=float)
         self._daily_low = np.array([], dtype=float)
@@ -61,6 +66,7 @@ class PrecomputedTrendIndicatorProvider(TrendIndicatorProvider):
         self._daily_close_idx_4h = np.array([], dtype=np.int64)
         self._daily_count_by_4h_idx = np.array([], dtype=np.int64)
 
+        self._weekly_tstamp = np.array([], dtype=np.int64)
         self._weekly_open = np.array([], dtype=float)
         self._weekly_high = np.array([], dtype=float)
         self._weekly_low = np.array([], dtype=float)
@@ -107,6 +113,11 @@ class PrecomputedTrendIndicatorProvider(TrendIndicatorProvider):
     def on_new_bar(self, bars: List[Bar]):
         if len(bars) < 2:
             return
+        if bars is self._last_bars:
+            # snapshot is already there, only the plot data goes to the bars of the calling run
+            self.ta_indicator.write_data_for_plot(bars)
+            return
+        self._last_bars = bars
         if not self._ready:
             self._fallback.on_new_bar(bars)
             return
@@ -118,6 +129,30 @@ class PrecomputedTrendIndicatorProvider(TrendIndicatorProvider):
 
         self._apply_snapshot(idx, bars)
 
+    @property
+    def timestamps(self) -> np.ndarray:
+        return self._timestamps
+
+    def gate_features(self) -> Dict[str, np.ndarray]:
+        ''' per bar values (chronological, same index as the snapshots) the common entry rules of StrategyOne gate on.
+        nan where the rule sees no value '''
+        with np.errstate(divide="ignore", invalid="ignore"):
+            vol_ratio = np.where(np.isfinite(self._volume_sma) & (self._volume_sma != 0),
+                                 self._volume / self._volume_sma, np.nan)
+            oi_ratio = np.where(np.isfinite(self._oi) & np.isfinite(self._oi_sma) & (np.abs(self._oi_sma) > 1e-12),
+                                self._oi / self._oi_sma, np.nan)
+            atr_std_ratio = np.where(np.isfinite(self._bb_std) & (np.abs(self._bb_std) > 1e-12),
+                                     self._atr / self._bb_std, np.nan)
+        return {
+            "rsi_4h": np.asarray(self._rsi_4h, dtype=float),
+            "rsi_d": np.array([np.nan if value is None else value for value in self._rsi_d_by_idx], dtype=float),
+            "natr_4h": np.asarray(self._natr, dtype=float),
+            "vol_ratio": vol_ratio,
+            "oi_ratio_4h": oi_ratio,
+            "oi_4h": np.asarray(self._oi, dtype=float),
+            "atr_std_ratio": atr_std_ratio,
+        }
+
     def _build_precomputed_data(self, bars: List[Bar]):
         chrono = list(reversed(bars))
         timestamps = [int(bar.tstamp) for bar in chrono]
@@ -142,56 +177,35 @@ class PrecomputedTrendIndicatorProvider(TrendIndicatorProvider):
 
     def _build_daily_and_weekly_candles(self):
         n = len(self._timestamps)
-        daily_start = self._find_daily_start_index(self._timestamps)
-
-        if daily_start is None:
+        daily = resample_candles(self._timestamps, self._open, self._high, self._low, self._close, DAY_SECONDS)
+        if len(daily.tstamp) == 0:
             self._reset_calendar_arrays(n)
             return
 
-        daily_open_idx = np.arange(daily_start, n, 6, dtype=np.int64)
-        daily_close_idx = np.arange(daily_start + 5, n, 6, dtype=np.int64)
-        complete_daily = min(len(daily_open_idx), len(daily_close_idx))
-        daily_open_idx = daily_open_idx[:complete_daily]
-        daily_close_idx = daily_close_idx[:complete_daily]
-
-        self._daily_open = self._open[daily_open_idx]
-        self._daily_close = self._close[daily_close_idx]
-        self._daily_high = np.array([np.max(self._high[idx : idx + 6]) for idx in daily_open_idx], dtype=float)
-        self._daily_low = np.array([np.min(self._low[idx : idx + 6]) for idx in daily_open_idx], dtype=float)
-        self._daily_close_idx_4h = daily_close_idx
+        self._daily_tstamp = daily.tstamp
+        self._daily_open = daily.open
+        self._daily_close = daily.close
+        self._daily_high = daily.high
+        self._daily_low = daily.low
+        self._daily_close_idx_4h = daily.last_idx
         self._daily_count_by_4h_idx = np.searchsorted(
             self._daily_close_idx_4h,
             np.arange(n, dtype=np.int64),
             side="right",
         )
 
-        if len(daily_open_idx) == 0:
+        weekly = resample_candles(daily.tstamp, daily.open, daily.high, daily.low, daily.close, WEEK_SECONDS,
+                                  WEEK_OFFSET_SECONDS, bar_seconds=DAY_SECONDS)
+        if len(weekly.tstamp) == 0:
             self._reset_weekly_arrays(n)
             return
 
-        daily_open_timestamps = self._timestamps[daily_open_idx]
-        weekly_start_daily_idx = self._find_weekly_start_index(daily_open_timestamps)
-        if weekly_start_daily_idx is None:
-            self._reset_weekly_arrays(n)
-            return
-
-        weekly_open_daily_idx = np.arange(weekly_start_daily_idx, len(self._daily_open), 7, dtype=np.int64)
-        weekly_close_daily_idx = np.arange(weekly_start_daily_idx + 6, len(self._daily_close), 7, dtype=np.int64)
-        complete_weekly = min(len(weekly_open_daily_idx), len(weekly_close_daily_idx))
-        weekly_open_daily_idx = weekly_open_daily_idx[:complete_weekly]
-        weekly_close_daily_idx = weekly_close_daily_idx[:complete_weekly]
-
-        self._weekly_open = self._daily_open[weekly_open_daily_idx]
-        self._weekly_close = self._daily_close[weekly_close_daily_idx]
-        self._weekly_high = np.array(
-            [np.max(self._daily_high[idx : idx + 7]) for idx in weekly_open_daily_idx],
-            dtype=float,
-        )
-        self._weekly_low = np.array(
-            [np.min(self._daily_low[idx : idx + 7]) for idx in weekly_open_daily_idx],
-            dtype=float,
-        )
-        self._weekly_close_idx_4h = self._daily_close_idx_4h[weekly_close_daily_idx]
+        self._weekly_tstamp = weekly.tstamp
+        self._weekly_open = weekly.open
+        self._weekly_close = weekly.close
+        self._weekly_high = weekly.high
+        self._weekly_low = weekly.low
+        self._weekly_close_idx_4h = self._daily_close_idx_4h[weekly.last_idx]
         self._weekly_count_by_4h_idx = np.searchsorted(
             self._weekly_close_idx_4h,
             np.arange(n, dtype=np.int64),
@@ -441,21 +455,8 @@ class PrecomputedTrendIndicatorProvider(TrendIndicatorProvider):
 
         self.ta_indicator.write_data_for_plot(bars)
 
-    @staticmethod
-    def _find_daily_start_index(timestamps: np.ndarray) -> Optional[int]:
-        for idx, ts in enumerate(timestamps):
-            if datetime.utcfromtimestamp(int(ts)).hour == 0:
-                return idx
-        return None
-
-    @staticmethod
-    def _find_weekly_start_index(daily_open_timestamps: np.ndarray) -> Optional[int]:
-        for idx, ts in enumerate(daily_open_timestamps):
-            if datetime.utcfromtimestamp(int(ts)).weekday() == 0:
-                return idx
-        return None
-
     def _reset_weekly_arrays(self, n: int):
+        self._weekly_tstamp = np.array([], dtype=np.int64)
         self._weekly_open = np.array([], dtype=float)
         self._weekly_high = np.array([], dtype=float)
         self._weekly_low = np.array([], dtype=float)
@@ -464,6 +465,7 @@ class PrecomputedTrendIndicatorProvider(TrendIndicatorProvider):
         self._weekly_count_by_4h_idx = np.zeros(n, dtype=np.int64)
 
     def _reset_calendar_arrays(self, n: int):
+        self._daily_tstamp = np.array([], dtype=np.int64)
         self._daily_open = np.array([], dtype=float)
         self._daily_high = np.array([], dtype=float)
         self._daily_low = np.array([], dtype=float)
@@ -490,11 +492,13 @@ class PrecomputedTrendIndicatorProvider(TrendIndicatorProvider):
 
     def _write_daily_snapshot(self, talibbars, daily_count: int):
         if daily_count > 0:
+            talibbars.timestamps_daily = self._daily_tstamp[:daily_count]
             talibbars.open_daily = self._daily_open[:daily_count]
             talibbars.high_daily = self._daily_high[:daily_count]
             talibbars.low_daily = self._daily_low[:daily_count]
             talibbars.close_daily = self._daily_close[:daily_count]
             return
+        talibbars.timestamps_daily = None
         talibbars.open_daily = None
         talibbars.high_daily = None
         talibbars.low_daily = None
@@ -502,11 +506,13 @@ class PrecomputedTrendIndicatorProvider(TrendIndicatorProvider):
 
     def _write_weekly_snapshot(self, talibbars, weekly_count: int):
         if weekly_count > 0:
+            talibbars.timestamps_weekly = self._weekly_tstamp[:weekly_count]
             talibbars.open_weekly = self._weekly_open[:weekly_count]
             talibbars.high_weekly = self._weekly_high[:weekly_count]
             talibbars.low_weekly = self._weekly_low[:weekly_count]
             talibbars.close_weekly = self._weekly_close[:weekly_count]
             return
+        talibbars.timestamps_weekly = None
         talibbars.open_weekly = None
         talibbars.high_weekly = None
         talibbars.low_weekly = None
@@ -518,3 +524,38 @@ def build_trend_indicator_provider(ta_indicator: TATrendStrategyIndicator, mode:
     if normalized_mode == "precomputed":
         return PrecomputedTrendIndicatorProvider(ta_indicator)
     return IncrementalTrendIndicatorProvider(ta_indicator)
+
+
+def _share_key(value):
+    if value is None or isinstance(value, (bool, int, float, str, Enum)):
+        return value
+    if isinstance(value, np.ndarray):
+        return ("ndarray", value.dtype.str, value.shape, value.tobytes())
+    if isinstance(value, (list, tuple)) and all(elem is None or isinstance(elem, (bool, int, float, str))
+                                                for elem in value):
+        return (type(value).__name__,) + tuple(value)
+    return ("id", id(value))
+
+
+def share_precomputed_providers(strategies: List) -> int:
+    ''' strategies with the same indicator settings get one PrecomputedTrendIndicatorProvider (and indicator), so
+    backtests running in lockstep over the same bars (BatchBackTest) build and apply each snapshot once.
+    must be called before the backtests are set up. returns the number of strategies that got a shared provider '''
+    providers = {}
+    shared = 0
+    for strategy in strategies:
+        provider = getattr(strategy, "_indicator_provider", None)
+        if not isinstance(provider, PrecomputedTrendIndicatorProvider):
+            continue
+        indicator = provider.ta_indicator
+        key = (type(provider), type(indicator)) + tuple(
+            sorted((name, _share_key(value)) for name, value in vars(indicator).items()
+                   if value is not indicator.taData_trend_strat and value is not indicator.streaming_4h))
+        existing = providers.get(key)
+        if existing is None:
+            providers[key] = provider
+        elif existing is not provider:
+            strategy._indicator_provider = existing
+            strategy.ta_trend_strat = existing.ta_indicator
+            shared += 1
+    return shared
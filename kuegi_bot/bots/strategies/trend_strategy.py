@@ -1,5 +1,4 @@
-from typing import Dict, List, Optional
-import plotly.graph_objects as go
+from typing import Dict, List, Optional, TYPE_CHECKING
 
 from kuegi_bot.bots.strategies.strat_w_trade_man import StrategyWithTradeManagement
 from kuegi_bot.bots.strategies.trend_enums import MarketDynamic, MarketRegime
@@ -9,9 +8,13 @@ from kuegi_bot.bots.strategies.trend_indicator_engine import (
     TATrendStrategyIndicator,
 )
 from kuegi_bot.bots.strategies.trend_indicator_provider import build_trend_indicator_provider
+from kuegi_bot.utils.plotting import graph_objects
 from kuegi_bot.utils.trading_classes import Bar, Account, Symbol, OrderType, Order, PositionStatus, Position
 from kuegi_bot.bots.trading_bot import TradingBot
 
+if TYPE_CHECKING:
+    import plotly.graph_objects as go
+
 
 class DataTrendStrategy:
     def __init__(self):
@@ -204,7 +207,8 @@ class TrendStrategy(StrategyWithTradeManagement):
     def get_ta_data_trend_strategy(self):
         return self._indicator_provider.get_ta_data()
 
-    def add_to_price_data_plot(self, fig: go.Figure, bars: List[Bar], time):
+    def add_to_price_data_plot(self, fig: 'go.Figure', bars: List[Bar], time):
+        go = graph_objects()
         super().add_to_price_data_plot(fig, bars, time)
 
         # plot trend indicator
@@ -345,7 +349,7 @@ class TrendStrategy(StrategyWithTradeManagement):
             fig.add_scatter(x=time, y=sub_data[offset:], mode='lines', line=styles[10],
                             name=self.ta_trend_strat.id + "_" + names[10])
 
-    def add_to_normalized_plot(self, fig: go.Figure, bars: List[Bar], time):
+    def add_to_normalized_plot(self, fig: 'go.Figure', bars: List[Bar], time):
         super().add_to_normalized_plot(fig, bars, time)
 
         # get ta data settings
@@ -1,11 +1,10 @@
 import time
 
 from kuegi_bot.bots.strategies.exit_modules import ExitModule
+from kuegi_bot.utils.plotting import graph_objects
 from kuegi_bot.utils.trading_classes import Bar, Position, Symbol, OrderInterface, Account, OrderType, Order, \
     PositionStatus, ExchangeInterface
 
-import plotly.graph_objects as go
-
 from typing import List, Dict
 from datetime import datetime
 from random import randint
@@ -55,6 +54,12 @@ class TradingBot:
     def min_bars_needed(self):
         return 5
 
+    @property
+    def needs_intrabar_ticks(self) -> bool:
+        """False if the bot only acts on new bars (and executions). on subbars where no open order can trigger the
+        backtest skips the order checks for every bot, for these bots also the tick"""
+        return True
+
     def reset(self):
         self.last_time = 0
         self.open_positions = {}
@@ -793,6 +798,7 @@ class TradingBot:
     ###
 
     def create_performance_plot(self, bars: List[Bar]):
+        go = graph_objects()
         self.logger.info("preparing stats")
         if len(self.position_history) == 0:
             self.logger.info("no positions done.")
@@ -945,11 +951,12 @@ class TradingBot:
 
     def add_to_price_data_plot(self, fig, bars, time):
         self.logger.info("adding trades")
-        # trades
+        # trades, added in one layout update: fig.add_shape per trade revalidates all shapes of the figure
+        shapes = []
 
         for pos in self.open_positions.values():
             if pos.status == PositionStatus.OPEN:
-                fig.add_shape(go.layout.Shape(
+                shapes.append(dict(
                     type="line",
                     x0=datetime.fromtimestamp(pos.entry_tstamp),
                     y0=pos.filled_entry,
@@ -964,7 +971,7 @@ class TradingBot:
 
         for pos in self.position_history:
             if pos.status == PositionStatus.CLOSED:
-                fig.add_shape(go.layout.Shape(
+                shapes.append(dict(
                     type="line",
                     x0=datetime.fromtimestamp(pos.entry_tstamp),
                     y0=pos.filled_entry,
@@ -978,7 +985,7 @@ class TradingBot:
                 ))
 
             if pos.status == PositionStatus.MISSED:
-                fig.add_shape(go.layout.Shape(
+                shapes.append(dict(
                     type="line",
                     x0=datetime.fromtimestamp(pos.signal_tstamp),
                     y0=pos.wanted_entry,
@@ -991,6 +998,7 @@ class TradingBot:
                     )
                 ))
 
+        fig.update_layout(shapes=list(fig.layout.shapes) + shapes)
         fig.update_shapes(dict(xref='x', yref='y'))
 
     def add_to_normalized_plot(self, fig, bars, time):
@@ -1,8 +1,12 @@
 import math
 from typing import List
 
+import numpy as np
+
 from kuegi_bot.indicators.indicator import Indicator, get_bar_value, highest, lowest, BarSeries, clean_range
 from kuegi_bot.trade_engine import Bar
+from kuegi_bot.utils.bar_array import BarArray
+from kuegi_bot.utils.trading_classes import BarWindow
 from kuegi_bot.utils import log
 
 logger = log.setup_custom_logger()
@@ -31,6 +35,7 @@ class HMA(Indicator):
         self.maType= maType
 
     def on_tick(self, bars: List[Bar]):
+        bars = BarWindow.of(bars)
         first_changed = 0
         for idx in range(len(bars)):
             if bars[idx].did_change:
@@ -103,6 +108,58 @@ class HMA(Indicator):
         self.write_data(bars[0], Data(hma=hma, hmasum=hmasum,
                                       inner=inner, inner1=inner1, inner2=inner2))
 
+    def compute_all(self, bar_columns: BarArray):
+        if self.maType not in (0, 1) or self.halfperiod == 0:
+            return None
+        close = bar_columns.close
+        n = len(close)
+        first = self.period - 1  # first bar with a full window, the ones before just carry the close
+        result = [Data(hma=value, hmasum=None, inner=value, inner1=None, inner2=None)
+                  for value in close[:first].tolist()]
+        if n <= first:
+            return result
+
+        if self.maType == 0:
+            # first bar sums its window, then each bar adds the new close and drops the old one like process_bar.
+            # cumsum adds sequentially, so the running sums drift exactly like the bar by bar ones
+            closes = close.tolist()
+            half = self.halfperiod
+            inner1 = np.cumsum(np.concatenate(([sum(closes[first + 1 - self.period:first + 1][::-1])],
+                                               close[first + 1:] - close[first + 1 - self.period:n - self.period])))
+            inner2 = np.cumsum(np.concatenate(([sum(closes[first + 1 - half:first + 1][::-1])],
+                                               close[first + 1:] - close[first + 1 - half:n - half])))
+            inner = (2 * inner2 / self.halfperiod) - inner1 / self.period
+            inners = np.concatenate((close[:first], inner))
+            hmasum_first = inner[0]
+            for back in range(1, self.hmalength):
+                hmasum_first += inners[first - back]
+            hmasum = np.cumsum(np.concatenate(([hmasum_first],
+                                               inner[1:] - inners[first + 1 - self.hmalength:n - self.hmalength])))
+            hma = hmasum / self.hmalength
+        else:
+            inner1 = self._weighted_sums(close, first, self.period)
+            inner2 = self._weighted_sums(close, first, self.halfperiod)
+            inner = (2 * inner2 * 2 / (self.halfperiod + 1)) - inner1 * 2 / (self.period + 1)
+            inners = np.concatenate((close[:first], inner))
+            hmasum = inner.copy()
+            for back in range(1, self.hmalength):
+                hmasum += inners[first - back:n - back] * (self.hmalength - back) / self.hmalength
+            hma = hmasum * 2 / (self.hmalength + 1)
+
+        for values in zip(hma.tolist(), hmasum.tolist(), inner.tolist(), inner1.tolist(), inner2.tolist()):
+            result.append(Data(*values))
+        return result
+
+    @staticmethod
+    def _weighted_sums(close: np.ndarray, first: int, length: int):
+        ''' linear weighted sums of maType 1 over the last length closes of every bar from first on,
+        added newest first like process_bar does '''
+        n = len(close)
+        result = np.zeros(n - first)
+        for back in range(length):
+            result += close[first - back:n - back] * (length - back) / length
+        return result
+
     def get_line_names(self):
         return ["hma" + str(self.period)]
 
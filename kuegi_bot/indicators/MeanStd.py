@@ -1,8 +1,12 @@
 import math
 from typing import List
 
-from kuegi_bot.indicators.indicator import Indicator, get_bar_value, highest, lowest, BarSeries, clean_range
+import numpy as np
+
+from kuegi_bot.indicators.indicator import Indicator, get_bar_value, highest, lowest, BarSeries, clean_range, \
+    rolling_sum
 from kuegi_bot.trade_engine import Bar
+from kuegi_bot.utils.bar_array import BarArray
 from kuegi_bot.utils import log
 
 logger = log.setup_custom_logger()
@@ -50,6 +54,23 @@ class MeanStd(Indicator):
             else:
                 self.write_data(bar, None)
 
+    def compute_all(self, bar_columns: BarArray):
+        close = bar_columns.close
+        n = len(close)
+        result = [None] * min(self.period, n)
+        if n <= self.period:
+            return result
+        rows = slice(self.period, n)
+        sum = rolling_sum(close, self.period)[rows]
+        mean = sum / self.period
+        sqsum = np.zeros(n - self.period)
+        for back in range(self.period):
+            dev = close[self.period - back:n - back] - mean
+            sqsum += dev * dev / self.period
+        for mean_value, std, sum_value in zip(mean.tolist(), np.sqrt(sqsum).tolist(), sum.tolist()):
+            result.append(Data(mean=mean_value, std=std, sum=sum_value))
+        return result
+
     def get_number_of_lines(self):
         return 3
 
@@ -1,10 +1,14 @@
 from kuegi_bot.utils import log
 
-from typing import List
+from typing import List, Optional, Sequence
 
 from enum import Enum
 
-from kuegi_bot.utils.trading_classes import Bar
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from kuegi_bot.utils.bar_array import BarArray
+from kuegi_bot.utils.trading_classes import Bar, BarWindow
 
 
 class BarSeries(Enum):
@@ -22,19 +26,101 @@ def get_bar_value(bar: Bar, series: BarSeries):
     return getattr(bar, series.value)
 
 
+def bar_values(bars: List[Bar], series: BarSeries, length: int, offset: int = 0) -> List[float]:
+    ''' values of bars[offset:offset + length] (newest first, cut at the end of bars). indicators that look at the
+    same bars many times per bar read them once and use highest_of/lowest_of on the list '''
+    attr = series.value
+    return [getattr(bar, attr) for bar in bars[offset:offset + length]]
+
+
+def changed_bar_count(bars: List[Bar]) -> int:
+    ''' number of bars with did_change from the newest one on. the engines only mark the newest bars as changed,
+    so on_tick doesn't need to check the rest of the history '''
+    count = 0
+    for bar in bars:
+        if not bar.did_change:
+            break
+        count += 1
+    return count
+
+
+def highest_of(values: Sequence[float], length: int, offset: int):
+    result: float = values[offset]
+    for idx in range(offset, offset + length):
+        if result < values[idx]:
+            result = values[idx]
+    return result
+
+
+def lowest_of(values: Sequence[float], length: int, offset: int):
+    result: float = values[offset]
+    for idx in range(offset, offset + length):
+        if result > values[idx]:
+            result = values[idx]
+    return result
+
+
 def highest(bars: List[Bar], length: int, offset: int, series: BarSeries):
-    result: float = get_bar_value(bars[offset], series)
+    attr = series.value
+    result: float = getattr(bars[offset], attr)
     for idx in range(offset, offset + length):
-        if result < get_bar_value(bars[idx], series):
-            result = get_bar_value(bars[idx], series)
+        value = getattr(bars[idx], attr)
+        if result < value:
+            result = value
     return result
 
 
 def lowest(bars: List[Bar], length: int, offset: int, series: BarSeries):
-    result: float = get_bar_value(bars[offset], series)
+    attr = series.value
+    result: float = getattr(bars[offset], attr)
     for idx in range(offset, offset + length):
-        if result > get_bar_value(bars[idx], series):
-            result = get_bar_value(bars[idx], series)
+        value = getattr(bars[idx], attr)
+        if result > value:
+            result = value
+    return result
+
+
+def lagged(values: np.ndarray, lag: int) -> np.ndarray:
+    ''' row i is values[i - lag] (the value lag bars before), nan for the first lag rows '''
+    values = np.asarray(values, dtype=float)
+    result = np.full(len(values), np.nan)
+    if lag < len(values):
+        result[lag:] = values[:len(values) - lag]
+    return result
+
+
+def rolling_sum(values: np.ndarray, length: int) -> np.ndarray:
+    ''' row i is values[i] + values[i-1] + .. + values[i-length+1], added in that order like the loops over
+    bars[idx:idx + length] do, so the sums are the same as bar by bar. nan while the window is not full '''
+    values = np.asarray(values, dtype=float)
+    result = np.full(len(values), np.nan)
+    if 0 < length <= len(values):
+        total = np.zeros(len(values) - length + 1)
+        for back in range(length):
+            total += values[length - 1 - back:len(values) - back]
+        result[length - 1:] = total
+    return result
+
+
+def rolling_highest(values: np.ndarray, length: int) -> np.ndarray:
+    ''' batch version of highest(bars, length, 0, ..) for a whole chronological column: row i is the highest of
+    rows i-length+1..i, nan while the window is not full '''
+    return _rolling_extreme(values, length, np.maximum)
+
+
+def rolling_lowest(values: np.ndarray, length: int) -> np.ndarray:
+    return _rolling_extreme(values, length, np.minimum)
+
+
+def _rolling_extreme(values: np.ndarray, length: int, extreme) -> np.ndarray:
+    # one pass per bar back, much faster than a reduction over strided windows for the short lengths used here
+    values = np.asarray(values, dtype=float)
+    result = np.full(len(values), np.nan)
+    if 0 < length <= len(values):
+        window = result[length - 1:]
+        window[:] = values[length - 1:]
+        for back in range(1, length):
+            extreme(window, values[length - 1 - back:len(values) - back], out=window)
     return result
 
 
@@ -46,6 +132,20 @@ class Indicator:
     def on_tick(self, bars: List[Bar]):
         pass
 
+    def compute_all(self, bar_columns: BarArray) -> Optional[list]:
+        ''' batch version of on_tick over a whole history: the data of every bar (chronological like the columns),
+        computed from the columns in one pass. None if the indicator has no batch version '''
+        return None
+
+    def fill_history(self, bars: List[Bar]):
+        ''' writes the data on_tick(bars) would write on a fresh history, via compute_all if the indicator has it '''
+        data = self.compute_all(BarArray.from_bars(bars)) if len(bars) > 0 else None
+        if data is None:
+            self.on_tick(bars)
+            return
+        for bar, value in zip(reversed(bars), data):
+            self.write_data(bar, value)
+
     def write_data(self, bar: Bar, data):
         self.write_data_static(bar, data, self.id)
 
@@ -88,6 +188,7 @@ class SMA(Indicator):
         self.period = period
 
     def on_tick(self, bars: List[Bar]):
+        bars = BarWindow.of(bars)
         first_changed = 0
         for idx in range(len(bars)):
             if bars[idx].did_change:
@@ -109,6 +210,11 @@ class SMA(Indicator):
             else:
                 self.write_data(bar, None)
 
+    def compute_all(self, bar_columns: BarArray):
+        # like on_tick the oldest period bars stay empty, even the one with a full window
+        sma = (rolling_sum(bar_columns.close, self.period) / self.period).tolist()
+        return [None] * min(self.period, len(sma)) + sma[self.period:]
+
     def get_line_names(self):
         return ["sma" + str(self.period)]
 
@@ -143,12 +249,12 @@ from functools import reduce
 
 
 def clean_range(bars: List[Bar], offset: int, length: int):
-    ranges = []
-    for idx in range(offset, offset + length):
-        if idx < len(bars):
-            ranges.append(bars[idx].high - bars[idx].low)
+    return trimmed_mean_range([bar.high - bar.low for bar in bars[offset:offset + length]], length)
+
 
-    ranges.sort(reverse=True)
+def trimmed_mean_range(ranges: List[float], length: int):
+    ''' clean_range of the given bar ranges (up to length of them, in any order) '''
+    ranges = sorted(ranges, reverse=True)
 
     # ignore the biggest 10% of ranges
     ignored_count = int(length / 5)
@@ -156,6 +262,23 @@ def clean_range(bars: List[Bar], offset: int, length: int):
     return sum / (len(ranges) - ignored_count)
 
 
+def rolling_clean_range(high: np.ndarray, low: np.ndarray, length: int) -> np.ndarray:
+    ''' batch version of clean_range(bars, 0, length) for whole chronological columns, same values as bar by bar.
+    the first rows use the shorter history like clean_range does, nan where it has no ranges left '''
+    ranges = np.asarray(high, dtype=float) - np.asarray(low, dtype=float)
+    n = len(ranges)
+    ignored_count = int(length / 5)
+    result = np.full(n, np.nan)
+    for row in range(min(n, length - 1)):
+        if row + 1 > ignored_count:
+            result[row] = trimmed_mean_range(ranges[:row + 1].tolist(), length)
+    if length > ignored_count and n >= length:
+        windows = -np.sort(-sliding_window_view(ranges, length), axis=1)
+        # cumsum adds left to right like the reduce in trimmed_mean_range, np.sum would round differently
+        result[length - 1:] = np.cumsum(windows[:, ignored_count:], axis=1)[:, -1] / (length - ignored_count)
+    return result
+
+
 def calc_atr(bars: List[Bar], offset: int, length: int):
     ranges = []
     for idx in range(offset, offset + length):
@@ -1,7 +1,12 @@
 from typing import List
 
-from kuegi_bot.indicators.indicator import Indicator, get_bar_value, highest, lowest, BarSeries, clean_range
+import numpy as np
+
+from kuegi_bot.indicators.indicator import Indicator, BarSeries, clean_range, bar_values, highest_of, lowest_of, \
+    trimmed_mean_range, lagged, rolling_highest, rolling_lowest, rolling_clean_range, changed_bar_count
 from kuegi_bot.trade_engine import Bar
+from kuegi_bot.utils.bar_array import BarArray
+from kuegi_bot.utils.trading_classes import BarWindow
 from kuegi_bot.utils import log
 
 logger = log.setup_custom_logger()
@@ -40,10 +45,137 @@ class KuegiChannel(Indicator):
         self.max_swing_length = max_swing_length
 
     def on_tick(self, bars: List[Bar]):
-        # ignore first 5 bars
-        for idx in range(len(bars) - self.max_look_back, -1, -1):
-            if bars[idx].did_change:
-                self.process_bar(bars[idx:])
+        bars = BarWindow.of(bars)
+        # ignore first 5 bars. the changed bars are the newest ones, no need to look at the whole history
+        changed = changed_bar_count(bars)
+        for idx in range(min(changed, len(bars) - self.max_look_back + 1) - 1, -1, -1):
+            self.process_bar(bars[idx:])
+
+    def compute_all(self, bar_columns: BarArray):
+        ''' same values as process_bar on every bar. everything that only depends on the bars is done on the columns,
+        the loop just carries the reset counters and swings from bar to bar '''
+        n = len(bar_columns)
+        first = self.max_look_back - 1  # on_tick leaves the bars before without data
+        if self.max_look_back < 5:
+            return None  # process_bar would look before the first bar, leave that to on_tick
+        if n <= first:
+            return [None] * n
+        high = bar_columns.high
+        low = bar_columns.low
+        bar_range = high - low
+        atr = rolling_clean_range(high, low, self.max_look_back * 2)
+        threshold = atr * self.threshold_factor
+        maxDist = atr * self.max_dist_factor
+        buffer = atr * self.buffer_factor
+        last_buffer = np.nan_to_num(lagged(buffer, 1), nan=0.0)
+        last_buffer[first] = 0
+
+        # move_length 2 if the bar before the last one was bigger
+        long_move = lagged(bar_range, 1) < lagged(bar_range, 2)
+        move_length = np.where(long_move, 2, 1)
+        range_high = np.where(long_move, self._highest_before(high, 3), self._highest_before(high, 2))
+        range_low = np.where(long_move, self._lowest_before(low, 3), self._lowest_before(low, 2))
+        # strong move against the last bar, the counters reset if they ran long enough (see calc_trail)
+        long_reset = ((lagged(high, 1) - range_high) > threshold) & (lagged(low, 1) < low) & (range_high < low)
+        short_reset = ((range_low - lagged(low, 1)) > threshold) & (lagged(high, 1) > high) & (range_low > high)
+
+        # extremes of the last 0..max_look_back bars, 0 is the same as 1 like in lowest_of
+        lengths = range(1, self.max_look_back + 1)
+        lowest_by_length = np.array([low] + [rolling_lowest(low, length) for length in lengths])
+        highest_by_length = np.array([high] + [rolling_highest(high, length) for length in lengths])
+
+        # swing candidates for every swing length, independent of the state
+        swing_length = range(1, self.max_swing_length + 1)
+        long_swings = [self._swing_candidates(high, buffer, length, 1) for length in swing_length]
+        short_swings = [self._swing_candidates(low, buffer, length, -1) for length in swing_length]
+
+        move_lengths = move_length.tolist()
+        long_resets = long_reset.tolist()
+        short_resets = short_reset.tolist()
+        highs = high.tolist()
+        lows = low.tolist()
+        since_long = np.zeros(n, dtype=int)
+        since_short = np.zeros(n, dtype=int)
+        long_swing_values = [None] * n
+        short_swing_values = [None] * n
+        last_long = 0
+        last_short = 0
+        long_swing = None
+        short_swing = None
+        for row in range(first, n):
+            length = move_lengths[row]
+            if long_resets[row] and last_long >= length:
+                last_long = length + 1
+            else:
+                last_long = min(last_long + 1, self.max_look_back)
+            if short_resets[row] and last_short >= length:
+                last_short = length + 1
+            else:
+                last_short = min(last_short + 1, self.max_look_back)
+            since_long[row] = last_long
+            since_short[row] = last_short
+
+            sinceReset = min(last_long, last_short)
+            if sinceReset >= 3:
+                new_long = long_swing
+                new_short = short_swing
+                for idx in range(min(self.max_swing_length + 1, sinceReset - 1) - 1):
+                    if long_swings[idx][row] is not None:
+                        new_long = long_swings[idx][row]
+                        break
+                for idx in range(min(self.max_swing_length + 1, sinceReset - 1) - 1):
+                    if short_swings[idx][row] is not None:
+                        new_short = short_swings[idx][row]
+                        break
+                if long_swing is not None and long_swing < highs[row]:
+                    new_long = None
+                if short_swing is not None and short_swing > lows[row]:
+                    new_short = None
+                long_swing = new_long
+                short_swing = new_short
+            else:
+                long_swing = None
+                short_swing = None
+            long_swing_values[row] = long_swing
+            short_swing_values[row] = short_swing
+
+        rows = np.arange(n)
+        low_a = lowest_by_length[np.maximum(since_long - 1, 0), rows] - maxDist
+        low_b = lowest_by_length[since_long, rows] - last_buffer
+        long_trail = np.where(low_b > low_a, low_b, low_a)
+        high_a = highest_by_length[np.maximum(since_short - 1, 0), rows] + maxDist
+        high_b = highest_by_length[since_short, rows] + last_buffer
+        short_trail = np.where(high_b < high_a, high_b, high_a)
+
+        result = [None] * first
+        for values in zip(since_long[first:].tolist(), since_short[first:].tolist(), long_trail[first:].tolist(),
+                          short_trail[first:].tolist(), long_swing_values[first:], short_swing_values[first:],
+                          buffer[first:].tolist(), atr[first:].tolist()):
+            result.append(Data(*values))
+        return result
+
+    @staticmethod
+    def _highest_before(values: np.ndarray, lag: int):
+        ''' highest_of(values, 2, lag) of every bar '''
+        return lagged(rolling_highest(values, 2), lag)
+
+    @staticmethod
+    def _lowest_before(values: np.ndarray, lag: int):
+        return lagged(rolling_lowest(values, 2), lag)
+
+    @staticmethod
+    def _swing_candidates(values: np.ndarray, buffer: np.ndarray, length: int, direction):
+        ''' what calc_swing returns for this length on every bar, None where the length gives no swing '''
+        if direction > 0:
+            e = lagged(rolling_highest(values, length), 1)
+            preRange = lagged(rolling_highest(values, 2), length + 1)
+        else:
+            e = lagged(rolling_lowest(values, length), 1)
+            preRange = lagged(rolling_lowest(values, 2), length + 1)
+        found = (direction * (e - preRange) > 0) & (direction * (e - lagged(values, length + 1)) > buffer) \
+                & (direction * (e - values) > buffer)
+        swing = (e + direction * buffer).tolist()
+        return [value if hit else None for value, hit in zip(swing, found.tolist())]
 
     def get_data_for_plot(self, bar: Bar):
         data: Data = self.get_data(bar)
@@ -68,11 +200,17 @@ class KuegiChannel(Indicator):
         return ["longTrail", "shortTrail", "longSwing", "shortSwing"]
 
     def process_bar(self, bars: List[Bar]):
-        atr = clean_range(bars, offset=0, length=self.max_look_back * 2)
+        # highs and lows of all bars the trails and swings look at, read once
+        depth = max(self.max_look_back * 2, self.max_swing_length + 3, 5)
+        highs = bar_values(bars, BarSeries.HIGH, depth)
+        lows = bar_values(bars, BarSeries.LOW, depth)
+        atr = trimmed_mean_range([high - low for high, low in zip(highs[:self.max_look_back * 2],
+                                                                   lows[:self.max_look_back * 2])],
+                                 self.max_look_back * 2)
 
         offset = 1
         move_length = 1
-        if (bars[offset].high - bars[offset].low) < (bars[offset + 1].high - bars[offset + 1].low):
+        if (highs[offset] - lows[offset]) < (highs[offset + 1] - lows[offset + 1]):
             move_length = 2
 
         threshold = atr * self.threshold_factor
@@ -80,18 +218,18 @@ class KuegiChannel(Indicator):
         maxDist = atr * self.max_dist_factor
         buffer = atr * self.buffer_factor
 
-        [sinceLongReset, longTrail] = self.calc_trail(bars, offset, 1, move_length, threshold, maxDist)
-        [sinceShortReset, shortTrail] = self.calc_trail(bars, offset, -1, move_length, threshold, maxDist)
+        [sinceLongReset, longTrail] = self.calc_trail(bars, highs, lows, offset, 1, move_length, threshold, maxDist)
+        [sinceShortReset, shortTrail] = self.calc_trail(bars, highs, lows, offset, -1, move_length, threshold, maxDist)
 
         sinceReset = min(sinceLongReset, sinceShortReset)
 
         if sinceReset >= 3:
             last_data: Data = self.get_data(bars[1])
-            lastLongSwing = self.calc_swing(bars, 1, last_data.longSwing, sinceReset, buffer)
-            lastShortSwing = self.calc_swing(bars, -1, last_data.shortSwing, sinceReset, buffer)
-            if last_data.longSwing is not None and last_data.longSwing < bars[0].high:
+            lastLongSwing = self.calc_swing(highs, 1, last_data.longSwing, sinceReset, buffer)
+            lastShortSwing = self.calc_swing(lows, -1, last_data.shortSwing, sinceReset, buffer)
+            if last_data.longSwing is not None and last_data.longSwing < highs[0]:
                 lastLongSwing = None
-            if last_data.shortSwing is not None and last_data.shortSwing > bars[0].low:
+            if last_data.shortSwing is not None and last_data.shortSwing > lows[0]:
                 lastShortSwing = None
         else:
             lastLongSwing = None
@@ -102,34 +240,34 @@ class KuegiChannel(Indicator):
                              shortTrail=shortTrail, longSwing=lastLongSwing, shortSwing=lastShortSwing, buffer=buffer,
                              atr=atr))
 
-    def calc_swing(self, bars: List[Bar], direction, default, maxLookBack, minDelta):
-        series = BarSeries.HIGH if direction > 0 else BarSeries.LOW
+    def calc_swing(self, values: List[float], direction, default, maxLookBack, minDelta):
+        ''' values: highs (direction > 0) or lows of the bars, newest first '''
         for length in range(1, min(self.max_swing_length + 1, maxLookBack - 1)):
-            cex = lowest(bars, length, 1, series)
-            ex = highest(bars, length, 1, series)
-            preRange = highest(bars, 2, length + 1, series)
-            e = ex
-            if direction < 0:
-                e = cex
-                preRange = lowest(bars, 2, length + 1, series)
+            if direction > 0:
+                e = highest_of(values, length, 1)
+                preRange = highest_of(values, 2, length + 1)
+            else:
+                e = lowest_of(values, length, 1)
+                preRange = lowest_of(values, 2, length + 1)
             if direction * (e - preRange) > 0 \
-                    and direction * (e - get_bar_value(bars[length + 1], series)) > minDelta \
-                    and direction * (e - get_bar_value(bars[0], series)) > minDelta:
+                    and direction * (e - values[length + 1]) > minDelta \
+                    and direction * (e - values[0]) > minDelta:
                 return e + direction * minDelta
 
         return default
 
-    def calc_trail(self, bars: List[Bar], offset, direction, move_length, threshold, maxDist):
+    def calc_trail(self, bars: List[Bar], highs: List[float], lows: List[float], offset, direction, move_length,
+                   threshold, maxDist):
         if direction > 0:
-            range = highest(bars, 2, offset + move_length, BarSeries.HIGH)
-            move = bars[offset].high - range
-            last_value = bars[0].low
-            offset_value = bars[offset].low
+            range = highest_of(highs, 2, offset + move_length)
+            move = highs[offset] - range
+            last_value = lows[0]
+            offset_value = lows[offset]
         else:
-            range = lowest(bars, 2, offset + move_length, BarSeries.LOW)
-            move = range - bars[offset].low
-            last_value = bars[0].high
-            offset_value = bars[offset].high
+            range = lowest_of(lows, 2, offset + move_length)
+            move = range - lows[offset]
+            last_value = highs[0]
+            offset_value = highs[offset]
 
         last_data: Data = self.get_data(bars[1])
         if last_data is None:
@@ -151,11 +289,11 @@ class KuegiChannel(Indicator):
 
         if direction > 0:
             trail = max(
-                lowest(bars, sinceReset - 1, 0, BarSeries.LOW) - maxDist,
-                lowest(bars, sinceReset, 0, BarSeries.LOW) - last_buffer)
+                lowest_of(lows, sinceReset - 1, 0) - maxDist,
+                lowest_of(lows, sinceReset, 0) - last_buffer)
         else:
             trail = min(
-                highest(bars, sinceReset - 1, 0, BarSeries.HIGH) + maxDist,
-                highest(bars, sinceReset, 0, BarSeries.HIGH) + last_buffer)
+                highest_of(highs, sinceReset - 1, 0) + maxDist,
+                highest_of(highs, sinceReset, 0) + last_buffer)
 
         return [sinceReset, trail]
@@ -0,0 +1,225 @@
+'''
+streaming versions of the talib indicators the trend strategy needs. every kernel carries the smoothing state of
+talib forward, so update() is O(1) per bar and gives the value talib would output at the end of the whole history fed
+so far. the operations follow the ta-lib c code, values agree with talib up to float rounding (~1e-14).
+seed() replays a history and returns the outputs talib would return for it (nan during the lookback).
+'''
+import math
+
+import numpy as np
+
+
+def true_range(high: float, low: float, prev_close: float) -> float:
+    result = high - low
+    to_high = abs(prev_close - high)
+    if to_high > result:
+        result = to_high
+    to_low = abs(prev_close - low)
+    if to_low > result:
+        result = to_low
+    return result
+
+
+class StreamingEMA:
+    ''' talib.EMA: sma of the first period values, then exponential smoothing with k = 2/(period+1) '''
+
+    def __init__(self, period: int):
+        self.period = int(period)
+        self.k = 2.0 / (self.period + 1)
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self._sum = 0.0
+        self.value = math.nan
+
+    def update(self, value: float) -> float:
+        if self.count < self.period:
+            self._sum += value
+            self.count += 1
+            if self.count == self.period:
+                self.value = self._sum / self.period
+        else:
+            self.value = ((value - self.value) * self.k) + self.value
+        return self.value
+
+    def seed(self, values: np.ndarray) -> np.ndarray:
+        self.reset()
+        return np.array([self.update(value) for value in np.asarray(values, dtype=float).tolist()], dtype=float)
+
+
+class StreamingRSI:
+    ''' talib.RSI: average gain/loss of the first period changes, then wilder smoothing '''
+
+    def __init__(self, period: int):
+        self.period = int(period)
+        self.reset()
+
+    def reset(self):
+        self.count = 0  # changes seen
+        self.prev_close = None
+        self.gain = 0.0
+        self.loss = 0.0
+        self.value = math.nan
+
+    def update(self, close: float) -> float:
+        if self.prev_close is None:
+            self.prev_close = close
+            return self.value
+        change = close - self.prev_close
+        self.prev_close = close
+        self.count += 1
+        if self.count <= self.period:
+            if change < 0:
+                self.loss -= change
+            else:
+                self.gain += change
+            if self.count < self.period:
+                return self.value
+            self.loss /= self.period
+            self.gain /= self.period
+        else:
+            self.loss *= (self.period - 1)
+            self.gain *= (self.period - 1)
+            if change < 0:
+                self.loss -= change
+            else:
+                self.gain += change
+            self.loss /= self.period
+            self.gain /= self.period
+        total = self.gain + self.loss
+        self.value = 100.0 * (self.gain / total) if total != 0 else 0.0
+        return self.value
+
+    def seed(self, close: np.ndarray) -> np.ndarray:
+        self.reset()
+        return np.array([self.update(value) for value in np.asarray(close, dtype=float).tolist()], dtype=float)
+
+
+class StreamingATR:
+    ''' talib.ATR and talib.NATR: sma of the first period true ranges, then wilder smoothing. natr in % of the close '''
+
+    def __init__(self, period: int):
+        self.period = int(period)
+        self.reset()
+
+    def reset(self):
+        self.count = 0  # true ranges seen
+        self.prev_close = None
+        self._sum = 0.0
+        self.value = math.nan
+        self.natr = math.nan
+
+    def update(self, high: float, low: float, close: float) -> float:
+        if self.prev_close is None:
+            self.prev_close = close
+            return self.value
+        tr = true_range(high, low, self.prev_close)
+        self.prev_close = close
+        self.count += 1
+        if self.count <= self.period:
+            self._sum += tr
+            if self.count < self.period:
+                return self.value
+            self.value = self._sum / self.period
+        else:
+            self.value *= self.period - 1
+            self.value += tr
+            self.value /= self.period
+        self.natr = (self.value / close) * 100.0 if close != 0 else 0.0
+        return self.value
+
+    def seed(self, high: np.ndarray, low: np.ndarray, close: np.ndarray):
+        ''' returns (atr, natr) of the history '''
+        self.reset()
+        atr = np.full(len(close), np.nan)
+        natr = np.full(len(close), np.nan)
+        for idx, (h, l, c) in enumerate(zip(np.asarray(high, dtype=float).tolist(), np.asarray(low, dtype=float).tolist(),
+                                            np.asarray(close, dtype=float).tolist())):
+            atr[idx] = self.update(h, l, c)
+            natr[idx] = self.natr
+        return atr, natr
+
+
+class StreamingADX:
+    ''' talib.ADX, PLUS_DI and MINUS_DI in one pass, they share the smoothed directional movement and true range '''
+
+    def __init__(self, period: int):
+        self.period = int(period)
+        self.reset()
+
+    def reset(self):
+        self.count = 0  # moves seen
+        self.prev_high = None
+        self.prev_low = None
+        self.prev_close = None
+        self.plus_dm = 0.0
+        self.minus_dm = 0.0
+        self.tr = 0.0
+        self._sum_dx = 0.0
+        self.value = math.nan
+        self.plus_di = math.nan
+        self.minus_di = math.nan
+
+    def update(self, high: float, low: float, close: float) -> float:
+        if self.prev_high is None:
+            self.prev_high, self.prev_low, self.prev_close = high, low, close
+            return self.value
+        diff_plus = high - self.prev_high
+        diff_minus = self.prev_low - low
+        self.prev_high = high
+        self.prev_low = low
+        tr = true_range(high, low, self.prev_close)
+        self.prev_close = close
+        self.count += 1
+        period = self.period
+        if self.count < period:
+            if diff_minus > 0 and diff_plus < diff_minus:
+                self.minus_dm += diff_minus
+            elif diff_plus > 0 and diff_plus > diff_minus:
+                self.plus_dm += diff_plus
+            self.tr += tr
+            return self.value
+
+        self.minus_dm -= self.minus_dm / period
+        self.plus_dm -= self.plus_dm / period
+        if diff_minus > 0 and diff_plus < diff_minus:
+            self.minus_dm += diff_minus
+        elif diff_plus > 0 and diff_plus > diff_minus:
+            self.plus_dm += diff_plus
+        self.tr = self.tr - (self.tr / period) + tr
+
+        dx = None
+        if self.tr != 0:
+            self.minus_di = 100.0 * (self.minus_dm / self.tr)
+            self.plus_di = 100.0 * (self.plus_dm / self.tr)
+            di_sum = self.minus_di + self.plus_di
+            if di_sum != 0:
+                dx = 100.0 * (abs(self.minus_di - self.plus_di) / di_sum)
+        else:
+            self.minus_di = 0.0
+            self.plus_di = 0.0
+
+        if self.count < 2 * period - 1:
+            if dx is not None:
+                self._sum_dx += dx
+        elif self.count == 2 * period - 1:
+            if dx is not None:
+                self._sum_dx += dx
+            self.value = self._sum_dx / period
+        elif dx is not None:
+            self.value = ((self.value * (period - 1)) + dx) / period
+        return self.value
+
+    def seed(self, high: np.ndarray, low: np.ndarray, close: np.ndarray):
+        ''' returns (adx, plus_di, minus_di) of the history '''
+        self.reset()
+        adx = np.full(len(close), np.nan)
+        plus_di = np.full(len(close), np.nan)
+        minus_di = np.full(len(close), np.nan)
+        for idx, (h, l, c) in enumerate(zip(np.asarray(high, dtype=float).tolist(), np.asarray(low, dtype=float).tolist(),
+                                            np.asarray(close, dtype=float).tolist())):
+            adx[idx] = self.update(h, l, c)
+            plus_di[idx] = self.plus_di
+            minus_di[idx] = self.minus_di
+        return adx, plus_di, minus_di
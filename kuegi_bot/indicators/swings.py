@@ -1,7 +1,9 @@
 from typing import List
 
-from kuegi_bot.indicators.indicator import Indicator, BarSeries, lowest, highest
-from kuegi_bot.utils.trading_classes import Bar
+from kuegi_bot.indicators.indicator import Indicator, BarSeries, bar_values, highest_of, lowest_of, lagged, \
+    rolling_highest, rolling_lowest, changed_bar_count
+from kuegi_bot.utils.bar_array import BarArray
+from kuegi_bot.utils.trading_classes import Bar, BarWindow
 
 
 class Data:
@@ -18,34 +20,70 @@ class Swings(Indicator):
         self.after = after
 
     def on_tick(self, bars: List[Bar]):
-        # ignore first bars
-        for idx in range(len(bars) - self.before - self.after-2, -1, -1):
-            if bars[idx].did_change:
-                self.process_bar(bars[idx:])
+        bars = BarWindow.of(bars)
+        # ignore first bars. the changed bars are the newest ones, no need to look at the whole history
+        changed = changed_bar_count(bars)
+        for idx in range(min(changed, len(bars) - self.before - self.after - 1) - 1, -1, -1):
+            self.process_bar(bars[idx:])
 
     def process_bar(self, bars: List[Bar]):
         prevData: Data = self.get_data(bars[1])
+        depth = self.before + self.after + 2
+        highs = bar_values(bars, BarSeries.HIGH, depth)
+        lows = bar_values(bars, BarSeries.LOW, depth)
 
         swingHigh = prevData.swingHigh if prevData is not None else None
-        highestAfter = highest(bars, self.after, 1, BarSeries.HIGH)
-        candidate = bars[self.after + 1].high
-        highestBefore = highest(bars, self.before, self.after + 2, BarSeries.HIGH)
+        highestAfter = highest_of(highs, self.after, 1)
+        candidate = highs[self.after + 1]
+        highestBefore = highest_of(highs, self.before, self.after + 2)
         if highestAfter <= candidate and highestBefore <= candidate:
             swingHigh = candidate
-        if swingHigh is not None and bars[0].high > swingHigh:
+        if swingHigh is not None and highs[0] > swingHigh:
             swingHigh= None
 
         swingLow = prevData.swingLow if prevData is not None else None
-        lowestAfter = lowest(bars, self.after, 1, BarSeries.LOW)
-        candidate = bars[self.after + 1].low
-        lowestBefore = lowest(bars, self.before, self.after + 2, BarSeries.LOW)
+        lowestAfter = lowest_of(lows, self.after, 1)
+        candidate = lows[self.after + 1]
+        lowestBefore = lowest_of(lows, self.before, self.after + 2)
         if lowestAfter >= candidate and lowestBefore >= candidate:
             swingLow = candidate
-        if swingLow is not None and bars[0].low < swingLow:
+        if swingLow is not None and lows[0] < swingLow:
             swingLow= None
 
         self.write_data(bars[0], Data(swingHigh=swingHigh, swingLow=swingLow))
 
+    def compute_all(self, bar_columns: BarArray):
+        n = len(bar_columns)
+        first = self.before + self.after + 1  # on_tick leaves the bars before without data
+        if n <= first:
+            return [None] * n
+        high = bar_columns.high
+        low = bar_columns.low
+        # a length of 0 takes the first bar like highest_of/lowest_of
+        high_candidate = lagged(high, self.after + 1)
+        new_high = (lagged(rolling_highest(high, max(self.after, 1)), 1) <= high_candidate) \
+                   & (lagged(rolling_highest(high, max(self.before, 1)), self.after + 2) <= high_candidate)
+        low_candidate = lagged(low, self.after + 1)
+        new_low = (lagged(rolling_lowest(low, max(self.after, 1)), 1) >= low_candidate) \
+                  & (lagged(rolling_lowest(low, max(self.before, 1)), self.after + 2) >= low_candidate)
+
+        result = [None] * first
+        swingHigh = None
+        swingLow = None
+        for high_value, low_value, high_found, low_found, high_swing, low_swing in zip(
+                high[first:].tolist(), low[first:].tolist(), new_high[first:].tolist(), new_low[first:].tolist(),
+                high_candidate[first:].tolist(), low_candidate[first:].tolist()):
+            if high_found:
+                swingHigh = high_swing
+            if swingHigh is not None and high_value > swingHigh:
+                swingHigh = None
+            if low_found:
+                swingLow = low_swing
+            if swingLow is not None and low_value < swingLow:
+                swingLow = None
+            result.append(Data(swingHigh=swingHigh, swingLow=swingLow))
+        return result
+
     def get_data_for_plot(self, bar: Bar):
         data: Data = self.get_data(bar)
         if data is not None:
@@ -1,9 +1,51 @@
 from kuegi_bot.indicators.indicator import Indicator
 from kuegi_bot.utils.trading_classes import Bar
-from typing import List
-import datetime
+from kuegi_bot.utils.bar_array import BarArray
+from kuegi_bot.utils.growable_array import GrowableArray
+from typing import Dict, List, NamedTuple, Optional
 import numpy as np
 
+DAY_SECONDS = 24 * 60 * 60
+WEEK_SECONDS = 7 * DAY_SECONDS
+# weeks start on monday 00:00 utc, the epoch was a thursday
+WEEK_OFFSET_SECONDS = 4 * DAY_SECONDS
+
+
+class Candles(NamedTuple):
+    tstamp: np.ndarray
+    open: np.ndarray
+    high: np.ndarray
+    low: np.ndarray
+    close: np.ndarray
+    last_idx: np.ndarray  # row of the last source bar of each candle
+
+
+def resample_candles(tstamp, open, high, low, close, period_seconds: int, offset_seconds: int = 0,
+                     bar_seconds: Optional[int] = None) -> Candles:
+    ''' candles of period_seconds (starting at offset_seconds + k * period_seconds) from chronological bars of
+    bar_seconds (default: the smallest step in tstamp). only complete candles are returned: the first bar starts
+    the period and the last one ends it '''
+    tstamp = np.asarray(tstamp, dtype=np.int64)
+    n = len(tstamp)
+    if bar_seconds is None:
+        steps = np.diff(tstamp)
+        steps = steps[steps > 0]
+        bar_seconds = int(steps.min()) if len(steps) > 0 else 0
+    if n == 0 or bar_seconds <= 0:
+        empty = np.array([], dtype=float)
+        return Candles(np.array([], dtype=np.int64), empty, empty, empty, empty, np.array([], dtype=np.int64))
+    bucket = (tstamp - offset_seconds) // period_seconds
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(bucket)) + 1))
+    ends = np.append(starts[1:], n) - 1
+    bucket_start = bucket[starts] * period_seconds + offset_seconds
+    complete = (tstamp[starts] == bucket_start) & (tstamp[ends] + bar_seconds == bucket_start + period_seconds)
+    return Candles(tstamp=bucket_start[complete],
+                   open=np.asarray(open, dtype=float)[starts[complete]],
+                   high=np.maximum.reduceat(np.asarray(high, dtype=float), starts)[complete],
+                   low=np.minimum.reduceat(np.asarray(low, dtype=float), starts)[complete],
+                   close=np.asarray(close, dtype=float)[ends[complete]],
+                   last_idx=ends[complete])
+
 
 class TAlibBars(Indicator):
     def __init__(self, close: List[float] = None, high: List[float] = None, low: List[float] = None, open: List[float] = None, volume: List[float] = None):
@@ -16,17 +58,22 @@ class TAlibBars(Indicator):
         self.volume = np.array(volume) if volume is not None else None
 
         # Initialize daily candles
+        self.timestamps_daily = None
         self.close_daily = None
         self.high_daily = None
         self.low_daily = None
         self.open_daily = None
 
         # Initialize weekly candles
+        self.timestamps_weekly = None
         self.close_weekly = None
         self.high_weekly = None
         self.low_weekly = None
         self.open_weekly = None
 
+        # append buffers behind the columns, new bars don't copy the whole history (see _append)
+        self._buffers: Dict[str, GrowableArray] = {}
+
     def set_timestamps(self, bars: List[Bar]):
         self.timestamps = np.array([bar.tstamp for bar in reversed(bars[1:])])
 
@@ -34,18 +81,15 @@ class TAlibBars(Indicator):
         if self.close is None or self.open is None or self.high is None or self.low is None:
             self.reset_candles(bars)
         else:
-            self.close = np.append(self.close, bars[1].close)
-            self.high = np.append(self.high, bars[1].high)
-            self.low = np.append(self.low, bars[1].low)
-            self.open = np.append(self.open, bars[1].open)
-            self.volume = np.append(self.volume, bars[1].volume)
-            if self.timestamps is None:
-                self.timestamps = np.array([bars[1].tstamp], dtype=np.int64)
-            else:
-                self.timestamps = np.append(self.timestamps, int(bars[1].tstamp))
-
-            self._update_daily_candles(bars[1].tstamp)
-            self._update_weekly_candles(bars[1].tstamp)
+            self._append("close", bars[1].close)
+            self._append("high", bars[1].high)
+            self._append("low", bars[1].low)
+            self._append("open", bars[1].open)
+            self._append("volume", bars[1].volume)
+            self._append("timestamps", int(bars[1].tstamp), dtype=np.int64)
+
+            self._update_daily_candles(int(bars[1].tstamp))
+            self._update_weekly_candles(int(bars[1].tstamp))
 
         if not self.is_synchronized(bars):
             # Resynchronize the data
@@ -69,112 +113,104 @@ class TAlibBars(Indicator):
         self.volume = volume
         self.set_timestamps(bars)
 
+        self._reset_calendar_candles()
+
+    def reset_from_bar_array(self, bars: BarArray):
+        ''' takes the (closed) bars straight from the columns of a BarArray, no forming bar expected '''
+        self.close = bars.close.copy()
+        self.high = bars.high.copy()
+        self.low = bars.low.copy()
+        self.open = bars.open.copy()
+        self.volume = bars.volume.copy()
+        self.timestamps = bars.tstamp.copy()
+        self._reset_calendar_candles()
+
+    def _reset_calendar_candles(self):
         # daily & weekly
         self._reset_daily_candles()
         self._reset_weekly_candles()
-        self._repopulate_daily_candles()
-        self._repopulate_weekly_candles()
-
-    def _update_daily_candles(self, last_tstamp):
-        last_date = datetime.datetime.utcfromtimestamp(last_tstamp)
-        if last_date.hour == 20 and len(self.close) >= 7:
-            close_daily = self.close[-1]
-            high_daily = max(self.high[-6:])
-            low_daily = min(self.low[-6:])
-            open_daily = self.open[-6]
-
-            if self.close_daily is None:
-                self.close_daily = np.array([close_daily])
-                self.high_daily = np.array([high_daily])
-                self.low_daily = np.array([low_daily])
-                self.open_daily = np.array([open_daily])
-            else:
-                self.close_daily = np.append(self.close_daily, close_daily)
-                self.high_daily = np.append(self.high_daily, high_daily)
-                self.low_daily = np.append(self.low_daily, low_daily)
-                self.open_daily = np.append(self.open_daily, open_daily)
-
-    def _update_weekly_candles(self, last_tstamp):
-        last_date = datetime.datetime.utcfromtimestamp(last_tstamp)
-        if last_date.weekday() == 0 and last_date.hour == 0 and len(self.close) > (4 * 6 *7):  # Sunday TODO: make adaptable to timeframe
-            close_weekly = self.close_daily[-1]
-            high_weekly = max(self.high_daily[-7:])
-            low_weekly = min(self.low_daily[-7:])
-            open_weekly = self.open_daily[-7]
-
-            if self.close_weekly is None:
-                self.close_weekly = np.array([close_weekly])
-                self.high_weekly = np.array([high_weekly])
-                self.low_weekly = np.array([low_weekly])
-                self.open_weekly = np.array([open_weekly])
-            else:
-                self.close_weekly = np.append(self.close_weekly, close_weekly)
-                self.high_weekly = np.append(self.high_weekly, high_weekly)
-                self.low_weekly = np.append(self.low_weekly, low_weekly)
-                self.open_weekly = np.append(self.open_weekly, open_weekly)
-
-    def _repopulate_daily_candles(self):
-        if self.close is None or len(self.close) < 6:
+        if self.timestamps is None or len(self.timestamps) != len(self.close):
             return
-
-        daily_candle_start_index = self._find_daily_candle_start_index()
-        if daily_candle_start_index is None or len(self.close) < daily_candle_start_index+6:
+        daily = resample_candles(self.timestamps, self.open, self.high, self.low, self.close, DAY_SECONDS)
+        if len(daily.tstamp) == 0:
             return
-
-        open_indices = range(daily_candle_start_index, len(self.open), 6)
-        close_indices = range(daily_candle_start_index+5, len(self.close), 6)
-        self.open_daily = self.open[open_indices]
-        self.close_daily = self.close[close_indices]
-        self.high_daily = np.array([max(self.high[i:i + 6]) for i in open_indices])
-        self.low_daily = np.array([min(self.low[i:i + 6]) for i in open_indices])
-
-    def _find_daily_candle_start_index(self):
-        if self.timestamps is None or len(self.timestamps) == 0:
-            return None
-
-        desired_start_hour = 0  # Change this to the desired starting hour of the daily candle, e.g., 4 for 4 AM
-        for i, tstamp in enumerate(self.timestamps):
-            dt = datetime.datetime.utcfromtimestamp(tstamp)
-            if dt.hour == desired_start_hour:
-                return i
-
-        return None
-
-    def _find_weekly_candle_start_index(self):
-        if self.timestamps is None or len(self.timestamps) == 0 or self.close_daily is None:
-            return None
-
-        daily_candle_start_index = self._find_daily_candle_start_index()
-        if daily_candle_start_index is None:
-            return None
-
-        daily_timestamps = self.timestamps[daily_candle_start_index::6]  # Convert 4H timestamps to daily timestamps
-        for i, tstamp in enumerate(daily_timestamps):
-            dt = datetime.datetime.utcfromtimestamp(tstamp)
-            if dt.weekday() == 0:  # Start of the week (Monday)
-                return i
-
-        return None
-
-    def _repopulate_weekly_candles(self):
-        weekly_candle_start_index = self._find_weekly_candle_start_index()
-        if weekly_candle_start_index is None or self.close_daily is None or len(self.close_daily) < (weekly_candle_start_index + 7):
+        self._set_daily_candles(daily)
+        weekly = resample_candles(daily.tstamp, daily.open, daily.high, daily.low, daily.close, WEEK_SECONDS,
+                                  WEEK_OFFSET_SECONDS, bar_seconds=DAY_SECONDS)
+        if len(weekly.tstamp) > 0:
+            self._set_weekly_candles(weekly)
+
+    def _bar_seconds(self) -> int:
+        steps = np.diff(self.timestamps[-8:])
+        steps = steps[steps > 0]
+        return int(steps.min()) if len(steps) > 0 else 0
+
+    def _update_daily_candles(self, last_tstamp: int):
+        # a new daily candle once the last bar of a day closed
+        bar_seconds = self._bar_seconds()
+        if bar_seconds <= 0 or (last_tstamp + bar_seconds) % DAY_SECONDS != 0:
             return
-
-        open_indices = range(weekly_candle_start_index,len(self.open_daily), 7)
-        close_indices = range(weekly_candle_start_index + 6, len(self.close_daily), 7)
-        self.open_weekly = self.open_daily[open_indices]
-        self.close_weekly = self.close_daily[close_indices]
-        self.high_weekly = np.array([max(self.high_daily[i:i + 7]) for i in open_indices])
-        self.low_weekly = np.array([min(self.low_daily[i:i + 7]) for i in open_indices])
+        start = int(np.searchsorted(self.timestamps, last_tstamp + bar_seconds - DAY_SECONDS))
+        daily = resample_candles(self.timestamps[start:], self.open[start:], self.high[start:], self.low[start:],
+                                 self.close[start:], DAY_SECONDS, bar_seconds=bar_seconds)
+        if len(daily.tstamp) == 0:
+            return
+        self._append("timestamps_daily", int(daily.tstamp[-1]), dtype=np.int64)
+        self._append("close_daily", daily.close[-1])
+        self._append("high_daily", daily.high[-1])
+        self._append("low_daily", daily.low[-1])
+        self._append("open_daily", daily.open[-1])
+
+    def _update_weekly_candles(self, last_tstamp: int):
+        # the weekly candle gets added with the first bar of the next week (monday 00:00), one bar after its last
+        # daily candle. the strategies are tuned on this timing, the precomputed provider has it at the daily close
+        if (last_tstamp - WEEK_OFFSET_SECONDS) % WEEK_SECONDS != 0 or len(self.close) <= 4 * 6 * 7 \
+                or self.timestamps_daily is None:
+            return
+        start = int(np.searchsorted(self.timestamps_daily, last_tstamp - WEEK_SECONDS))
+        weekly = resample_candles(self.timestamps_daily[start:], self.open_daily[start:], self.high_daily[start:],
+                                  self.low_daily[start:], self.close_daily[start:], WEEK_SECONDS, WEEK_OFFSET_SECONDS,
+                                  bar_seconds=DAY_SECONDS)
+        if len(weekly.tstamp) == 0:
+            return
+        self._append("timestamps_weekly", int(weekly.tstamp[-1]), dtype=np.int64)
+        self._append("close_weekly", weekly.close[-1])
+        self._append("high_weekly", weekly.high[-1])
+        self._append("low_weekly", weekly.low[-1])
+        self._append("open_weekly", weekly.open[-1])
+
+    def _append(self, column: str, value, dtype=float):
+        current = getattr(self, column)
+        buffer = self._buffers.get(column)
+        if buffer is None or buffer.values is not current:
+            # the column was set from outside (reset, precomputed provider), continue from its values
+            buffer = GrowableArray(current, dtype=current.dtype if current is not None else dtype)
+            self._buffers[column] = buffer
+        setattr(self, column, buffer.append(value))
+
+    def _set_daily_candles(self, daily: Candles):
+        self.timestamps_daily = daily.tstamp
+        self.open_daily = daily.open
+        self.high_daily = daily.high
+        self.low_daily = daily.low
+        self.close_daily = daily.close
+
+    def _set_weekly_candles(self, weekly: Candles):
+        self.timestamps_weekly = weekly.tstamp
+        self.open_weekly = weekly.open
+        self.high_weekly = weekly.high
+        self.low_weekly = weekly.low
+        self.close_weekly = weekly.close
 
     def _reset_daily_candles(self):
+        self.timestamps_daily = None
         self.close_daily = None
         self.high_daily = None
         self.low_daily = None
         self.open_daily = None
 
     def _reset_weekly_candles(self):
+        self.timestamps_weekly = None
         self.close_weekly = None
         self.high_weekly = None
         self.low_weekly = None
@@ -0,0 +1,220 @@
+from typing import List
+
+import numpy as np
+
+from kuegi_bot.utils.trading_classes import Bar
+
+
+def _sequential_sums(values: np.ndarray, starts: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    ''' sums of values[starts[i]:starts[i]+lengths[i]], added up oldest first like Bar.add_subbar does.
+    np.add.reduceat sums pairwise which can differ in the last digit '''
+    sums = values[starts].copy()
+    for k in range(1, int(lengths.max()) if len(lengths) > 0 else 0):
+        open_rows = np.flatnonzero(lengths > k)
+        sums[open_rows] += values[starts[open_rows] + k]
+    return sums
+
+
+class BarArray:
+    ''' struct-of-arrays store for bars.
+    the columns are chronological (oldest bar = row 0) so they can be passed to numpy/talib directly.
+    indexing follows the rest of the bot though: bar_array[0] is the newest bar.
+    subbars of row i are the rows sub_offset[i]:sub_offset[i]+sub_length[i] of the BarArray in `subbars`. '''
+    COLUMNS = ("tstamp", "open", "high", "low", "close", "volume", "buyVolume", "sellVolume")
+
+    def __init__(self, tstamp, open, high, low, close, volume, buyVolume=None, sellVolume=None,
+                 subbars: 'BarArray' = None, sub_offset=None, sub_length=None):
+        self.tstamp = np.asarray(tstamp, dtype=np.int64)
+        self.open = np.asarray(open, dtype=float)
+        self.high = np.asarray(high, dtype=float)
+        self.low = np.asarray(low, dtype=float)
+        self.close = np.asarray(close, dtype=float)
+        self.volume = np.asarray(volume, dtype=float)
+        n = len(self.tstamp)
+        self.buyVolume = np.asarray(buyVolume, dtype=float) if buyVolume is not None else np.zeros(n)
+        self.sellVolume = np.asarray(sellVolume, dtype=float) if sellVolume is not None else np.zeros(n)
+        self.subbars = subbars
+        self.sub_offset = np.asarray(sub_offset, dtype=np.int64) if sub_offset is not None else None
+        self.sub_length = np.asarray(sub_length, dtype=np.int64) if sub_length is not None else None
+        self._shared_bars: List[Bar] = None
+
+    @staticmethod
+    def from_bars(bars: List[Bar]) -> 'BarArray':
+        ''' bars need to be ordered newest bar = index 0, subbars are not taken over '''
+        chrono = list(reversed(bars))
+        return BarArray(tstamp=[bar.tstamp for bar in chrono],
+                        open=[bar.open for bar in chrono],
+                        high=[bar.high for bar in chrono],
+                        low=[bar.low for bar in chrono],
+                        close=[bar.close for bar in chrono],
+                        volume=[bar.volume for bar in chrono],
+                        buyVolume=[bar.buyVolume for bar in chrono],
+                        sellVolume=[bar.sellVolume for bar in chrono])
+
+    def __len__(self):
+        return len(self.tstamp)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        n = len(self.tstamp)
+        if idx < 0:
+            idx += n
+        if idx < 0 or idx >= n:
+            raise IndexError("bar index out of range")
+        return BarRef(self, n - 1 - idx)
+
+    def __iter__(self):
+        for row in range(len(self.tstamp) - 1, -1, -1):
+            yield BarRef(self, row)
+
+    def __reversed__(self):
+        for row in range(len(self.tstamp)):
+            yield BarRef(self, row)
+
+    def __repr__(self):
+        return "BarArray(%i bars)" % len(self)
+
+    @property
+    def nbytes(self):
+        result = sum(getattr(self, col).nbytes for col in self.COLUMNS)
+        if self.sub_offset is not None:
+            result += self.sub_offset.nbytes + self.sub_length.nbytes
+        if self.subbars is not None:
+            result += self.subbars.nbytes
+        return result
+
+    def last_tick_tstamp(self, row: int) -> int:
+        if self.subbars is None or self.sub_length[row] == 0:
+            return int(self.tstamp[row])
+        return int(self.subbars.tstamp[self.sub_offset[row] + self.sub_length[row] - 1])
+
+    def subbars_of(self, row: int) -> List[Bar]:
+        ''' materializes the subbars of the given (chronological) row, newest subbar = index 0 '''
+        if self.subbars is None:
+            return []
+        start = int(self.sub_offset[row])
+        return self.subbars.to_bars(start, start + int(self.sub_length[row]))
+
+    def to_bars(self, start: int = 0, stop: int = None, with_subbars: bool = True) -> List[Bar]:
+        ''' materializes the (chronological) rows start:stop as Bar objects ordered newest bar = index 0 '''
+        if stop is None:
+            stop = len(self.tstamp)
+        result: List[Bar] = []
+        tstamp = self.tstamp[start:stop].tolist()
+        open = self.open[start:stop].tolist()
+        high = self.high[start:stop].tolist()
+        low = self.low[start:stop].tolist()
+        close = self.close[start:stop].tolist()
+        volume = self.volume[start:stop].tolist()
+        buy = self.buyVolume[start:stop].tolist()
+        sell = self.sellVolume[start:stop].tolist()
+        for row in range(stop - 1, start - 1, -1):
+            i = row - start
+            bar = Bar(tstamp=tstamp[i], open=open[i], high=high[i], low=low[i], close=close[i],
+                      volume=volume[i], subbars=self.subbars_of(row) if with_subbars else None)
+            bar.buyVolume = buy[i]
+            bar.sellVolume = sell[i]
+            if not with_subbars:
+                bar.last_tick_tstamp = self.last_tick_tstamp(row)
+            result.append(bar)
+        return result
+
+    def shared_bars(self) -> List[Bar]:
+        ''' the bars without subbars, materialized once. BackTest.reset() wipes bot_data/did_change of the bars,
+        so backtests that run one after the other can all use the same objects '''
+        if self._shared_bars is None:
+            self._shared_bars = self.to_bars(with_subbars=False)
+        return self._shared_bars
+
+    def window(self, start: int, stop: int = None) -> 'BarArray':
+        ''' the (chronological) rows start:stop as BarArray. numpy views, the subbars are shared with self '''
+        if stop is None:
+            stop = len(self.tstamp)
+        cols = (getattr(self, col)[start:stop] for col in self.COLUMNS)
+        if self.subbars is None:
+            return BarArray(*cols)
+        return BarArray(*cols, subbars=self.subbars, sub_offset=self.sub_offset[start:stop],
+                        sub_length=self.sub_length[start:stop])
+
+    def aggregate(self, timeframe_minutes, start_offset_minutes=0) -> 'BarArray':
+        ''' vectorized version of process_low_tf_bars. the rows of self become the subbars of the result '''
+        if len(self.tstamp) > 1 and np.any(np.diff(self.tstamp) < 0):
+            print("Had to order subbars before processing them!")
+            order = np.argsort(self.tstamp, kind="stable")
+            source = BarArray(*(getattr(self, col)[order] for col in self.COLUMNS))
+        else:
+            source = BarArray(*(getattr(self, col) for col in self.COLUMNS))
+        n = len(source.tstamp)
+        if n == 0:
+            return BarArray([], [], [], [], [], [], subbars=source, sub_offset=[], sub_length=[])
+        tf_seconds = 60 * timeframe_minutes
+        bar_start = ((source.tstamp - start_offset_minutes * 60) // tf_seconds) * tf_seconds
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(bar_start)) + 1))
+        ends = np.append(starts[1:], n)
+        return BarArray(tstamp=bar_start[starts],
+                        open=source.open[starts],
+                        high=np.maximum.reduceat(source.high, starts),
+                        low=np.minimum.reduceat(source.low, starts),
+                        close=source.close[ends - 1],
+                        volume=_sequential_sums(source.volume, starts, ends - starts),
+                        buyVolume=_sequential_sums(source.buyVolume, starts, ends - starts),
+                        sellVolume=_sequential_sums(source.sellVolume, starts, ends - starts),
+                        subbars=source,
+                        sub_offset=starts,
+                        sub_length=ends - starts)
+
+
+class BarRef:
+    ''' lightweight, read-only Bar-like accessor to one row of a BarArray '''
+    __slots__ = ("_array", "_row")
+
+    def __init__(self, array: BarArray, row: int):
+        self._array = array
+        self._row = row
+
+    @property
+    def tstamp(self) -> int:
+        return int(self._array.tstamp[self._row])
+
+    @property
+    def open(self) -> float:
+        return float(self._array.open[self._row])
+
+    @property
+    def high(self) -> float:
+        return float(self._array.high[self._row])
+
+    @property
+    def low(self) -> float:
+        return float(self._array.low[self._row])
+
+    @property
+    def close(self) -> float:
+        return float(self._array.close[self._row])
+
+    @property
+    def volume(self) -> float:
+        return float(self._array.volume[self._row])
+
+    @property
+    def buyVolume(self) -> float:
+        return float(self._array.buyVolume[self._row])
+
+    @property
+    def sellVolume(self) -> float:
+        return float(self._array.sellVolume[self._row])
+
+    @property
+    def last_tick_tstamp(self) -> int:
+        return self._array.last_tick_tstamp(self._row)
+
+    @property
+    def subbars(self) -> List[Bar]:
+        return self._array.subbars_of(self._row)
+
+    def to_bar(self) -> Bar:
+        return self._array.to_bars(self._row, self._row + 1)[0]
+
+    def __str__(self):
+        return str(self.to_bar())
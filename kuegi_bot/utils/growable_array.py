@@ -0,0 +1,28 @@
+import numpy as np
+
+
+class GrowableArray:
+    ''' 1d numpy array with amortised O(1) append.
+    the values live at the start of a larger buffer whose capacity doubles when it is full, `values` is a view of
+    the filled part and can go straight into numpy/talib. a view taken before an append keeps its length and
+    content, it just doesn't see the new value. '''
+
+    def __init__(self, values=None, dtype=float, capacity: int = 16):
+        values = np.asarray(values if values is not None else [], dtype=dtype)
+        self._data = np.empty(max(int(capacity), 2 * len(values), 1), dtype=values.dtype)
+        self._data[:len(values)] = values
+        self._size = len(values)
+        self.values = self._data[:self._size]
+
+    def __len__(self):
+        return self._size
+
+    def append(self, value) -> np.ndarray:
+        if self._size == len(self._data):
+            data = np.empty(2 * len(self._data), dtype=self._data.dtype)
+            data[:self._size] = self._data[:self._size]
+            self._data = data
+        self._data[self._size] = value
+        self._size += 1
+        self.values = self._data[:self._size]
+        return self.values
@@ -1,21 +1,21 @@
+import hashlib
 import json
 import logging
+import os
 import re
 import sys
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 
-from kuegi_bot.exchanges.bybit.bybit_interface import ByBitInterface
-from kuegi_bot.exchanges.bybit_linear.bybitlinear_interface import ByBitLinearInterface
-from kuegi_bot.exchanges.phemex.phemex_interface import PhemexInterface
 from kuegi_bot.indicators.indicator import Indicator
-from kuegi_bot.exchanges.bitfinex.bitfinex_interface import BitfinexInterface
 from kuegi_bot.utils import log
 
-import plotly.graph_objects as go
+import numpy as np
 
+from kuegi_bot.utils.bar_array import BarArray
 from kuegi_bot.utils.dotdict import dotdict
+from kuegi_bot.utils.plotting import graph_objects
 from kuegi_bot.utils.trading_classes import Bar, process_low_tf_bars
 
 logger = log.setup_custom_logger()
@@ -141,7 +141,191 @@ def _available_history_indices(exchange: str, symbol: str) -> List[int]:
     return out
 
 
-def load_bars(days_in_history, wanted_tf, start_offset_minutes=0,exchange='bybit',symbol='BTCUSD'):
+# fixed-width layout of one M1 row in the binary history cache
+M1_HISTORY_DTYPE = np.dtype([("tstamp", "<i8"), ("open", "<f8"), ("high", "<f8"), ("low", "<f8"),
+                             ("close", "<f8"), ("volume", "<f8")])
+
+# exchange -> (tstamp in ms, row indices of open/high/low/close/volume, price scale)
+_M1_ROW_LAYOUT = {
+    'bybit': (True, (1, 2, 3, 4, 5), 1),
+    'bybit-linear': (True, (1, 2, 3, 4, 5), 1),
+    'phemex': (False, (3, 4, 5, 6, 7), 10000),
+    'bitfinex': (True, (1, 3, 4, 2, 5), 1),
+}
+
+
+def _m1_rows_to_records(m1_bars, exchange) -> Optional[np.ndarray]:
+    # raw history rows -> fixed-width records, missing prices (gaps in bybit history) become nan.
+    # None if the exchange layout is not supported or the rows don't have it (e.g. dict rows), the caller then
+    # falls back to the exchange's own row parsing
+    layout = _M1_ROW_LAYOUT.get(exchange)
+    if layout is None:
+        return None
+    try:
+        return _m1_layout_to_records(m1_bars, layout)
+    except (ValueError, TypeError, KeyError, IndexError) as e:
+        logger.warning("history rows of %s don't match the row layout: %s" % (exchange, str(e)))
+        return None
+
+
+def _m1_layout_to_records(m1_bars, layout) -> np.ndarray:
+    tstamp_in_ms, columns, price_scale = layout
+    records = np.zeros(len(m1_bars), dtype=M1_HISTORY_DTYPE)
+    if len(m1_bars) == 0:
+        return records
+    records["tstamp"] = [int(int(b[0]) / 1000) for b in m1_bars] if tstamp_in_ms else [b[0] for b in m1_bars]
+    values = np.array([[b[c] for c in columns] for b in m1_bars], dtype=float)
+    for idx, name in enumerate(("open", "high", "low", "close")):
+        records[name] = values[:, idx] / price_scale
+    records["volume"] = values[:, 4]
+    return records
+
+
+def _records_to_bar_array(records: np.ndarray) -> BarArray:
+    valid = ~np.isnan(records["open"])
+    if not valid.all():
+        records = records[valid]
+    return BarArray(tstamp=records["tstamp"], open=records["open"], high=records["high"], low=records["low"],
+                    close=records["close"], volume=records["volume"])
+
+
+def history_cache_file_name(index, exchange, symbol=''):
+    if len(symbol) > 0:
+        symbol += "_"
+    return 'history/' + exchange + '/cache/' + symbol + 'M1_' + str(index) + '.npy'
+
+
+def _history_cache_index_name(index, exchange, symbol=''):
+    return history_cache_file_name(index, exchange, symbol)[:-len('.npy')] + '.json'
+
+
+def _write_atomic(path: Path, write):
+    # write to a temp file first, parallel workers must never see half written cache files
+    tmp = path.with_name(path.name + ".%i.tmp" % os.getpid())
+    with open(tmp, "wb") as f:
+        write(f)
+    os.replace(tmp, path)
+
+
+def convert_history_file(index, exchange, symbol='', force=False) -> Optional[dict]:
+    '''
+    writes history file `index` once into the binary cache (npy of M1_HISTORY_DTYPE records) together with an
+    index sidecar (rows, first/last tstamp, source size/mtime and a digest of the records).
+    returns the sidecar, None if the exchange layout is not supported or the rows can't be converted
+    '''
+    if exchange not in _M1_ROW_LAYOUT:
+        return None
+    source = Path(history_file_name(index, exchange, symbol))
+    index_path = Path(_history_cache_index_name(index, exchange, symbol))
+    cache_path = Path(history_cache_file_name(index, exchange, symbol))
+    source_stat = source.stat()
+    if not force and index_path.exists() and cache_path.exists():
+        try:
+            with open(index_path) as f:
+                sidecar = json.load(f)
+            if sidecar.get("source_size") == source_stat.st_size and \
+                    sidecar.get("source_mtime_ns") == source_stat.st_mtime_ns:
+                return sidecar
+        except ValueError:
+            pass  # broken sidecar, rebuild
+
+    with open(source) as f:
+        records = _m1_rows_to_records(json.load(f), exchange)
+    if records is None:
+        return None
+    sidecar = {
+        "rows": int(len(records)),
+        "first_tstamp": int(records["tstamp"][0]) if len(records) > 0 else None,
+        "last_tstamp": int(records["tstamp"][-1]) if len(records) > 0 else None,
+        "source_size": source_stat.st_size,
+        "source_mtime_ns": source_stat.st_mtime_ns,
+        "digest": hashlib.sha1(records.tobytes()).hexdigest()
+    }
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    _write_atomic(cache_path, lambda f: np.save(f, records))
+    _write_atomic(index_path, lambda f: f.write(json.dumps(sidecar).encode("utf-8")))
+    return sidecar
+
+
+def convert_history_files(exchange='bybit', symbol='BTCUSD', force=False) -> int:
+    converted = 0
+    for index in _available_history_indices(exchange=exchange, symbol=symbol):
+        if convert_history_file(index, exchange, symbol, force=force) is not None:
+            converted += 1
+    return converted
+
+
+def _load_m1_records_cached(indices, days_in_history, exchange, symbol) -> Tuple[Optional[np.ndarray], str]:
+    # same rows as the json path, but only the needed tail of each memory mapped cache file is touched.
+    # also returns a content key of the selected rows (digests of the used files + first row)
+    try:
+        sidecars = [convert_history_file(i, exchange, symbol) for i in indices]
+    except (OSError, ValueError, TypeError, KeyError) as e:
+        logger.warning("could not use history cache: " + str(e))
+        return None, ""
+    if any(sidecar is None for sidecar in sidecars):
+        return None, ""
+    total_rows = sum(sidecar["rows"] for sidecar in sidecars)
+    start = int(max(0, total_rows - (days_in_history * 1440)))
+    parts = []
+    key_parts = []
+    offset = 0
+    for i, sidecar in zip(indices, sidecars):
+        rows = sidecar["rows"]
+        if offset + rows > start and rows > 0:
+            records = np.load(history_cache_file_name(i, exchange, symbol), mmap_mode='r')
+            parts.append(records[max(0, start - offset):])
+            key_parts.append("%s:%i" % (sidecar["digest"], max(0, start - offset)))
+        offset += rows
+    key = hashlib.sha1("|".join(key_parts).encode("utf-8")).hexdigest()
+    if len(parts) == 0:
+        return np.zeros(0, dtype=M1_HISTORY_DTYPE), key
+    return (parts[0] if len(parts) == 1 else np.concatenate(parts)), key
+
+
+def _htf_cache_file_name(exchange, symbol, wanted_tf, start_offset_minutes):
+    if len(symbol) > 0:
+        symbol += "_"
+    return 'history/' + exchange + '/cache/' + symbol + 'M' + str(wanted_tf) + '_' + str(start_offset_minutes) + '.npz'
+
+
+def _aggregate_cached(records: np.ndarray, source_key: str, wanted_tf, start_offset_minutes, exchange,
+                      symbol) -> BarArray:
+    # aggregated bars + subbar ranges are stored next to the history, one file per tf/offset. the file holds the key
+    # of the M1 rows it was built from and gets overwritten when the history changed
+    subbars = _records_to_bar_array(records)
+    if len(subbars) > 1 and np.any(np.diff(subbars.tstamp) < 0):
+        return process_low_tf_bars(subbars, wanted_tf, start_offset_minutes)  # needs reordering, not cached
+    key = hashlib.sha1(("%s|%s|%s" % (source_key, wanted_tf, start_offset_minutes)).encode("utf-8")).hexdigest()
+    path = Path(_htf_cache_file_name(exchange, symbol, wanted_tf, start_offset_minutes))
+    if path.exists():
+        try:
+            with np.load(path) as data:
+                if str(data["key"]) == key:
+                    return BarArray(tstamp=data["tstamp"], open=data["open"], high=data["high"], low=data["low"],
+                                    close=data["close"], volume=data["volume"], subbars=subbars,
+                                    sub_offset=data["sub_offset"], sub_length=data["sub_length"])
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("ignoring broken bar cache %s: %s" % (path, str(e)))
+
+    bar_array = process_low_tf_bars(subbars, wanted_tf, start_offset_minutes)
+    try:
+        _write_atomic(path, lambda f: np.savez(f, key=np.array(key), tstamp=bar_array.tstamp,
+                                               open=bar_array.open, high=bar_array.high, low=bar_array.low,
+                                               close=bar_array.close, volume=bar_array.volume,
+                                               sub_offset=bar_array.sub_offset, sub_length=bar_array.sub_length))
+    except OSError as e:
+        logger.warning("could not write bar cache: " + str(e))
+    return bar_array
+
+
+def load_bars(days_in_history, wanted_tf, start_offset_minutes=0,exchange='bybit',symbol='BTCUSD', as_array=False,
+              cache=None):
+    '''
+    as_array=True returns a BarArray (columns + subbar ranges) instead of a list of Bar objects.
+    cache="mmap" reads the history through the binary cache (see convert_history_file), converting files on first use.
+    the aggregated bars are cached there as well, so repeated loads with the same tf/offset skip the aggregation
+    '''
     # empty symbol is legacy and means BTCUSD
     indices = _available_history_indices(exchange=exchange, symbol=symbol)
     if len(indices) == 0:
@@ -157,6 +341,16 @@ def load_bars(days_in_history, wanted_tf, start_offset_minutes=0,exchange='bybit
         files_needed = int(days_in_history * 1440 / 50000) + 2
         indices = indices[-max(1, files_needed):]
 
+    if cache == "mmap":
+        logger.info("loading " + str(len(indices)) + " cached history files from " + exchange)
+        records, source_key = _load_m1_records_cached(indices, days_in_history, exchange, symbol)
+        if records is not None:
+            bar_array = _aggregate_cached(records, source_key, wanted_tf, start_offset_minutes, exchange, symbol)
+            return bar_array if as_array else bar_array.to_bars()
+        logger.info("no binary cache for " + exchange + ", falling back to json")
+    elif cache is not None:
+        raise ValueError("unknown history cache: " + str(cache))
+
     m1_bars_temp = []
     logger.info("loading " + str(len(indices)) + " history files from " + exchange)
     for i in indices:
@@ -166,6 +360,18 @@ def load_bars(days_in_history, wanted_tf, start_offset_minutes=0,exchange='bybit
     start = int(max(0,len(m1_bars_temp)-(days_in_history * 1440)))
     m1_bars = m1_bars_temp[start:]
 
+    if as_array:
+        records = _m1_rows_to_records(m1_bars, exchange)
+        if records is not None:
+            return process_low_tf_bars(_records_to_bar_array(records), wanted_tf, start_offset_minutes)
+
+    # the exchange clients pull in their http/websocket libs, only the one of this history gets loaded
+    if exchange in ['bybit', 'bybit-linear']:
+        from kuegi_bot.exchanges.bybit.bybit_interface import ByBitInterface
+    elif exchange == 'phemex':
+        from kuegi_bot.exchanges.phemex.phemex_interface import PhemexInterface
+    elif exchange == 'bitfinex':
+        from kuegi_bot.exchanges.bitfinex.bitfinex_interface import BitfinexInterface
     subbars: List[Bar] = []
     for b in m1_bars:
         if exchange in ['bybit', 'bybit-linear']:
@@ -188,13 +394,15 @@ def load_bars(days_in_history, wanted_tf, start_offset_minutes=0,exchange='bybit
             sys.exit("exchange and/or symbol not found")
 
     subbars.reverse()
+    if as_array:
+        return process_low_tf_bars(BarArray.from_bars(subbars), wanted_tf, start_offset_minutes)
     return process_low_tf_bars(subbars, wanted_tf, start_offset_minutes)
 
 
 def prepare_plot(bars, indis: List[Indicator]):
     logger.info("calculating " + str(len(indis)) + " indicators on " + str(len(bars)) + " bars")
     for indi in indis:
-        indi.on_tick(bars)
+        indi.fill_history(bars)
 
     logger.info("running timelines")
     time = list(map(lambda b: datetime.fromtimestamp(b.tstamp), bars))
@@ -204,6 +412,7 @@ def prepare_plot(bars, indis: List[Indicator]):
     close = list(map(lambda b: b.close, bars))
 
     logger.info("creating plot")
+    go = graph_objects()
     fig = go.Figure(data=[go.Candlestick(x=time, open=open, high=high, low=low, close=close, name="XBTUSD")])
 
     logger.info("adding indicators")
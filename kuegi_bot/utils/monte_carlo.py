@@ -0,0 +1,82 @@
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from kuegi_bot.utils.trading_classes import PositionStatus
+
+# metrics added by monte_carlo_metrics, percentiles over all simulated runs
+MONTE_CARLO_METRICS = (
+    "mc_profit_pct_p5",
+    "mc_profit_pct_p50",
+    "mc_peak_dd_pct_p50",
+    "mc_peak_dd_pct_p95",
+    "mc_loss_prob",
+)
+
+# simulated runs per block, keeps the runs x trades matrices small for long trade lists
+CHUNK_CELLS = 2_000_000
+
+
+def trade_returns(position_history: list, initial_equity: float) -> np.ndarray:
+    '''
+    equity change of every closed trade (in exit order) as fraction of the equity before it.
+    the R of a trade is a price move, the equity change also carries position size, fees and funding.
+    '''
+    closed = [pos for pos in position_history
+              if pos.status == PositionStatus.CLOSED and pos.filled_entry is not None
+              and pos.filled_exit is not None and pos.max_filled_amount != 0]
+    closed.sort(key=lambda pos: pos.exit_tstamp or 0)
+    equity = np.array([float(initial_equity)] + [float(pos.exit_equity) for pos in closed])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        returns = np.where(equity[:-1] > 0, equity[1:] / equity[:-1] - 1, 0.0)
+    return returns
+
+
+def monte_carlo(returns: np.ndarray, runs: int = 10000, method: str = "bootstrap",
+                seed: Optional[int] = 0) -> Dict[str, float]:
+    '''
+    equity paths of the trade returns in random order. "bootstrap" draws the trades with replacement,
+    "shuffle" permutes them (same final equity, only the path and drawdown change).
+    drawdown in % of the previous high (negative). unlike max_drawdown_pct it doesn't grow with the equity, a loss
+    shuffled to the end of a profitable run would otherwise dominate the distribution.
+    '''
+    returns = np.asarray(returns, dtype=float)
+    n = len(returns)
+    if n == 0 or runs <= 0:
+        return {key: 0.0 for key in MONTE_CARLO_METRICS}
+    if method not in ("bootstrap", "shuffle"):
+        raise ValueError("unknown monte carlo method: %s" % method)
+    rng = np.random.default_rng(seed)
+    growth = np.log1p(np.maximum(returns, -0.999999))
+    profits: List[np.ndarray] = []
+    drawdowns: List[np.ndarray] = []
+    block = max(1, CHUNK_CELLS // n)
+    for start in range(0, runs, block):
+        count = min(block, runs - start)
+        if method == "bootstrap":
+            sample = growth[rng.integers(0, n, size=(count, n))]
+        else:
+            sample = rng.permuted(np.broadcast_to(growth, (count, n)), axis=1)
+        equity = np.exp(np.cumsum(sample, axis=1))
+        # paths are relative to the initial equity, which is also the first high
+        peak = np.maximum(np.maximum.accumulate(equity, axis=1), 1.0)
+        profits.append(equity[:, -1] - 1)
+        drawdowns.append((equity / peak - 1).min(axis=1).clip(max=0.0))
+    profit = 100.0 * np.concatenate(profits)
+    drawdown = 100.0 * np.concatenate(drawdowns)
+    p5, p50 = np.percentile(profit, [5, 50])
+    dd_p50, dd_p95 = np.percentile(drawdown, [50, 5])  # drawdown is negative, p95 of its size is the 5th pct
+    return {
+        "mc_profit_pct_p5": float(p5),
+        "mc_profit_pct_p50": float(p50),
+        "mc_peak_dd_pct_p50": float(dd_p50),
+        "mc_peak_dd_pct_p95": float(dd_p95),
+        "mc_loss_prob": float(np.mean(profit < 0)),
+    }
+
+
+def monte_carlo_metrics(backtest, runs: int = 10000, method: str = "bootstrap",
+                        seed: Optional[int] = 0) -> Dict[str, float]:
+    ''' monte_carlo on the closed trades of a finished BackTest '''
+    return monte_carlo(trade_returns(backtest.bot.position_history, backtest.initialEquity), runs=runs,
+                       method=method, seed=seed)
@@ -0,0 +1,167 @@
+import bisect
+import math
+from typing import Dict, List, Optional, Tuple
+
+from kuegi_bot.utils.trading_classes import Order
+
+
+class OrderBook:
+    ''' index of the open orders of a backtest.
+    lookup by order id plus four price-ordered buckets (stop buy/sell by trigger, limit buy/sell by limit) sorted by
+    sort_key and arrival. crossed(high, low) returns the orders a subbar can execute in execution order, without
+    sorting all open orders. market orders and triggered stop-limits are returned on every call.
+    account.open_orders stays the list the bots see, the book only mirrors it. '''
+    STOP_BUY = "stop_buy"
+    STOP_SELL = "stop_sell"
+    LIMIT_BUY = "limit_buy"
+    LIMIT_SELL = "limit_sell"
+    BUCKETS = (STOP_BUY, STOP_SELL, LIMIT_BUY, LIMIT_SELL)
+
+    # relative slack on the binary search thresholds, the exact check is done by the caller per order
+    THRESHOLD_SLACK = 1e-9
+
+    def __init__(self, ref_close: float, ref_open: float):
+        # reference bar for the sort key (newest bar of the backtest)
+        self.ref_close = ref_close
+        self.long_fac = 1 if ref_close > ref_open else 2
+        self.short_fac = 1 if ref_close < ref_open else 2
+        self._keys: Dict[str, List[Tuple[float, int]]] = {bucket: [] for bucket in self.BUCKETS}
+        self._orders: Dict[str, List[Order]] = {bucket: [] for bucket in self.BUCKETS}
+        self._always: Dict[int, Tuple[Tuple[float, int], Order]] = {}
+        self._entries: Dict[int, Tuple[Optional[str], Tuple[float, int]]] = {}
+        self._by_id: Dict[str, Order] = {}
+        self._seq = 0
+        # bumped on every change of the book, quiet_range is cached per version
+        self.version = 0
+        self._quiet_version = -1
+        self._quiet = None
+
+    def sort_key(self, order: Order) -> float:
+        if order.trigger_price is None and order.limit_price is None:
+            return 0
+        # sort buys after sells (higher number) when bar is falling
+        if order.trigger_price is not None:
+            if order.amount > 0:
+                return order.trigger_price
+            else:
+                return -order.trigger_price
+        else:  # limit -> bigger numbers to be sorted after the stops
+            if order.amount > 0:
+                return (self.ref_close + self.ref_close - order.limit_price) + self.ref_close * self.long_fac
+            else:
+                return order.limit_price + self.ref_close * self.short_fac
+
+    @staticmethod
+    def bucket_of(order: Order) -> Optional[str]:
+        if order.limit_price is None and order.trigger_price is None:
+            return None  # market: always a candidate
+        if order.trigger_price and not order.stop_triggered:
+            return OrderBook.STOP_BUY if order.amount > 0 else OrderBook.STOP_SELL
+        if order.trigger_price is None and order.limit_price is not None:
+            return OrderBook.LIMIT_BUY if order.amount > 0 else OrderBook.LIMIT_SELL
+        return None  # triggered stop-limits and odd states: checked on every subbar
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, order: Order):
+        return id(order) in self._entries
+
+    def get(self, order_id: str) -> Optional[Order]:
+        return self._by_id.get(order_id)
+
+    def add(self, order: Order, seq: Optional[int] = None):
+        ''' appends the order (new arrival) or re-inserts it with its old arrival seq '''
+        if seq is None:
+            seq = self._seq
+            self._seq += 1
+        key = (self.sort_key(order), seq)
+        bucket = self.bucket_of(order)
+        if bucket is None:
+            self._always[id(order)] = (key, order)
+        else:
+            idx = bisect.bisect_left(self._keys[bucket], key)
+            self._keys[bucket].insert(idx, key)
+            self._orders[bucket].insert(idx, order)
+        self._entries[id(order)] = (bucket, key)
+        self._by_id[order.id] = order
+        self.version += 1
+
+    def remove(self, order: Order) -> Optional[int]:
+        ''' returns the arrival seq of the removed order, None if it was not in the book '''
+        entry = self._entries.pop(id(order), None)
+        if entry is None:
+            return None
+        bucket, key = entry
+        if bucket is None:
+            del self._always[id(order)]
+        else:
+            idx = bisect.bisect_left(self._keys[bucket], key)
+            del self._keys[bucket][idx]
+            del self._orders[bucket][idx]
+        if self._by_id.get(order.id) is order:
+            del self._by_id[order.id]
+        self.version += 1
+        return key[1]
+
+    def refresh(self, order: Order):
+        ''' state or price of the order changed, keeps its arrival position '''
+        seq = self.remove(order)
+        if seq is not None:
+            self.add(order, seq)
+
+    def matches(self, open_orders: List[Order]) -> bool:
+        return len(self._entries) == len(open_orders) and all(id(order) in self._entries for order in open_orders)
+
+    def rebuild(self, open_orders: List[Order]):
+        self.version += 1
+        for bucket in self.BUCKETS:
+            self._keys[bucket].clear()
+            self._orders[bucket].clear()
+        self._always.clear()
+        self._entries.clear()
+        self._by_id.clear()
+        for order in open_orders:
+            self.add(order)
+
+    def quiet_range(self) -> Optional[Tuple[float, float]]:
+        ''' (lower, upper): a subbar with lower < low and high < upper can't execute any order of the book.
+        None if there are orders that need a check on every subbar (market, triggered stop-limit).
+        cached until the book changes, prices must be changed via refresh (or remove + add) '''
+        if self._quiet_version != self.version:
+            self._quiet = self._calc_quiet_range()
+            self._quiet_version = self.version
+        return self._quiet
+
+    def _calc_quiet_range(self) -> Optional[Tuple[float, float]]:
+        if len(self._always) > 0:
+            return None
+        upper = math.inf
+        lower = -math.inf
+        for order in self._orders[self.STOP_BUY]:
+            upper = min(upper, order.trigger_price)
+        for order in self._orders[self.LIMIT_SELL]:
+            upper = min(upper, order.limit_price)
+        for order in self._orders[self.STOP_SELL]:
+            lower = max(lower, order.trigger_price)
+        for order in self._orders[self.LIMIT_BUY]:
+            lower = max(lower, order.limit_price)
+        return lower, upper
+
+    def _below(self, bucket: str, threshold: float):
+        keys = self._keys[bucket]
+        end = bisect.bisect_left(keys, (threshold, -1))
+        return zip(keys[:end], self._orders[bucket][:end])
+
+    def crossed(self, high: float, low: float) -> List[Order]:
+        ''' all orders the range low..high might execute, ordered like sorted(open_orders, key=sort_key) '''
+        slack = self.THRESHOLD_SLACK * (abs(high) + abs(self.ref_close) * 3)
+        close = self.ref_close
+        result = list(self._always.values())
+        result.extend(self._below(self.STOP_BUY, high + slack))
+        result.extend(self._below(self.STOP_SELL, -low + slack))
+        result.extend(self._below(self.LIMIT_BUY, close + close - low + close * self.long_fac + slack))
+        result.extend(self._below(self.LIMIT_SELL, high + close * self.short_fac + slack))
+        if len(result) > 1:
+            result.sort(key=lambda entry: entry[0])
+        return [order for _key, order in result]
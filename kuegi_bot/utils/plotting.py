@@ -2,11 +2,68 @@
 
 from __future__ import annotations
 
+import importlib
 from datetime import datetime
-from typing import Dict, List, Optional
+from typing import TYPE_CHECKING, Dict, List, Optional, Sequence, Tuple
 
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
+import numpy as np
+
+if TYPE_CHECKING:
+    import plotly.graph_objects as go
+
+# points per series a figure gets at most, more than a screen can show anyway
+DEFAULT_MAX_POINTS = 4000
+
+
+def graph_objects():
+    """plotly.graph_objects, imported on first use so plotly is only loaded when something gets plotted"""
+    return importlib.import_module("plotly.graph_objects")
+
+
+def bucket_starts(n: int, max_points: int = DEFAULT_MAX_POINTS) -> np.ndarray:
+    """
+    First row of each display bucket: every row if n fits into max_points, otherwise n split into
+    equally sized buckets so that 4 points per bucket (first, min, max, last) stay within max_points.
+    """
+    if max_points is None or max_points <= 0 or n <= max_points:
+        return np.arange(n)
+    size = int(np.ceil(n / max(1, max_points // 4)))
+    return np.arange(0, n, size)
+
+
+def decimate_ohlc(
+    open_: np.ndarray,
+    high: np.ndarray,
+    low: np.ndarray,
+    close: np.ndarray,
+    starts: np.ndarray,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """candles merged per bucket (rows in time order): first open, highest high, lowest low, last close"""
+    if len(starts) == len(open_):
+        return open_, high, low, close
+    ends = np.append(starts[1:], len(open_)) - 1
+    return open_[starts], np.maximum.reduceat(high, starts), np.minimum.reduceat(low, starts), close[ends]
+
+
+def decimate_lines(series: Sequence[np.ndarray], starts: np.ndarray) -> np.ndarray:
+    """
+    rows to plot for line series of the same length: first, last, min and max row of every bucket of every
+    series, so no peak or drawdown gets lost. nan rows are ignored.
+    """
+    n = len(series[0]) if len(series) > 0 else 0
+    if len(starts) == n:
+        return np.arange(n)
+    size = int(starts[1] - starts[0]) if len(starts) > 1 else n
+    keep = [starts, np.minimum(starts + size, n) - 1]
+    for values in series:
+        values = np.asarray(values, dtype=float)
+        padded = np.full(len(starts) * size, np.nan)
+        padded[:n] = values
+        padded = padded.reshape(len(starts), size)
+        missing = np.isnan(padded)
+        keep.append(starts + np.argmin(np.where(missing, np.inf, padded), axis=1))
+        keep.append(starts + np.argmax(np.where(missing, -np.inf, padded), axis=1))
+    return np.unique(np.minimum(np.concatenate(keep), n - 1))
 
 
 def plot_price_with_funding(
@@ -24,6 +81,9 @@ def plot_price_with_funding(
     bars: list of bar objects (must have .tstamp, .open, .high, .low, .close)
     funding: dict {unix_seconds -> funding_rate}; keys may be int or str
     """
+    from plotly.subplots import make_subplots
+
+    go = graph_objects()
 
     if not bars:
         raise ValueError("bars is empty; cannot determine plotting range.")
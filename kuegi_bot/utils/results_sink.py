@@ -0,0 +1,130 @@
+import json
+import math
+import re
+import sqlite3
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from kuegi_bot.utils.trading_classes import Position
+
+TRADE_COLUMNS = ("trial_id", "position_id", "status", "signal_tstamp", "amount", "wanted_entry", "initial_stop",
+                 "entry_tstamp", "filled_entry", "exit_tstamp", "filled_exit", "exit_equity")
+
+
+def trade_rows(bt) -> List[Tuple]:
+    ''' closed and still open positions of a finished BackTest, columns TRADE_COLUMNS without trial_id '''
+    rows = []
+    for position in list(bt.bot.position_history) + list(bt.bot.open_positions.values()):
+        rows.append(_position_row(position))
+    return rows
+
+
+def _position_row(position: Position) -> Tuple:
+    return (str(position.id), position.status.value, position.signal_tstamp, position.max_filled_amount,
+            position.wanted_entry, position.initial_stop, position.entry_tstamp, position.filled_entry, position.exit_tstamp,
+            position.filled_exit, position.exit_equity)
+
+
+class ResultsSink:
+    '''
+    append-only results of many backtests in one sqlite file. one row per trial in "trials" (tags and metrics as own
+    columns, added when they first show up, params as json) and optionally its positions in "trades".
+    rows are buffered and written batch_size at a time in one transaction, close() writes the rest.
+    several sinks (also in other processes) can append to the same file: sqlite assigns the trial_id and the columns
+    are re-read inside the write transaction. readers can query it while it is written (wal mode):
+        select label, profit_pct, max_drawdown_pct from trials where stage like 'stage2%' order by profit_pct desc
+    '''
+
+    def __init__(self, path: str, batch_size: int = 500, timeout: float = 60.0):
+        self.path = str(path)
+        self.batch_size = max(1, int(batch_size))
+        # timeout: how long a flush waits for another writer on the same file
+        self.connection = sqlite3.connect(self.path, timeout=timeout)
+        self.connection.execute("pragma journal_mode=wal")
+        self.connection.execute("pragma synchronous=normal")
+        self.connection.execute("create table if not exists trials (trial_id integer primary key, created text, "
+                                "params text)")
+        self.connection.execute("create table if not exists trades (%s)" % ", ".join(
+            column + (" integer" if column == "trial_id" else "") for column in TRADE_COLUMNS))
+        self.connection.execute("create index if not exists trades_trial on trades (trial_id)")
+        self.connection.commit()
+        self._trials: List[Dict[str, Any]] = []
+        # trade rows (without trial_id) of each buffered trial
+        self._trades: List[List[Tuple]] = []
+
+    def add(self, metrics: Optional[Dict[str, Any]], params: Optional[Dict[str, Any]] = None,
+            trades: Optional[List[Tuple]] = None, **tags):
+        ''' buffers one trial, tags like run_name, stage, label become columns too '''
+        row = {"created": datetime.utcnow().isoformat() + "Z",
+               "params": json.dumps(params, sort_keys=True, default=str) if params is not None else None}
+        for key, value in list(tags.items()) + list((metrics or {}).items()):
+            row[_column_name(key)] = _sql_value(value)
+        self._trials.append(row)
+        self._trades.append([tuple(_sql_value(value) for value in trade) for trade in trades or []])
+        if len(self._trials) >= self.batch_size:
+            self.flush()
+
+    def add_backtest(self, bt, params: Optional[Dict[str, Any]] = None, with_trades: bool = True, **tags):
+        self.add(bt.metrics if isinstance(getattr(bt, "metrics", None), dict) else {}, params=params,
+                 trades=trade_rows(bt) if with_trades else None, **tags)
+
+    def flush(self):
+        if len(self._trials) == 0:
+            return
+        connection = self.connection
+        # immediate: takes the write lock before the columns are read, so no other writer can add them in between
+        connection.execute("begin immediate")
+        try:
+            columns = {row[1] for row in connection.execute("pragma table_info(trials)")}
+            new_columns: Dict[str, str] = {}
+            for row in self._trials:
+                for key, value in row.items():
+                    if key not in columns and new_columns.get(key) != "real":
+                        new_columns[key] = "real" if isinstance(value, float) else ""
+            for key, kind in new_columns.items():
+                connection.execute('alter table trials add column "%s" %s' % (key, kind))
+            trades = []
+            for row, row_trades in zip(self._trials, self._trades):
+                cursor = connection.execute(
+                    'insert into trials (%s) values (%s)' % (", ".join('"%s"' % key for key in row.keys()),
+                                                            ", ".join("?" * len(row))), tuple(row.values()))
+                trades.extend((cursor.lastrowid,) + trade for trade in row_trades)
+            if len(trades) > 0:
+                connection.executemany("insert into trades values (%s)" % ", ".join("?" * len(TRADE_COLUMNS)),
+                                       trades)
+            connection.commit()
+        except BaseException:
+            connection.rollback()
+            raise
+        self._trials = []
+        self._trades = []
+
+    def close(self):
+        if self.connection is None:
+            return
+        self.flush()
+        self.connection.close()
+        self.connection = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def _column_name(key: str) -> str:
+    name = re.sub(r"[^0-9a-zA-Z_]", "_", str(key))
+    return name if not name[:1].isdigit() else "_" + name
+
+
+def _sql_value(value: Any) -> Any:
+    if value is None or isinstance(value, (str, int)):
+        return value
+    if isinstance(value, float):
+        return None if math.isnan(value) else value
+    if hasattr(value, "item"):  # numpy scalars
+        return _sql_value(value.item())
+    if isinstance(value, (dict, list, tuple)):
+        return json.dumps(value, sort_keys=True, default=str)
+    return str(value)
@@ -0,0 +1,101 @@
+import sys
+from multiprocessing import resource_tracker, shared_memory
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from kuegi_bot.utils.bar_array import BarArray
+
+_SUB_PREFIX = "sub_"
+
+
+def _attach_untracked(name: str) -> shared_memory.SharedMemory:
+    # only the publishing process owns the block. before 3.13 attaching registers it with the resource tracker too,
+    # a worker with its own tracker then unlinks it at exit (and warns about a leak). unregistering afterwards
+    # is no option: spawned workers share the tracker of the parent and would drop its registration
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    register = resource_tracker.register
+    resource_tracker.register = lambda *args: None
+    try:
+        return shared_memory.SharedMemory(name=name)
+    finally:
+        resource_tracker.register = register
+
+
+class SharedBarDataset:
+    ''' bars (BarArray incl. subbars), funding and open interest published once in a shared memory block.
+    the parent creates it with publish(), worker processes attach() with the picklable descriptor and get
+    read-only numpy views on the same memory instead of loading/copying the history themselves. '''
+
+    def __init__(self, shm: shared_memory.SharedMemory, fields: List[Tuple[str, str, int, int]], owner: bool):
+        self.shm = shm
+        self.fields = fields
+        self.owner = owner
+        self.columns: Dict[str, np.ndarray] = {}
+        for name, dtype, length, offset in fields:
+            column = np.ndarray((length,), dtype=np.dtype(dtype), buffer=shm.buf, offset=offset)
+            if not owner:
+                column.flags.writeable = False
+            self.columns[name] = column
+
+    @staticmethod
+    def publish(bars: BarArray, funding: Optional[Dict[int, float]] = None,
+                open_interest: Optional[Dict[int, float]] = None) -> 'SharedBarDataset':
+        arrays: Dict[str, np.ndarray] = {}
+        for col in BarArray.COLUMNS:
+            arrays[col] = getattr(bars, col)
+        if bars.subbars is not None:
+            arrays["sub_offset"] = bars.sub_offset
+            arrays["sub_length"] = bars.sub_length
+            for col in BarArray.COLUMNS:
+                arrays[_SUB_PREFIX + col] = getattr(bars.subbars, col)
+        for prefix, series in (("funding", funding), ("open_interest", open_interest)):
+            if series is not None:
+                keys = sorted(series.keys())
+                arrays[prefix + "_tstamp"] = np.array(keys, dtype=np.int64)
+                arrays[prefix + "_value"] = np.array([series[k] for k in keys], dtype=float)
+
+        fields: List[Tuple[str, str, int, int]] = []
+        offset = 0
+        for name, array in arrays.items():
+            fields.append((name, array.dtype.str, len(array), offset))
+            offset += -(-array.nbytes // 8) * 8  # keep every column 8 byte aligned
+        shm = shared_memory.SharedMemory(create=True, size=max(8, offset))
+        dataset = SharedBarDataset(shm, fields, owner=True)
+        for name, array in arrays.items():
+            dataset.columns[name][:] = array
+        return dataset
+
+    @staticmethod
+    def attach(descriptor: dict) -> 'SharedBarDataset':
+        return SharedBarDataset(_attach_untracked(descriptor["name"]),
+                                [tuple(field) for field in descriptor["fields"]], owner=False)
+
+    def descriptor(self) -> dict:
+        return {"name": self.shm.name, "fields": [list(field) for field in self.fields]}
+
+    def bar_array(self) -> BarArray:
+        cols = self.columns
+        subbars = None
+        if "sub_offset" in cols:
+            subbars = BarArray(*(cols[_SUB_PREFIX + col] for col in BarArray.COLUMNS))
+        return BarArray(*(cols[col] for col in BarArray.COLUMNS), subbars=subbars,
+                        sub_offset=cols.get("sub_offset"), sub_length=cols.get("sub_length"))
+
+    def _series(self, prefix: str) -> Optional[Dict[int, float]]:
+        if prefix + "_tstamp" not in self.columns:
+            return None
+        return dict(zip(self.columns[prefix + "_tstamp"].tolist(), self.columns[prefix + "_value"].tolist()))
+
+    def funding(self) -> Optional[Dict[int, float]]:
+        return self._series("funding")
+
+    def open_interest(self) -> Optional[Dict[int, float]]:
+        return self._series("open_interest")
+
+    def close(self):
+        self.columns = {}
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
@@ -62,10 +62,82 @@ class Bar:
         self.low = min(self.low, subbar.low)
         self.close = subbar.close
         self.volume += subbar.volume
+        self.buyVolume += subbar.buyVolume
+        self.sellVolume += subbar.sellVolume
         self.subbars.insert(0, subbar)
         self.last_tick_tstamp = max(self.last_tick_tstamp, subbar.last_tick_tstamp)
         self.did_change = True
 
+    def add_subbars(self, subbars):
+        ''' same as add_subbar for each of the subbars (oldest first) '''
+        if self.close is None or any(subbar is None or subbar.close is None for subbar in subbars):
+            for subbar in subbars:
+                self.add_subbar(subbar)
+            return
+        if len(subbars) == 0:
+            return
+        self.high = max(self.high, max(subbar.high for subbar in subbars))
+        self.low = min(self.low, min(subbar.low for subbar in subbars))
+        self.close = subbars[-1].close
+        volume = self.volume
+        buy_volume = self.buyVolume
+        sell_volume = self.sellVolume
+        for subbar in subbars:
+            volume += subbar.volume  # same summation order as add_subbar
+            buy_volume += subbar.buyVolume
+            sell_volume += subbar.sellVolume
+        self.volume = volume
+        self.buyVolume = buy_volume
+        self.sellVolume = sell_volume
+        self.subbars[0:0] = reversed(subbars)
+        self.last_tick_tstamp = max(self.last_tick_tstamp, max(subbar.last_tick_tstamp for subbar in subbars))
+        self.did_change = True
+
+
+class BarWindow:
+    ''' read-only view on bars[start:stop] of a list of bars ordered newest bar = index 0.
+    slicing returns another view, so indicators that walk through the history never copy the list. '''
+    __slots__ = ("_bars", "_start", "_stop")
+
+    def __init__(self, bars: List[Bar], start: int = 0, stop: int = None):
+        self._bars = bars
+        self._start = start
+        self._stop = len(bars) if stop is None else stop
+
+    @staticmethod
+    def of(bars) -> 'BarWindow':
+        if isinstance(bars, BarWindow):
+            return bars
+        return BarWindow(bars)
+
+    def __len__(self):
+        return self._stop - self._start
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            start, stop, step = idx.indices(self._stop - self._start)
+            if step != 1:
+                return [self._bars[self._start + i] for i in range(start, stop, step)]
+            return BarWindow(self._bars, self._start + start, self._start + max(start, stop))
+        if idx < 0:
+            idx += self._stop - self._start
+        if idx < 0 or idx >= self._stop - self._start:
+            raise IndexError("bar index out of range")
+        return self._bars[self._start + idx]
+
+    def __iter__(self):
+        bars = self._bars
+        for idx in range(self._start, self._stop):
+            yield bars[idx]
+
+    def __reversed__(self):
+        bars = self._bars
+        for idx in range(self._stop - 1, self._start - 1, -1):
+            yield bars[idx]
+
+    def __repr__(self):
+        return "BarWindow(%i bars, start=%i)" % (len(self), self._start)
+
 
 class Account:
     def __init__(self):
@@ -272,7 +344,10 @@ def parse_utc_timestamp(timestamp: str) -> float:
 
 
 def process_low_tf_bars(subbars: List[Bar], timeframe_minutes, start_offset_minutes=0):
-    ''' subbars need to be ordered newest bar = index 0 '''
+    ''' subbars need to be ordered newest bar = index 0. a BarArray is aggregated vectorized into a BarArray '''
+    from kuegi_bot.utils.bar_array import BarArray
+    if isinstance(subbars, BarArray):
+        return subbars.aggregate(timeframe_minutes, start_offset_minutes)
     result: list = []
     if len(subbars) > 1 and subbars[0].tstamp < subbars[-1].tstamp:
         print("Had to order subbars before processing them!")
@@ -286,6 +361,8 @@ def process_low_tf_bars(subbars: List[Bar], timeframe_minutes, start_offset_minu
             # create new bar
             result.append(Bar(tstamp=bar_start, open=bar.open, high=bar.high, low=bar.low, close=bar.close,
                               volume=bar.volume, subbars=[bar]))
+            result[-1].buyVolume = bar.buyVolume
+            result[-1].sellVolume = bar.sellVolume
 
     # sort subbars
     for bar in result: